@@ -3,8 +3,13 @@ import numpy as np
 from PyQt5.QtCore import QThread, pyqtSignal
 import config
 import logging
+import threading
 import face_processor
+import metrics
 from time import time
+from async_pipeline import AsyncFramePipeline, PipelineSink
+from video_index import FrameSeeker
+from recognition_timeline import TimelineCursor, build_timeline, file_hash, load_timeline
 
 
 class VideoThread(QThread):
@@ -30,8 +35,12 @@ class VideoThread(QThread):
         self.prev_frame = None
         # Kết nối tín hiệu mới này với tín hiệu cũ để không phải sửa gui2.py
         self.processing_in_progress = False # Thêm cờ để tránh gửi quá nhiều yêu cầu
-        self.last_seek_time = 0
-        self.seek_debounce_interval = 0.5  # 0.5 giây giữa các yêu cầu tua
+        # Tua được thực hiện trên luồng video; các yêu cầu dồn dập chỉ giữ vị trí cuối cùng
+        self.seeker = None
+        self._seek_target = None
+        self._wake = threading.Event()
+        # Dòng thời gian nhận diện tính trước (nếu có): kết quả được tra thay vì nhận diện lại
+        self.timeline_cursor = None
         # Thêm biến để đo FPS
         self.fps_start_time = time()
         self.fps_frame_count = 0
@@ -99,20 +108,31 @@ class VideoThread(QThread):
         video_w = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         video_h = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         self.needs_rotation = video_h > video_w
+        if isinstance(self.input_source, str):
+            self.seeker = FrameSeeker(self.cap)
+        else:
+            self.seeker = FrameSeeker(self.cap, cache_size=0)
         #logging.debug(f"Khởi tạo video: {video_w}x{video_h}, total frames: {self.total_frames}")
 
         last_gui_update = 0
         gui_update_interval = 1.0 / 30  # 30 FPS
         while self._run_flag:
             while self._is_paused and self._run_flag:
-                self.msleep(50)
+                self._wake.clear()
+                if self._seek_target is not None:
+                    self._perform_seek()
+                self._wake.wait(0.05)
                 continue
-            
-            ret, cv_img = self.cap.read()
+            if self._seek_target is not None:
+                self._perform_seek()
+                continue
+
+            with metrics.timer("capture"):
+                ret, cv_img = self.seeker.read()
             if not ret:
                 if isinstance(self.input_source, str):  # Nếu là video file
                     logging.info("Đã phát hết video, tua về đầu và tạm dừng.")
-                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    self.seeker.set_position(0)
                     self.frame_count = 0
                     self._is_paused = True
                     continue  # Không break, mà tiếp tục vòng lặp với trạng thái pause
@@ -131,13 +151,27 @@ class VideoThread(QThread):
             elapsed_time = current_time - self.fps_start_time
             if elapsed_time >= 1.0:
                 fps = self.fps_frame_count / elapsed_time
+                metrics.REGISTRY.gauge("fps", "Số khung hình đọc được mỗi giây").set(fps)
                 self.fps_signal.emit(fps)
                 self.fps_frame_count = 0
                 self.fps_start_time = current_time
 
+            if self.timeline_cursor is not None:
+                self._emit_timeline_results()
+                self.progress_signal.emit(self.frame_count, self.total_frames)
+                self.frame_count += 1
+                self.msleep(10)
+                continue
+
             # KIỂM TRA ĐIỀU KIỆN XỬ LÝ
             should_process = (self.frame_count % config.SKIP_FRAMES == 0) or self.detect_motion(cv_img)
 
+            # Đếm khung hình bị bỏ qua (không cần xử lý) và bị rơi (cần xử lý nhưng đang bận)
+            if not should_process:
+                metrics.inc("frames_skipped")
+            elif self.processing_in_progress:
+                metrics.inc("frames_dropped")
+
             # CHỈ GỬI YÊU CẦU NẾU KHÔNG CÓ YÊU CẦU NÀO ĐANG CHỜ
             if should_process and not self.processing_in_progress:
                 self.processing_in_progress = True
@@ -159,6 +193,15 @@ class VideoThread(QThread):
         self.cleanup()
         self.finished_signal.emit()
 
+    def set_timeline(self, timeline):
+        """Dùng dòng thời gian đã tính cho video này (None để quay lại nhận diện trực tiếp)."""
+        self.timeline_cursor = TimelineCursor(timeline) if timeline is not None else None
+
+    def _emit_timeline_results(self):
+        results = self.timeline_cursor.results_if_changed(self.frame_count)
+        if results is not None:
+            self.update_results_signal.emit(results)
+
     def on_recognition_complete(self, results):
             """Callback được gọi khi xử lý khuôn mặt hoàn tất."""
             self.update_results_signal.emit(results)
@@ -167,28 +210,31 @@ class VideoThread(QThread):
     def toggle_pause(self):
         """Bật/tắt trạng thái tạm dừng."""
         self._is_paused = not self._is_paused
+        self._wake.set()
 
     def seek_to_frame(self, frame_number):
         """
-        Tua đến frame được chỉ định, hiển thị và gửi yêu cầu nhận diện cho frame đó.
+        Yêu cầu tua đến frame được chỉ định. Việc tua diễn ra trên luồng video (không tranh chấp cap
+        với vòng lặp đọc); các yêu cầu đến dồn dập khi kéo thanh tua được gộp, chỉ vị trí cuối được thực hiện.
         """
-        start_time = time()
         if not self.cap or not self.cap.isOpened():
             logging.error("VideoCapture không khả dụng để tua frame.")
             self.error_signal.emit("Không thể tua video: VideoCapture không khả dụng.")
             return
+        self._seek_target = frame_number
+        self._wake.set()
 
-        current_time = time()
-        if current_time - self.last_seek_time < self.seek_debounce_interval:
-            return  # Bỏ qua nếu tua quá nhanh
-
+    def _perform_seek(self):
+        """
+        Tua đến frame đang chờ, hiển thị và gửi yêu cầu nhận diện cho frame đó.
+        """
+        start_time = time()
+        frame_number, self._seek_target = self._seek_target, None
         try:
-            self.last_seek_time = current_time
             self.frame_count = max(0, min(frame_number, self.total_frames - 1))
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.frame_count)
 
-            # Đọc frame ngay sau khi tua
-            ret, frame = self.cap.read()
+            # Đọc frame tại vị trí tua (lấy từ cache, giải mã tiến hoặc cap.set)
+            ret, frame = self.seeker.read_at(self.frame_count)
             if ret:
                 if self.needs_rotation:
                     frame = cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
@@ -197,7 +243,10 @@ class VideoThread(QThread):
                 self.change_pixmap_signal.emit(frame)
 
                 # ✨ Gửi nhận diện khuôn mặt nếu chưa có tác vụ đang chạy
-                if not self.processing_in_progress:
+                if self.timeline_cursor is not None:
+                    self.timeline_cursor.reset()
+                    self._emit_timeline_results()
+                elif not self.processing_in_progress:
                     self.processing_in_progress = True
                     self.face_processor.submit_face_recognition_task(
                         frame.copy(), self.known_students, self.on_recognition_complete
@@ -205,6 +254,7 @@ class VideoThread(QThread):
 
                 # ✨ Cập nhật tiến độ
                 self.progress_signal.emit(self.frame_count, self.total_frames)
+                self.frame_count += 1
             else:
                 logging.warning(f"Không thể đọc frame {self.frame_count} sau khi tua.")
 
@@ -218,8 +268,159 @@ class VideoThread(QThread):
         finally:
             end_time = time()
             response_time = (end_time - start_time) * 1000  # Chuyển sang ms
+            metrics.REGISTRY.histogram("seek").record(response_time)
             logging.info(f"Thời gian phản hồi khi tua video: {response_time:.2f} ms")
 
 
     def stop(self):
-        self._run_flag = False
\ No newline at end of file
+        self._run_flag = False
+        self._wake.set()
+
+class _SignalSink(PipelineSink):
+    """Chuyển các sự kiện của AsyncFramePipeline thành tín hiệu Qt của AsyncVideoThread."""
+    def __init__(self, thread):
+        self.thread = thread
+
+    def on_frame(self, frame):
+        self.thread.change_pixmap_signal.emit(frame)
+
+    def on_results(self, results):
+        self.thread.update_results_signal.emit(results)
+
+    def on_progress(self, current, total):
+        self.thread.progress_signal.emit(current, total)
+
+    def on_fps(self, fps):
+        self.thread.fps_signal.emit(fps)
+
+    def on_error(self, message):
+        self.thread.error_signal.emit(message)
+
+
+class AsyncVideoThread(QThread):
+    """
+    Cùng giao diện và tín hiệu với VideoThread nhưng chạy AsyncFramePipeline (asyncio) bên trong:
+    không ngủ cố định giữa các khung hình, tạm dừng/tua đánh thức vòng lặp ngay lập tức.
+    """
+    change_pixmap_signal = pyqtSignal(np.ndarray)
+    update_results_signal = pyqtSignal(list)
+    finished_signal = pyqtSignal()
+    progress_signal = pyqtSignal(int, int)
+    error_signal = pyqtSignal(str)
+    fps_signal = pyqtSignal(float)
+
+    def __init__(self, input_source, known_students, face_processor, parent=None):
+        super().__init__(parent)
+        self.input_source = input_source
+        self.known_students = known_students
+        self.face_processor = face_processor
+        # File video phát theo FPS gốc như VideoThread; không thì giải mã chạy đua đến hết và phần lớn khung bị bỏ
+        self.pipeline = AsyncFramePipeline(input_source, face_processor, known_students,
+                                           sink=_SignalSink(self), realtime=isinstance(input_source, str))
+
+    @property
+    def cap(self):
+        return self.pipeline.cap
+
+    @property
+    def total_frames(self):
+        return self.pipeline.total_frames
+
+    @property
+    def frame_count(self):
+        return self.pipeline.frame_count
+
+    @property
+    def _is_paused(self):
+        return self.pipeline.paused
+
+    @_is_paused.setter
+    def _is_paused(self, paused):
+        # gui2.py gán trực tiếp thuộc tính này như với VideoThread
+        if paused:
+            self.pipeline.pause()
+        else:
+            self.pipeline.resume()
+
+    def set_timeline(self, timeline):
+        self.pipeline.set_timeline(timeline)
+
+    def run(self):
+        try:
+            self.pipeline.run()
+        except Exception as e:
+            logging.exception("Lỗi trong pipeline video")
+            self.error_signal.emit(f"Lỗi pipeline video: {str(e)}")
+        self.finished_signal.emit()
+
+    def toggle_pause(self):
+        self._is_paused = not self._is_paused
+
+    def seek_to_frame(self, frame_number):
+        self.pipeline.request_seek(frame_number)
+
+    def stop(self):
+        self.pipeline.stop()
+
+
+def create_video_thread(input_source, known_students, face_processor, parent=None):
+    """Tạo luồng video theo config.VIDEO_PIPELINE ("async" hoặc "qthread")."""
+    thread_class = AsyncVideoThread if config.VIDEO_PIPELINE == "async" else VideoThread
+    return thread_class(input_source=input_source, known_students=known_students,
+                        face_processor=face_processor, parent=parent)
+
+
+class TimelineThread(QThread):
+    """Nạp dòng thời gian nhận diện của video từ file đã lưu, hoặc tính mới ở nền nếu chưa có."""
+    ready_signal = pyqtSignal(str, object)    # (đường dẫn video, RecognitionTimeline)
+    progress_signal = pyqtSignal(int, int)
+
+    def __init__(self, video_path, face_processor, parent=None):
+        super().__init__(parent)
+        self.video_path = video_path
+        self.face_processor = face_processor
+        self._run_flag = True
+
+    def run(self):
+        try:
+            video_hash = file_hash(self.video_path)
+            timeline = load_timeline(self.video_path, video_hash)
+            if timeline is None:
+                logging.info(f"Đang tính dòng thời gian nhận diện cho {self.video_path}...")
+                timeline = build_timeline(self.video_path, self.face_processor,
+                                          progress=self.progress_signal.emit,
+                                          should_stop=lambda: not self._run_flag,
+                                          video_hash=video_hash)
+            if timeline is not None and self._run_flag:
+                self.ready_signal.emit(self.video_path, timeline)
+        except Exception:
+            logging.exception("Lỗi khi tính dòng thời gian nhận diện")
+
+    def stop(self):
+        self._run_flag = False
+
+
+class EmbeddingMigrationThread(QThread):
+    """
+    Bước chạy nền của EmbeddingMigration (tính embedding mới, chỉ mục cũ vẫn phục vụ nhận diện).
+    ready_signal phát khi tính xong; commit() do luồng GUI gọi.
+    """
+    ready_signal = pyqtSignal(object)         # EmbeddingMigration
+    progress_signal = pyqtSignal(int, int)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, migration, parent=None):
+        super().__init__(parent)
+        self.migration = migration
+        self.migration.progress = self.progress_signal.emit
+
+    def run(self):
+        try:
+            if self.migration.run():
+                self.ready_signal.emit(self.migration)
+        except Exception as e:
+            logging.exception("Lỗi khi mã hóa lại dữ liệu khuôn mặt")
+            self.error_signal.emit(str(e))
+
+    def stop(self):
+        self.migration.stop()
@@ -4,13 +4,14 @@ from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QLineEdit, QPushButton, QFile
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtCore import Qt
 import cv2
-import os
 from datetime import datetime
-import database_manager as db
+from image_store import ImageStore
 
 class AddStudentDialog(QDialog):
-    def __init__(self, frame=None, face_encoding=None, existing_data=None, parent=None):
+    def __init__(self, frame=None, face_encoding=None, existing_data=None, parent=None, image_store=None):
         super().__init__(parent)
+        # Ảnh đăng ký được ghi/đọc qua ImageStore (ghi nguyên tử, giải mã có cache)
+        self.image_store = image_store or ImageStore()
         if existing_data:
             self.setWindowTitle("Sửa thông tin học sinh")
         else:
@@ -92,7 +93,7 @@ class AddStudentDialog(QDialog):
             self.browse_button.setVisible(False)
         else:
             self.image_path = existing_data.get("image_path") if existing_data else None
-            if self.image_path and os.path.exists(self.image_path):
+            if self.image_store.exists(self.image_path):
                 self.display_image_from_path(self.image_path)
             self.browse_button.setVisible(True)
 
@@ -118,7 +119,7 @@ class AddStudentDialog(QDialog):
             self.gender_input.setCurrentIndex(gender_index)
 
         # Hiển thị ảnh nếu có đường dẫn hợp lệ
-        if self.image_path and os.path.exists(self.image_path):
+        if self.image_store.exists(self.image_path):
             self.display_image_from_path(self.image_path)
 
     def format_dob_input(self, text):
@@ -166,22 +167,10 @@ class AddStudentDialog(QDialog):
             QMessageBox.warning(self, "Lỗi", "Không thể mở ảnh đã chọn.")
             return
         
-        scaled_image = cv2.resize(capture_img, (320, 320))
         code = self.code_input.text().strip()
-        filename = f"{code}.jpg"
-        # Lấy thư mục dự án (hoặc thư mục chứa DB)
-        base_dir = os.path.dirname(db.get_db_path())
-
-        # Nếu muốn lưu trong thư mục con "images"
-        images_dir = os.path.join(base_dir, "images")
-
-        # Tạo đường dẫn ảnh đầy đủ
-        image_path = os.path.join(images_dir, filename)
-
-        if scaled_image is not None:
-            os.remove(image_path)
-            cv2.imwrite(image_path, scaled_image)
-        self.display_image_from_array(scaled_image)
+        # Ghi đè nguyên tử ảnh cũ (kể cả khi ảnh cũ đã bị xóa khỏi images/)
+        self.image_path = self.image_store.save(code, capture_img)
+        self.display_image_from_array(self.image_store.load(self.image_path))
         self.new_image = capture_img
 
     def display_image_from_array(self, img):
@@ -197,8 +186,8 @@ class AddStudentDialog(QDialog):
         self.image_label.setPixmap(pixmap)
 
     def display_image_from_path(self, path):
-        pixmap = QPixmap(path).scaledToWidth(300)
-        self.image_label.setPixmap(pixmap)
+        # Ảnh đã giải mã được giữ trong LRU của ImageStore, mở lại dialog không phải đọc lại file
+        self.display_image_from_array(self.image_store.load(path))
     
     def save_data(self):
         name = self.name_input.text().strip()
@@ -223,25 +212,9 @@ class AddStudentDialog(QDialog):
             QMessageBox.warning(self, "Thiếu thông tin", "Vui lòng nhập đầy đủ các trường:\n- Mã học sinh\n- Họ và tên\n- Lớp\n- Số thứ tự\n- Ngày sinh")
             return
         
-        # Đặt tên file
-        filename = f"{code}.jpg"
-        # Lấy thư mục dự án (hoặc thư mục chứa DB)
-        base_dir = os.path.dirname(db.get_db_path())
-
-        # Nếu muốn lưu trong thư mục con "images"
-        images_dir = os.path.join(base_dir, "images")
-        os.makedirs(images_dir, exist_ok=True)
-
-        # Tạo đường dẫn ảnh đầy đủ
-        image_path = os.path.join(images_dir, filename)
-
-        save_dir = image_path
-
-        # Nếu có ảnh, resize và lưu
+        # Nếu có ảnh, lưu vào images/{mã}.jpg (kèm ảnh thu nhỏ)
         if self.captured_image is not None:
-            scaled_image = cv2.resize(self.captured_image, (320, 320))
-            cv2.imwrite(save_dir, scaled_image)
-            self.image_path = save_dir
+            self.image_path = self.image_store.save(code, self.captured_image)
 
         # Lưu thông tin
         self.student_data = {
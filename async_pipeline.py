@@ -0,0 +1,439 @@
+# async_pipeline.py
+"""
+Vòng lặp đọc khung hình và điều phối nhận diện dựa trên asyncio, thay cho vòng lặp chặn
+với msleep cố định của VideoThread:
+- cap.read() chạy trên một luồng riêng qua run_in_executor (mọi thao tác với VideoCapture,
+  kể cả tua, đều nằm trên luồng này nên không cần khóa);
+- tác vụ nhận diện là Future của FaceProcessor được await, kết quả cũ hơn kết quả đã gửi bị bỏ;
+- khung hình hiển thị được gom: chỉ khung mới nhất được gửi, tối đa gui_fps lần mỗi giây;
+- tạm dừng, tua và dừng là sự kiện đánh thức vòng lặp, không thăm dò định kỳ.
+
+Không phụ thuộc Qt: GUI dùng qua AsyncVideoThread (Video_Thread.py), chế độ không giao diện
+chạy trực tiếp:  python async_pipeline.py --source video.mp4
+"""
+import argparse
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import cv2
+import numpy as np
+
+import config
+import metrics
+import profiling
+from recognition_timeline import TimelineCursor
+from video_index import FrameSeeker
+
+
+def open_capture(source):
+    """Mở VideoCapture với backend phù hợp (DirectShow cho camera, FFmpeg cho file)."""
+    if isinstance(source, int):
+        return cv2.VideoCapture(source, cv2.CAP_DSHOW)
+    return cv2.VideoCapture(source, cv2.CAP_FFMPEG)
+
+
+class MotionDetector:
+    """Phát hiện chuyển động giữa hai khung hình liên tiếp trên ảnh xám 64x64."""
+    def __init__(self, threshold=config.MOTION_THRESHOLD):
+        self.threshold = threshold
+        self.prev_small = None
+
+    def __call__(self, frame):
+        small = cv2.cvtColor(cv2.resize(frame, (64, 64)), cv2.COLOR_BGR2GRAY)
+        prev, self.prev_small = self.prev_small, small
+        if prev is None:
+            return False
+        return np.mean(cv2.absdiff(prev, small)) > self.threshold
+
+    def reset(self):
+        self.prev_small = None
+
+
+class PipelineSink:
+    """Nơi nhận kết quả của pipeline. Các hàm được gọi trên luồng chạy vòng lặp asyncio."""
+    def on_frame(self, frame):
+        pass
+
+    def on_results(self, results):
+        pass
+
+    def on_progress(self, current, total):
+        pass
+
+    def on_fps(self, fps):
+        pass
+
+    def on_error(self, message):
+        pass
+
+    def on_finished(self):
+        pass
+
+
+class AsyncFramePipeline:
+    """
+    Điều khiển một nguồn video/camera theo sự kiện. Các hàm pause/resume/request_seek/stop
+    an toàn khi gọi từ luồng khác (ví dụ luồng GUI).
+    """
+    def __init__(self, source, processor, known_students=None, sink=None,
+                 gui_fps=30, max_in_flight=1, realtime=False, loop_at_end=True):
+        self.source = source
+        self.processor = processor
+        self.known_students = known_students
+        self.sink = sink or PipelineSink()
+        self.gui_interval = 1.0 / gui_fps if gui_fps else 0.0
+        self.max_in_flight = max_in_flight
+        self.realtime = realtime          # Phát file theo đúng FPS gốc thay vì nhanh nhất có thể
+        self.loop_at_end = loop_at_end    # Hết video: tua về đầu và tạm dừng (như VideoThread)
+        self.cap = None
+        self.seeker = None
+        self.total_frames = 0
+        self.frame_count = 0
+        self.paused = False
+        self._running = True
+        self._seek_target = None
+        self._loop = None
+        self._wake = None                 # asyncio.Event: có thay đổi trạng thái (tạm dừng/tua/dừng)
+        self._frame_ready = None          # asyncio.Event: có khung hình mới chờ hiển thị
+        self._latest_frame = None
+        self._in_flight = set()
+        self._submitted_seq = 0
+        self._delivered_seq = 0
+        self._capture_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Capture")
+        self._motion = MotionDetector()
+        self.timeline_cursor = None
+
+    # ---- Điều khiển từ luồng khác ----
+    def _call_in_loop(self, callback, *args):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(callback, *args)
+                return
+            except RuntimeError:  # Vòng lặp vừa đóng
+                pass
+        callback(*args)
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def _set_paused(self, paused):
+        self.paused = paused
+        self._notify()
+
+    def pause(self):
+        self._call_in_loop(self._set_paused, True)
+
+    def resume(self):
+        self._call_in_loop(self._set_paused, False)
+
+    def request_seek(self, frame_number):
+        """Yêu cầu tua; nhiều yêu cầu liên tiếp được gộp, chỉ vị trí cuối cùng được thực hiện."""
+        def apply():
+            self._seek_target = frame_number
+            self._notify()
+        self._call_in_loop(apply)
+
+    def set_timeline(self, timeline):
+        """Tra kết quả từ dòng thời gian đã tính thay vì nhận diện lại (None để tắt)."""
+        self.timeline_cursor = TimelineCursor(timeline) if timeline is not None else None
+
+    def stop(self):
+        def apply():
+            self._running = False
+            self._notify()
+            if self._frame_ready is not None:
+                self._frame_ready.set()
+        self._call_in_loop(apply)
+
+    # ---- Vòng lặp ----
+    def run(self):
+        """Chạy pipeline đến khi dừng hoặc hết nguồn (chặn luồng gọi)."""
+        asyncio.run(self.main())
+
+    async def main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._frame_ready = asyncio.Event()
+        try:
+            if not await self._open():
+                return
+            display = asyncio.ensure_future(self._display_loop())
+            try:
+                await self._capture_loop()
+            finally:
+                self._running = False
+                self._frame_ready.set()
+                await display
+                if self._in_flight:
+                    await asyncio.gather(*self._in_flight, return_exceptions=True)
+        finally:
+            await self._loop.run_in_executor(self._capture_executor, self._release)
+            self._capture_executor.shutdown(wait=False)
+            self._loop = None
+            self.sink.on_finished()
+
+    async def _open(self):
+        if not isinstance(self.source, (int, str)):
+            error_msg = "Nguồn đầu vào không hợp lệ."
+            logging.error(error_msg)
+            self.sink.on_error(error_msg)
+            return False
+        loop = asyncio.get_running_loop()
+        self.cap = await loop.run_in_executor(self._capture_executor, open_capture, self.source)
+        if not self.cap.isOpened():
+            error_msg = "Không thể mở nguồn video/camera."
+            logging.error(error_msg)
+            self.sink.on_error(error_msg)
+            return False
+        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.is_file:
+            self.seeker = FrameSeeker(self.cap)
+        else:
+            self.seeker = FrameSeeker(self.cap, cache_size=0)
+        return True
+
+    def _release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+    def _read(self):
+        """Chạy trên luồng Capture."""
+        with metrics.timer("capture"):
+            return self.seeker.read()
+
+    def _seek_and_read(self, frame_number):
+        """Chạy trên luồng Capture: lấy từ cache, giải mã tiến hoặc cap.set."""
+        return self.seeker.read_at(frame_number)
+
+    @property
+    def is_file(self):
+        return isinstance(self.source, str)
+
+    def _source_fps(self):
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        return fps if fps > 0 and np.isfinite(fps) else 30.0
+
+    async def _capture_loop(self):
+        loop = asyncio.get_running_loop()
+        fps_start, fps_frames = time(), 0
+        frame_period = 1.0 / self._source_fps() if self.realtime and self.is_file else 0.0
+        next_deadline = loop.time()
+
+        while self._running:
+            if self._seek_target is not None:
+                await self._handle_seek()
+                next_deadline = loop.time()
+                continue
+            if self.paused:
+                self._wake.clear()
+                await self._wake.wait()
+                next_deadline = loop.time()
+                continue
+
+            ret, frame = await loop.run_in_executor(self._capture_executor, self._read)
+            if not ret:
+                if self.is_file and self.loop_at_end:
+                    logging.info("Đã phát hết video, tua về đầu và tạm dừng.")
+                    self.paused = True
+                    self._seek_target = 0
+                    continue
+                logging.info("Nguồn không còn khung hình, kết thúc pipeline.")
+                break
+
+            self._publish_frame(frame)
+
+            fps_frames += 1
+            now = time()
+            if now - fps_start >= 1.0:
+                fps = fps_frames / (now - fps_start)
+                metrics.REGISTRY.gauge("fps", "Số khung hình đọc được mỗi giây").set(fps)
+                self.sink.on_fps(fps)
+                fps_start, fps_frames = now, 0
+
+            if self.timeline_cursor is not None:
+                self._deliver_timeline_results()
+            elif not ((self.frame_count % config.SKIP_FRAMES == 0) or self._motion(frame)):
+                metrics.inc("frames_skipped")
+            elif len(self._in_flight) >= self.max_in_flight:
+                metrics.inc("frames_dropped")
+            else:
+                self._submit(frame)
+
+            self.sink.on_progress(self.frame_count, self.total_frames)
+            self.frame_count += 1
+
+            if frame_period:
+                # Giữ nhịp theo FPS gốc bằng mốc thời gian tuyệt đối, không cộng dồn sai số
+                next_deadline = max(next_deadline + frame_period, loop.time() - frame_period)
+                await self._sleep_until(next_deadline)
+            else:
+                await asyncio.sleep(0)  # Nhường cho các tác vụ khác (hiển thị, kết quả nhận diện)
+
+    async def _sleep_until(self, deadline):
+        """Chờ đến mốc deadline nhưng thức dậy ngay khi có lệnh tạm dừng/tua/dừng."""
+        delay = deadline - asyncio.get_running_loop().time()
+        if delay <= 0:
+            return
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _handle_seek(self):
+        loop = asyncio.get_running_loop()
+        target = self._seek_target
+        self._seek_target = None
+        last_frame = max(0, self.total_frames - 1)
+        target = max(0, min(target, last_frame))
+        start = time()
+        try:
+            ret, frame = await loop.run_in_executor(self._capture_executor, self._seek_and_read, target)
+        except Exception as e:
+            logging.error(f"Lỗi khi tua đến frame {target}: {str(e)}")
+            self.sink.on_error(f"Lỗi khi tua đến frame: {str(e)}")
+            return
+        self.frame_count = target
+        self._motion.reset()
+        if not ret:
+            logging.warning(f"Không thể đọc frame {target} sau khi tua.")
+            return
+        # Khung hình sau khi tua được hiển thị ngay, không chờ nhịp hiển thị
+        self._latest_frame = None
+        self.sink.on_frame(frame)
+        if self.timeline_cursor is not None:
+            self.timeline_cursor.reset()
+            self._deliver_timeline_results()
+        elif len(self._in_flight) < self.max_in_flight:
+            self._submit(frame)
+        self.sink.on_progress(self.frame_count, self.total_frames)
+        self.frame_count += 1
+        metrics.REGISTRY.histogram("seek").record((time() - start) * 1000)
+
+    def _publish_frame(self, frame):
+        self._latest_frame = frame
+        self._frame_ready.set()
+
+    async def _display_loop(self):
+        """Gửi khung hình mới nhất cho sink, tối đa một lần mỗi gui_interval; khung trung gian bị gộp."""
+        while self._running:
+            await self._frame_ready.wait()
+            self._frame_ready.clear()
+            frame, self._latest_frame = self._latest_frame, None
+            if frame is None:
+                continue
+            self.sink.on_frame(frame)
+            if self.gui_interval:
+                await asyncio.sleep(self.gui_interval)
+
+    def _deliver_timeline_results(self):
+        results = self.timeline_cursor.results_if_changed(self.frame_count)
+        if results is not None:
+            self.sink.on_results(results)
+
+    def _submit(self, frame):
+        self._submitted_seq += 1
+        task = asyncio.ensure_future(self._recognize(self._submitted_seq, frame.copy()))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _recognize(self, seq, frame):
+        future = self.processor.submit_recognition(frame, self.known_students)
+        results = await asyncio.wrap_future(future)
+        if seq < self._delivered_seq:
+            return  # Đã có kết quả của khung hình mới hơn
+        self._delivered_seq = seq
+        self.sink.on_results(results)
+
+
+class _HeadlessSink(PipelineSink):
+    """Sink cho chế độ không giao diện: ghi điểm danh và in kết quả nhận diện."""
+    def __init__(self, attendance, verbose=False):
+        self.attendance = attendance
+        self.verbose = verbose
+
+    def on_results(self, results):
+        self.attendance.observe(results)
+        if self.verbose:
+            names = [r["name"] for r in results]
+            if names:
+                print(f"[Pipeline] {', '.join(names)}")
+
+    def on_fps(self, fps):
+        logging.debug(f"[Pipeline] FPS: {fps:.2f}")
+
+    def on_error(self, message):
+        logging.error(f"[Pipeline] {message}")
+
+
+def run_headless(source, realtime=False, max_in_flight=1, verbose=False, scope=None):
+    """
+    Chạy pipeline trên một nguồn mà không cần GUI, ghi điểm danh xuống CSDL.
+    scope: phạm vi tìm kiếm ("năm học/lớp", "" = toàn trường); None dùng cấu hình của nguồn (config.SOURCE_SCOPES).
+    """
+    import database_manager as db
+    import faiss_manager
+    from attendance import AttendanceTracker
+    from face_processor import FaceProcessor
+
+    db.create_table()
+    known_students = db.get_all_students()
+    faiss_index, id_mapping = faiss_manager.load_index()
+    processor = FaceProcessor(faiss_index, id_mapping, known_students)
+    source_key = str(source) if isinstance(source, str) else f"camera:{source}"
+    processor.set_scope(faiss_manager.scope_for_source(source_key) if scope is None else scope)
+    attendance = AttendanceTracker(source=source_key)
+    pipeline = AsyncFramePipeline(source, processor, known_students,
+                                  sink=_HeadlessSink(attendance, verbose), gui_fps=0,
+                                  max_in_flight=max_in_flight, realtime=realtime, loop_at_end=False)
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        attendance.stop()
+        processor.shutdown()
+        metrics.log_summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chạy pipeline nhận diện không giao diện.")
+    parser.add_argument("--source", default="0", help="Đường dẫn video hoặc chỉ số camera (mặc định 0).")
+    parser.add_argument("--realtime", action="store_true", help="Phát file theo FPS gốc.")
+    parser.add_argument("--in-flight", type=int, default=1, help="Số tác vụ nhận diện chạy đồng thời tối đa.")
+    parser.add_argument("--scope", default=None,
+                        help="Phạm vi tìm kiếm \"năm học/lớp\", \"lớp\" hoặc \"năm học/*\" (mặc định theo SOURCE_SCOPES).")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(encoding='utf-8', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[logging.FileHandler("performance.log"), logging.StreamHandler()])
+    source = int(args.source) if args.source.isdigit() else args.source
+
+    # Nhận diện chạy trên các luồng của executor nên chỉ dùng profile lấy mẫu (không cProfile)
+    args.no_cprofile = True
+    profile_session = profiling.session_from_args(args, "headless")
+    profile_timer = None
+    if profile_session:
+        profile_session.start()
+        profile_timer = threading.Timer(profile_session.duration, profile_session.stop)
+        profile_timer.start()
+    try:
+        run_headless(source, args.realtime, args.in_flight, args.verbose, args.scope)
+    finally:
+        if profile_session:
+            # Nguồn hết trước thời hạn: ghi kết quả ngay, không chờ Timer
+            profile_timer.cancel()
+            profile_session.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
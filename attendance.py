@@ -0,0 +1,138 @@
+# attendance.py
+"""
+Điểm danh: chuyển kết quả nhận diện thành các khoảng thời gian có mặt của từng học sinh.
+- Mỗi học sinh có tối đa một khoảng đang mở; các lần vắng ngắn hơn ATTENDANCE_GAP không cắt khoảng.
+- Khoảng ngắn hơn ATTENDANCE_MIN_DWELL bị bỏ qua (nhận nhầm thoáng qua).
+- Khoảng đã đóng được đưa vào hàng đợi và một luồng nền ghi theo lô xuống CSDL,
+  nên vòng lặp video/GUI không bao giờ phải chờ SQLite.
+- Lô ghi lỗi (ví dụ "database is locked" khi GUI đang ghi cùng file) được giữ lại và ghi lại ở chu kỳ sau;
+  chỉ bỏ sau ATTENDANCE_MAX_RETRIES lần thất bại liên tiếp hoặc khi vượt ATTENDANCE_MAX_PENDING sự kiện.
+"""
+import logging
+import queue
+import threading
+from time import time, monotonic, sleep
+
+import database_manager as db
+from config import (ATTENDANCE_MIN_DWELL, ATTENDANCE_GAP,
+                    ATTENDANCE_FLUSH_INTERVAL, ATTENDANCE_BATCH_SIZE,
+                    ATTENDANCE_MAX_RETRIES, ATTENDANCE_MAX_PENDING)
+
+_STOP = object()  # Tín hiệu dừng cho luồng ghi
+_STOP_RETRY_DELAY = 0.5  # Khoảng chờ giữa các lần ghi lại khi đang dừng (giây)
+
+
+class AttendanceTracker:
+    def __init__(self, source="", min_dwell=ATTENDANCE_MIN_DWELL, gap=ATTENDANCE_GAP,
+                 flush_interval=ATTENDANCE_FLUSH_INTERVAL, batch_size=ATTENDANCE_BATCH_SIZE,
+                 max_retries=ATTENDANCE_MAX_RETRIES, max_pending=ATTENDANCE_MAX_PENDING):
+        self.source = source
+        self.min_dwell = min_dwell
+        self.gap = gap
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self._open = {}               # student_id -> [first_seen, last_seen]
+        self._last_expire_check = 0.0
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="AttendanceWriter", daemon=True)
+        self._writer.start()
+
+    def observe(self, results, timestamp=None):
+        """
+        Ghi nhận một lần nhận diện. Chỉ thao tác trên dict trong bộ nhớ (O(số khuôn mặt)),
+        an toàn để gọi trực tiếp từ luồng GUI.
+        """
+        now = time() if timestamp is None else timestamp
+        for result in results:
+            student_id = result.get("id")
+            if student_id is None:
+                continue
+            interval = self._open.get(student_id)
+            if interval is None:
+                self._open[student_id] = [now, now]
+            elif now - interval[1] > self.gap:
+                # Vắng quá lâu: đóng khoảng cũ, mở khoảng mới
+                self._close(student_id, interval)
+                self._open[student_id] = [now, now]
+            else:
+                interval[1] = now
+
+        # Đóng các khoảng của học sinh đã rời khỏi khung hình (kiểm tra tối đa mỗi giây một lần)
+        if now - self._last_expire_check >= 1.0:
+            self._last_expire_check = now
+            expired = [sid for sid, interval in self._open.items() if now - interval[1] > self.gap]
+            for student_id in expired:
+                self._close(student_id, self._open.pop(student_id))
+
+    def _close(self, student_id, interval):
+        first_seen, last_seen = interval
+        duration = last_seen - first_seen
+        if duration >= self.min_dwell:
+            self._queue.put((student_id, self.source, first_seen, last_seen, duration))
+
+    def close_all(self):
+        """Đóng mọi khoảng đang mở (khi đổi nguồn video hoặc tắt ứng dụng)."""
+        for student_id, interval in self._open.items():
+            self._close(student_id, interval)
+        self._open.clear()
+
+    def set_source(self, source):
+        """Đổi nguồn đang điểm danh; các khoảng của nguồn cũ được đóng lại."""
+        self.close_all()
+        self.source = source
+
+    def stop(self, timeout=5.0):
+        """Đóng mọi khoảng, ghi nốt dữ liệu còn trong hàng đợi và dừng luồng ghi."""
+        self.close_all()
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
+
+    def _flush(self, batch, failures):
+        """
+        Ghi batch trong một transaction. Trả về (sự kiện còn chờ ghi, số lần thất bại liên tiếp):
+        lỗi thì giữ lại để ghi lại lần sau, trừ khi đã thất bại max_retries lần (bỏ cả lô)
+        hoặc vượt max_pending sự kiện (bỏ các sự kiện cũ nhất).
+        """
+        if db.add_attendance_events(batch):
+            logging.debug(f"Đã ghi {len(batch)} sự kiện điểm danh.")
+            return [], 0
+        failures += 1
+        if failures >= self.max_retries:
+            logging.error(f"Không thể ghi điểm danh sau {failures} lần thử, bỏ {len(batch)} sự kiện.")
+            return [], 0
+        if len(batch) > self.max_pending:
+            dropped = len(batch) - self.max_pending
+            logging.error(f"Quá {self.max_pending} sự kiện điểm danh chờ ghi, bỏ {dropped} sự kiện cũ nhất.")
+            batch = batch[dropped:]
+        logging.warning(f"Không thể ghi {len(batch)} sự kiện điểm danh (lần {failures}/{self.max_retries}), "
+                        "sẽ ghi lại ở chu kỳ sau.")
+        return batch, failures
+
+    def _writer_loop(self):
+        """Luồng nền: gom sự kiện và ghi theo lô, mỗi lô là một transaction."""
+        batch = []
+        failures = 0  # Số lần ghi thất bại liên tiếp của các sự kiện đang giữ trong batch
+        deadline = monotonic() + self.flush_interval
+        running = True
+        while running:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - monotonic()))
+                if item is _STOP:
+                    running = False
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            # Sau một lần lỗi chỉ ghi lại theo chu kỳ, không ghi lại ngay mỗi khi có sự kiện mới
+            full = failures == 0 and len(batch) >= self.batch_size
+            if batch and (not running or full or monotonic() >= deadline):
+                batch, failures = self._flush(batch, failures)
+            while batch and not running:
+                # Đang dừng: thử lại vài lần trước khi bỏ (giới hạn bởi max_retries)
+                sleep(_STOP_RETRY_DELAY)
+                batch, failures = self._flush(batch, failures)
+            if monotonic() >= deadline:
+                deadline = monotonic() + self.flush_interval
@@ -0,0 +1,9 @@
+# benchmark/__init__.py
+"""
+Bộ benchmark hiệu năng cho pipeline nhận diện.
+Chạy từ thư mục gốc của dự án:
+    python -m benchmark --roster-sizes 100 1000 10000 --output benchmark_results/run.json
+    python -m benchmark --compare cu.json moi.json
+Dữ liệu đầu vào (khung hình, danh sách học sinh, embedding) được sinh ngẫu nhiên với seed cố định
+hoặc đọc từ ảnh/video cục bộ (--input), nên kết quả có thể so sánh giữa các commit.
+"""
@@ -0,0 +1,123 @@
+# benchmark/__main__.py
+import argparse
+import sys
+
+import profiling
+from config import CONFIG_TIERS, RECOGNITION_MARGIN
+from benchmark import report, stages, synthetic
+
+ALL_STAGES = ["pipeline", "detectors", "search", "identify", "open_set", "database", "faiss_manager", "render"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark",
+                                     description="Benchmark hiệu năng pipeline nhận diện khuôn mặt.")
+    parser.add_argument("--roster-sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Số học sinh tổng hợp trong chỉ mục/CSDL.")
+    parser.add_argument("--tiers", nargs="+", default=list(CONFIG_TIERS), choices=list(CONFIG_TIERS),
+                        help="Các mức cấu hình (RESIZE_FACTOR, DET_SIZE) cần đo.")
+    parser.add_argument("--stages", nargs="+", default=ALL_STAGES, choices=ALL_STAGES)
+    parser.add_argument("--input", help="Thư mục ảnh hoặc file video cục bộ thay cho khung hình tổng hợp.")
+    parser.add_argument("--frames", type=int, default=20, help="Số khung hình dùng để đo.")
+    parser.add_argument("--repeat", type=int, default=30, help="Số lần đo mỗi bước.")
+    parser.add_argument("--faces-per-frame", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=8, help="Số khuôn mặt mỗi lần tìm kiếm/nhận diện.")
+    parser.add_argument("--open-set-queries", type=int, default=2000,
+                        help="Số truy vấn (20%% người lạ) để đo FAR/FRR của bước open_set.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6],
+                        help="Các ngưỡng độ tương đồng cosine cần đo FAR/FRR.")
+    parser.add_argument("--margins", type=float, nargs="+", default=[0.0, RECOGNITION_MARGIN],
+                        help="Các khoảng cách top-1/top-2 cần đo FAR/FRR.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="File JSON kết quả (mặc định benchmark_results/<commit>_<thời gian>.json).")
+    parser.add_argument("--compare", nargs=2, metavar=("CU", "MOI"), help="So sánh hai file kết quả và thoát.")
+    profiling.add_profile_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def run(args):
+    rows = []
+    processor = None
+    if "pipeline" in args.stages or "identify" in args.stages or "detectors" in args.stages:
+        processor = stages.create_processor()
+
+    if "pipeline" in args.stages or "render" in args.stages or "detectors" in args.stages:
+        if args.input:
+            frames = synthetic.load_frames(args.input, args.frames)
+        else:
+            frames = synthetic.synthetic_frames(args.frames, seed=args.seed)
+
+    if "pipeline" in args.stages:
+        for tier_name in args.tiers:
+            print(f"[Benchmark] Pipeline, mức cấu hình {tier_name}...")
+            rows += stages.bench_pipeline(processor, frames, tier_name, CONFIG_TIERS[tier_name],
+                                          args.repeat, args.faces_per_frame, args.seed)
+
+    if "detectors" in args.stages:
+        for tier_name in args.tiers:
+            print(f"[Benchmark] So sánh detector, mức cấu hình {tier_name}...")
+            rows += stages.bench_detectors(processor, frames, args.repeat, CONFIG_TIERS[tier_name]["RESIZE_FACTOR"])
+
+    for roster_size in args.roster_sizes:
+        embeddings, students = synthetic.synthetic_roster(roster_size, seed=args.seed)
+        queries, _ = synthetic.synthetic_queries(embeddings, args.batch, seed=args.seed + 1)
+        if "search" in args.stages:
+            print(f"[Benchmark] Faiss search, {roster_size} học sinh...")
+            rows += stages.bench_search(embeddings, queries, args.repeat)
+            rows += stages.bench_scoped_search(embeddings, students, queries, args.repeat)
+        if "identify" in args.stages:
+            print(f"[Benchmark] identify_faces, {roster_size} học sinh...")
+            rows += stages.bench_identify(processor, embeddings, students, queries, args.repeat)
+        if "open_set" in args.stages:
+            print(f"[Benchmark] Open-set FAR/FRR, {roster_size} học sinh...")
+            probes, truth = synthetic.synthetic_queries(embeddings, args.open_set_queries, seed=args.seed + 2)
+            rows += stages.bench_open_set(embeddings, students, probes, truth, args.thresholds, args.margins,
+                                          args.repeat)
+        if "database" in args.stages:
+            print(f"[Benchmark] database_manager, {roster_size} học sinh...")
+            rows += stages.bench_database(students, args.repeat)
+        if "faiss_manager" in args.stages:
+            print(f"[Benchmark] faiss_manager, {roster_size} học sinh...")
+            rows += stages.bench_faiss_manager(students, args.repeat)
+
+    if "render" in args.stages:
+        print("[Benchmark] Dựng khung hình hiển thị...")
+        rows += stages.bench_render(frames, args.repeat, args.faces_per_frame, args.seed)
+
+    if processor is not None:
+        processor.shutdown()
+    return rows
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        report.compare(*args.compare)
+        return 0
+
+    profile_session = profiling.session_from_args(args, "benchmark")
+    if profile_session:
+        profile_session.start()
+    try:
+        rows = run(args)
+    finally:
+        if profile_session:
+            profile_session.stop()
+    output = args.output or report.default_output_path()
+    report.write_results(output, report.collect_metadata(args), rows)
+    for row in rows:
+        labels = ", ".join(f"{k}={v}" for k, v in row.items()
+                           if k not in ("stage", "n") and not k.endswith("_ms"))
+        print(f"{row['stage']:<24} p50={row['p50_ms']:9.3f} ms  p95={row['p95_ms']:9.3f} ms  {labels}")
+    open_set = [row for row in rows if row["stage"] == "open_set"]
+    if open_set:
+        print(f"{'Học sinh':>9} {'Ngưỡng':>11} {'Margin':>7} {'FAR':>9} {'FRR':>9} {'Nhầm':>9}")
+        for row in open_set:
+            rates = " ".join("-".rjust(9) if row[k] is None else f"{row[k]:>9.4f}" for k in ("far", "frr", "misid"))
+            print(f"{row['roster_size']:>9} {str(row['threshold']):>11} {row['margin']:>7.3f} {rates}")
+    print(f"[Benchmark] Đã ghi kết quả vào '{output}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
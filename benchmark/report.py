@@ -0,0 +1,80 @@
+# benchmark/report.py
+"""Ghi kết quả benchmark ra JSON và so sánh hai lần chạy."""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+
+def _git(*args):
+    try:
+        return subprocess.check_output(["git", *args], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def collect_metadata(args):
+    """Thông tin môi trường để so sánh kết quả giữa các commit/máy."""
+    versions = {}
+    for module_name in ("numpy", "cv2", "faiss", "insightface", "onnxruntime", "PyQt5.QtCore"):
+        try:
+            module = __import__(module_name, fromlist=["_"])
+            versions[module_name] = getattr(module, "__version__", None) or getattr(module, "PYQT_VERSION_STR", None)
+        except ImportError:
+            versions[module_name] = None
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions,
+        "args": vars(args),
+    }
+
+
+def default_output_path():
+    commit = (_git("rev-parse", "--short", "HEAD") or "nogit")
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return os.path.join("benchmark_results", f"{commit}_{stamp}.json")
+
+
+def write_results(path, metadata, rows):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": metadata, "results": rows}, f, ensure_ascii=False, indent=2)
+
+
+def _row_key(row):
+    """Khóa nhận dạng một dòng: tên bước + các nhãn (tier, roster_size, ...), bỏ các số đo."""
+    measured = {"n", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "min_ms", "max_ms", "faces_detected", "synthetic_crops",
+                "fps", "gt_faces", "recall", "precision", "calibrated_threshold", "far", "frr", "misid"}
+    return tuple(sorted((k, str(v)) for k, v in row.items() if k not in measured))
+
+
+def compare(old_path, new_path):
+    """In bảng so sánh p50/p95 giữa hai file kết quả."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    old_rows = {_row_key(r): r for r in old["results"]}
+    print(f"Cũ: {old['meta'].get('commit')}  Mới: {new['meta'].get('commit')}")
+    print(f"{'Bước':<48} {'p50 cũ':>10} {'p50 mới':>10} {'x':>7} {'p95 cũ':>10} {'p95 mới':>10}")
+    for row in new["results"]:
+        key = _row_key(row)
+        label = ", ".join(f"{k}={v}" for k, v in key if k != "stage")
+        name = f"{row['stage']} [{label}]" if label else row["stage"]
+        before = old_rows.get(key)
+        if before is None:
+            print(f"{name:<48} {'-':>10} {row['p50_ms']:>10.3f} {'':>7} {'-':>10} {row['p95_ms']:>10.3f}")
+            continue
+        ratio = row["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("inf")
+        print(f"{name:<48} {before['p50_ms']:>10.3f} {row['p50_ms']:>10.3f} {ratio:>6.2f}x "
+              f"{before['p95_ms']:>10.3f} {row['p95_ms']:>10.3f}")
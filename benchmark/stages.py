@@ -0,0 +1,317 @@
+# benchmark/stages.py
+"""
+Đo thời gian từng bước của pipeline. Mỗi hàm bench_* trả về list các dòng kết quả
+(dict) đã tóm tắt, sẵn sàng ghi ra JSON.
+"""
+import os
+import shutil
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from benchmark import synthetic
+
+
+def time_calls(fn, repeat, warmup=2):
+    """Gọi fn() warmup lần (bỏ qua) rồi repeat lần, trả về danh sách thời gian (ms)."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        samples.append((perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(stage, samples, **labels):
+    """Tóm tắt danh sách thời gian thành một dòng kết quả."""
+    values = np.asarray(samples, dtype=np.float64)
+    row = {"stage": stage}
+    row.update(labels)
+    row.update({
+        "n": int(values.size),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "min_ms": float(values.min()),
+        "max_ms": float(values.max()),
+    })
+    return row
+
+
+def create_processor():
+    """Khởi tạo FaceProcessor thật (nạp model InsightFace) với chỉ mục rỗng."""
+    from face_processor import FaceProcessor
+    return FaceProcessor(None, None, [])
+
+
+def bench_pipeline(processor, frames, tier_name, tier, repeat, faces_per_frame, seed):
+    """
+    Đo resize, detect và embed với thông số của một mức cấu hình (RESIZE_FACTOR, DET_SIZE).
+    Nếu khung hình không có khuôn mặt thật, bước embed đo trên ảnh khuôn mặt tổng hợp đã căn chỉnh.
+    """
+    import cv2
+    from insightface.app.common import Face
+
+    resize_factor = tier["RESIZE_FACTOR"]
+    det_size = tuple(tier["DET_SIZE"])
+    det_model = processor.model.det_model
+    rec_model = processor.model.models["recognition"]
+    crops = list(synthetic.synthetic_face_crops(faces_per_frame, seed))
+
+    resize_samples, detect_samples, embed_samples = [], [], []
+    faces_detected = 0
+    for i in range(repeat):
+        frame = frames[i % len(frames)]
+
+        start = perf_counter()
+        small_frame = cv2.resize(frame, (0, 0), fx=resize_factor, fy=resize_factor)
+        resize_samples.append((perf_counter() - start) * 1000)
+
+        start = perf_counter()
+        bboxes, kpss = det_model.detect(small_frame, input_size=det_size, max_num=0, metric='default')
+        detect_samples.append((perf_counter() - start) * 1000)
+
+        start = perf_counter()
+        if len(bboxes):
+            faces_detected += len(bboxes)
+            for j in range(len(bboxes)):
+                face = Face(bbox=bboxes[j, 0:4], kps=None if kpss is None else kpss[j], det_score=bboxes[j, 4])
+                rec_model.get(small_frame, face)
+        else:
+            rec_model.get_feat(crops)
+        embed_samples.append((perf_counter() - start) * 1000)
+
+    labels = {"tier": tier_name}
+    return [
+        summarize("resize", resize_samples, **labels),
+        summarize("detect", detect_samples, **labels),
+        summarize("embed", embed_samples, faces_detected=faces_detected,
+                  synthetic_crops=faces_detected == 0, **labels),
+    ]
+
+
+def bench_search(embeddings, queries, repeat, k=1):
+    """Đo riêng thời gian tìm kiếm Faiss (IndexFlatL2) cho một lô truy vấn."""
+    import faiss
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    samples = time_calls(lambda: index.search(queries, k), repeat)
+    return [summarize("faiss_search", samples, roster_size=len(embeddings), batch=len(queries), k=k)]
+
+
+def bench_scoped_search(embeddings, students, queries, repeat, k=1):
+    """
+    Tìm kiếm trong chỉ mục con của một lớp (faiss_manager.build_scoped_index) so với chỉ mục chung,
+    kèm thời gian cắt chỉ mục con (mỗi thế hệ chỉ mục một lần).
+    """
+    import faiss
+    import faiss_manager
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    id_mapping = [s["id"] for s in students]
+    scope = faiss_manager.Scope(students[0]["school_year"], students[0]["class"])
+    members = faiss_manager.scope_members(students, scope)
+    build = time_calls(lambda: faiss_manager.build_scoped_index(index, id_mapping, members), max(1, repeat // 5))
+    scoped, _ = faiss_manager.build_scoped_index(index, id_mapping, members)
+    search = time_calls(lambda: scoped.search(queries, k), repeat)
+    labels = {"roster_size": len(embeddings), "scope_size": len(members)}
+    return [summarize("scope_build", build, **labels),
+            summarize("faiss_search_scoped", search, batch=len(queries), k=k, **labels)]
+
+
+def bench_identify(processor, embeddings, students, queries, repeat):
+    """
+    Đo FaceProcessor.identify_faces với một ảnh chụp chỉ mục tổng hợp:
+    'identify' xóa cache trước mỗi lần gọi, 'identify_cached' để cache hoạt động như khi chạy thật.
+    """
+    import faiss
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    processor.swap_snapshot(index, [s["id"] for s in students], students)
+    query_list = list(queries.astype(np.float64))
+
+    def identify_cold():
+        processor.recognition_cache.invalidate()
+        processor.identify_faces(query_list)
+
+    cold = time_calls(identify_cold, repeat)
+    processor.recognition_cache.invalidate()
+    warm = time_calls(lambda: processor.identify_faces(query_list), repeat)
+    labels = {"roster_size": len(embeddings), "batch": len(queries)}
+    return [summarize("identify", cold, **labels), summarize("identify_cached", warm, **labels)]
+
+
+def bench_open_set(embeddings, students, queries, truth, thresholds, margins, repeat):
+    """
+    Độ chính xác nhận diện open-set (calibration.open_set_match trên k láng giềng) theo ngưỡng và khoảng cách
+    top-1/top-2: far = tỉ lệ người lạ bị nhận là học sinh, frr = tỉ lệ học sinh không được nhận đúng,
+    misid = tỉ lệ học sinh bị nhận nhầm thành người khác. Thời gian là của bước quyết định trên cả lô.
+    Kèm thời gian hiệu chỉnh ngưỡng (mọi cặp theo khối) và một dòng cho ngưỡng hiệu chỉnh được.
+    """
+    import faiss
+    import calibration
+    from config import RECOGNITION_TOP_K
+    ids = np.array([s["id"] for s in students])
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+    distances, indices = index.search(queries, min(RECOGNITION_TOP_K, len(embeddings)))
+    similarities = 1 - distances / 2
+    neighbor_ids = ids[indices]
+    genuine = truth >= 0
+    correct = neighbor_ids[:, 0] == ids[np.maximum(truth, 0)]
+    labels = {"roster_size": len(embeddings), "queries": len(queries)}
+
+    samples = time_calls(lambda: calibration.calibrate(embeddings, ids), max(1, repeat // 10), warmup=0)
+    calibrated = calibration.calibrate(embeddings, ids)
+    row = summarize("calibrate", samples, **labels)
+    row["calibrated_threshold"] = calibrated.threshold
+    rows = [row]
+
+    settings = [(threshold, margin) for threshold in thresholds for margin in margins]
+    settings += [("calibrated", margin) for margin in margins]
+    for threshold, margin in settings:
+        value = calibrated.threshold if threshold == "calibrated" else threshold
+        samples = time_calls(lambda: calibration.open_set_match(similarities, neighbor_ids, value, margin), repeat)
+        accepted, _ = calibration.open_set_match(similarities, neighbor_ids, value, margin)
+        row = summarize("open_set", samples, threshold=threshold, margin=margin, **labels)
+        row["far"] = float(accepted[~genuine].mean()) if (~genuine).any() else None
+        row["frr"] = float(1 - (accepted & correct)[genuine].mean()) if genuine.any() else None
+        row["misid"] = float((accepted & ~correct)[genuine].mean()) if genuine.any() else None
+        rows.append(row)
+    return rows
+
+
+def bench_database(students, repeat):
+    """Đo database_manager.get_all_students và add_student trên CSDL tạm."""
+    import database_manager as db
+    rows = []
+    with synthetic.temporary_database(students):
+        samples = time_calls(db.get_all_students, repeat, warmup=1)
+        rows.append(summarize("db_get_all_students", samples, roster_size=len(students)))
+
+        counter = iter(range(10 ** 9))
+        encoding = students[0]["face_encoding"]
+
+        def add_one():
+            i = next(counter)
+            db.add_student(f"bench{i:08d}", "Bench", "01/01/2010", "10A",
+                           encoding + (i + 1) * 1e-6, "Nam", "2025-2026", 1)
+
+        samples = time_calls(add_one, repeat, warmup=1)
+        rows.append(summarize("db_add_student", samples, roster_size=len(students)))
+    return rows
+
+
+def bench_faiss_manager(students, repeat):
+    """Đo build_and_save_index và load_index (mmap và đọc thường) trên thư mục chỉ mục tạm."""
+    import faiss_manager
+    rows = []
+    index_dir = tempfile.mkdtemp(prefix="face_bench_index_")
+    old_dir = faiss_manager.INDEX_DIR
+    faiss_manager.INDEX_DIR = index_dir
+    try:
+        with synthetic.temporary_database(students):
+            samples = time_calls(faiss_manager.build_and_save_index, max(1, repeat // 5), warmup=0)
+            rows.append(summarize("faiss_build_and_save", samples, roster_size=len(students)))
+            for mmap in (True, False):
+                samples = time_calls(lambda: faiss_manager.load_index(mmap=mmap), repeat, warmup=1)
+                rows.append(summarize("faiss_load_index", samples, roster_size=len(students), mmap=mmap))
+    finally:
+        faiss_manager.INDEX_DIR = old_dir
+        shutil.rmtree(index_dir, ignore_errors=True)
+    return rows
+
+
+def bench_render(frames, repeat, faces_per_frame, seed):
+    """
+    Đo bước dựng khung hình hiển thị (thu nhỏ + lật + vẽ, chạy ngoài luồng GUI) và phần còn lại
+    trên luồng GUI (QPixmap.fromImage) bằng Qt offscreen.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtGui import QPixmap
+    from overlay_renderer import OverlayRenderer
+    from scaler import FixedScaler
+
+    app = QApplication.instance() or QApplication([])
+    renderer = OverlayRenderer(FixedScaler(target_width=640))
+    rng = np.random.default_rng(seed)
+    results = []
+    for i in range(faces_per_frame):
+        top, left = int(rng.integers(0, 300)), int(rng.integers(0, 600))
+        results.append({"name": f"Học sinh {i}", "id": None if i % 3 == 0 else str(i),
+                        "location": (top, left + 60, top + 80, left)})
+
+    counter = iter(range(10 ** 9))
+    rendered = []
+
+    def render_once():
+        frame = frames[next(counter) % len(frames)]
+        qt_image, _buffer = renderer.render(frame, results)
+        rendered.append(qt_image)
+        if len(rendered) > 1:
+            rendered.pop(0)
+
+    def to_pixmap():
+        QPixmap.fromImage(rendered[-1])
+
+    render_samples = time_calls(render_once, repeat)
+    gui_samples = time_calls(to_pixmap, repeat)
+    app.processEvents()
+    return [summarize("overlay_render", render_samples, faces=faces_per_frame),
+            summarize("gui_update", gui_samples, faces=faces_per_frame)]
+
+
+def bench_detectors(processor, frames, repeat, resize_factor, iou_threshold=0.5, gt_size=(640, 640)):
+    """
+    So sánh các detector trong config.FACE_DETECTION_ALGORITHMS: thời gian phát hiện trên ảnh đã thu nhỏ
+    resize_factor (như pipeline thật) và recall/precision so với "nhãn" là SCRFD chạy trên ảnh gốc
+    với det_size=gt_size (khớp khi IoU >= iou_threshold). Cần --input có khuôn mặt thật; với khung hình
+    tổng hợp recall/precision là None. Backend không dùng được trên máy (thiếu model) bị bỏ qua.
+    """
+    import cv2
+    from config import FACE_DETECTION_ALGORITHMS
+    from face_backends import BackendUnavailable, create_detector, iou_matrix
+
+    det_model = processor.model.det_model
+    ground_truth = [det_model.detect(frame, input_size=gt_size, max_num=0, metric='default')[0][:, 0:4]
+                    for frame in frames]
+    small_frames = [cv2.resize(frame, (0, 0), fx=resize_factor, fy=resize_factor) for frame in frames]
+    gt_faces = int(sum(len(boxes) for boxes in ground_truth))
+
+    rows = []
+    for name in FACE_DETECTION_ALGORITHMS:
+        try:
+            detector = create_detector(name, processor.model)
+        except BackendUnavailable as e:
+            print(f"[Benchmark] Bỏ qua detector {name}: {e}")
+            continue
+        counter = iter(range(10 ** 9))
+        samples = time_calls(lambda: detector.detect(small_frames[next(counter) % len(small_frames)]), repeat)
+
+        matched = detected = 0
+        for small_frame, gt_boxes in zip(small_frames, ground_truth):
+            bboxes, _ = detector.detect(small_frame)
+            detected += len(bboxes)
+            if len(bboxes) and len(gt_boxes):
+                iou = iou_matrix(gt_boxes, bboxes[:, 0:4] / resize_factor)
+                # Ghép tham lam theo IoU giảm dần, mỗi hộp chỉ được ghép một lần
+                used_gt, used_det = set(), set()
+                for gt_row, det_col in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                    if iou[gt_row, det_col] < iou_threshold:
+                        break
+                    if gt_row not in used_gt and det_col not in used_det:
+                        used_gt.add(gt_row)
+                        used_det.add(det_col)
+                matched += len(used_gt)
+        row = summarize("detector", samples, backend=name, resize_factor=resize_factor)
+        row["fps"] = 1000.0 / row["mean_ms"] if row["mean_ms"] else None
+        row["gt_faces"] = gt_faces
+        row["recall"] = matched / gt_faces if gt_faces else None
+        row["precision"] = matched / detected if detected else None
+        rows.append(row)
+    return rows
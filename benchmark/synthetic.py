@@ -0,0 +1,131 @@
+# benchmark/synthetic.py
+"""Sinh dữ liệu tổng hợp có thể tái lập (theo seed) cho benchmark."""
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+import database_manager as db
+
+EMBEDDING_DIM = 512
+CLASSES = ["10A", "10B", "11A", "11B", "12A", "12B"]
+SCHOOL_YEARS = ["2023-2024", "2024-2025", "2025-2026"]
+
+
+def synthetic_frames(count, width=1280, height=720, seed=0):
+    """Khung hình BGR tổng hợp: nền gradient + các hình elip màu da, giống cảnh lớp học đơn giản."""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(40, 200, width, dtype=np.uint8)
+    frames = []
+    for _ in range(count):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = gradient[None, :, None]
+        frame = cv2.add(frame, rng.integers(0, 25, size=frame.shape, dtype=np.uint8))
+        for _ in range(int(rng.integers(2, 8))):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            axes = (int(rng.integers(20, 90)), int(rng.integers(30, 120)))
+            color = tuple(int(c) for c in rng.integers([60, 110, 150], [120, 170, 230]))
+            cv2.ellipse(frame, center, axes, 0, 0, 360, color, -1)
+        frames.append(frame)
+    return frames
+
+
+def load_frames(path, count):
+    """Đọc tối đa count khung hình từ thư mục ảnh hoặc từ file video cục bộ."""
+    frames = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if not name.lower().endswith((".jpg", ".jpeg", ".png")):
+                continue
+            img = cv2.imread(os.path.join(path, name))
+            if img is not None:
+                frames.append(img)
+            if len(frames) >= count:
+                break
+    else:
+        cap = cv2.VideoCapture(path)
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        raise ValueError(f"Không đọc được khung hình nào từ '{path}'.")
+    return frames
+
+
+def synthetic_face_crops(count, seed=0):
+    """Ảnh khuôn mặt đã căn chỉnh giả (112x112) để đo riêng bước tính embedding."""
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, size=(count, 112, 112, 3), dtype=np.uint8)
+
+
+def synthetic_roster(n, dim=EMBEDDING_DIM, seed=0):
+    """
+    Danh sách n học sinh với embedding ngẫu nhiên đã chuẩn hóa L2.
+    Trả về (embeddings float32 (n, dim), danh sách dict học sinh giống db.get_all_students()).
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((n, dim)).astype('float32')
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    students = []
+    for i in range(n):
+        students.append({
+            "id": f"{i:012d}",
+            "name": f"Học sinh {i}",
+            "dob": "01/01/2010",
+            "class": CLASSES[i % len(CLASSES)],
+            "gender": "Nam" if i % 2 else "Nữ",
+            "school_year": SCHOOL_YEARS[i % len(SCHOOL_YEARS)],
+            "stt": i % 45 + 1,
+            "image_path": None,
+            "face_encoding": embeddings[i].astype(np.float64),
+        })
+    return embeddings, students
+
+
+def synthetic_queries(embeddings, count, noise=1.0, stranger_ratio=0.2, seed=0):
+    """
+    Truy vấn gần với embedding đã đăng ký (cộng nhiễu) và một phần là người lạ ngẫu nhiên.
+    noise là tỉ lệ độ lớn nhiễu so với vector gốc (1.0 -> cosine ≈ 0.7, gần với ArcFace thực tế).
+    Trả về (queries float32 đã chuẩn hóa, chỉ số học sinh đúng hoặc -1 nếu là người lạ).
+    """
+    rng = np.random.default_rng(seed)
+    n, dim = embeddings.shape
+    truth = rng.integers(0, n, size=count)
+    queries = embeddings[truth] + rng.standard_normal((count, dim)).astype('float32') * (noise / np.sqrt(dim))
+    strangers = rng.random(count) < stranger_ratio
+    queries[strangers] = rng.standard_normal((int(strangers.sum()), dim)).astype('float32')
+    truth[strangers] = -1
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries.astype('float32'), truth
+
+
+@contextmanager
+def temporary_database(students):
+    """
+    Tạo CSDL SQLite tạm chứa danh sách học sinh tổng hợp và trỏ database_manager tới đó.
+    Khôi phục đường dẫn CSDL cũ khi thoát.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="face_bench_")
+    old_path = db.db_path
+    db.db_path = os.path.join(tmp_dir, "bench.db")
+    try:
+        db.create_table()
+        rows = [(s["id"], s["name"], s["dob"], s["class"], s["face_encoding"].astype(np.float64).tobytes(),
+                 s["gender"], s["school_year"], s["stt"], s["image_path"]) for s in students]
+        with sqlite3.connect(db.db_path) as conn:
+            conn.executemany("""
+                INSERT INTO students (id, name, dob, class, face_encoding, gender, school_year, stt, image_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.commit()
+        yield tmp_dir
+    finally:
+        db.db_path = old_path
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,177 @@
+# calibration.py
+"""
+Nhận diện open-set: hiệu chỉnh ngưỡng theo danh sách học sinh đã đăng ký và quy tắc khoảng cách top-1/top-2.
+
+Phân bố "mạo danh" (impostor) là độ tương đồng cosine giữa embedding của hai học sinh khác nhau trong chỉ mục:
+một người lạ giống ai đó trong danh sách ở mức tương đương. Ngưỡng của danh sách là độ tương đồng nhỏ nhất mà
+tỉ lệ cặp khác người vượt qua (FAR) không quá CALIBRATION_TARGET_FAR, kẹp trong
+[CALIBRATION_MIN_SIMILARITY, CALIBRATION_MAX_SIMILARITY]. Mọi cặp được tính vector hóa theo khối
+(CALIBRATION_BLOCK_SIZE hàng nhân với phần còn lại của chỉ mục) và dồn vào một histogram cố định,
+nên bộ nhớ không phụ thuộc N².
+
+Một khuôn mặt chỉ được nhận là học sinh top-1 khi độ tương đồng đạt ngưỡng và cách học sinh khác gần nhất
+trong k láng giềng ít nhất RECOGNITION_MARGIN; hai học sinh gần như ngang nhau thì coi là người lạ.
+
+Chạy `python -m calibration` để in ngưỡng và bảng FAR theo ngưỡng của CSDL hiện tại.
+"""
+import argparse
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from config import (RECOGNITION_TOLERANCE, RECOGNITION_MARGIN, CALIBRATION_ENABLED, CALIBRATION_TARGET_FAR,
+                    CALIBRATION_MIN_SIMILARITY, CALIBRATION_MAX_SIMILARITY, CALIBRATION_MIN_PAIRS,
+                    CALIBRATION_BLOCK_SIZE, CALIBRATION_MAX_VECTORS)
+
+HIST_BINS = 2000   # Histogram độ tương đồng trên [-1, 1], mỗi ô rộng 0.001
+
+# threshold: ngưỡng độ tương đồng cosine; pairs: số cặp khác người đã dùng (0 = ngưỡng mặc định);
+# far: tỉ lệ cặp khác người đạt ngưỡng
+Calibration = namedtuple("Calibration", ["threshold", "pairs", "far"])
+
+
+def default_threshold():
+    """Ngưỡng cố định từ RECOGNITION_TOLERANCE (khoảng cách cosine 1 - S), dùng khi không hiệu chỉnh được."""
+    return 1.0 - RECOGNITION_TOLERANCE
+
+
+def _bin_of(similarities):
+    return np.clip(((np.asarray(similarities) + 1.0) * (HIST_BINS / 2)).astype(np.int64), 0, HIST_BINS - 1)
+
+
+def _bin_edge(index):
+    return -1.0 + 2.0 * index / HIST_BINS
+
+
+def impostor_histogram(embeddings, labels, block_size=CALIBRATION_BLOCK_SIZE):
+    """
+    Histogram (HIST_BINS ô) độ tương đồng cosine của mọi cặp embedding có nhãn khác nhau, mỗi cặp đếm một lần.
+    embeddings [N, dim] (chuẩn hóa lại ở đây), labels [N] (student_id).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    labels = np.asarray(labels).astype(str)
+    n = len(embeddings)
+    counts = np.zeros(HIST_BINS, dtype=np.int64)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        # Khối hàng [start, end) với các cột [start, n): chỉ lấy cột > hàng để mỗi cặp xuất hiện một lần
+        similarities = embeddings[start:end] @ embeddings[start:].T
+        upper = np.arange(start, n)[None, :] > np.arange(start, end)[:, None]
+        impostor = upper & (labels[start:end, None] != labels[None, start:])
+        counts += np.bincount(_bin_of(similarities[impostor]), minlength=HIST_BINS)
+    return counts
+
+
+def far_curve(histogram, thresholds):
+    """Tỉ lệ cặp khác người có độ tương đồng >= từng ngưỡng (sai số một ô histogram)."""
+    total = histogram.sum()
+    if total == 0:
+        return np.zeros(len(thresholds))
+    tail = np.cumsum(histogram[::-1])[::-1]
+    return tail[_bin_of(thresholds)] / total
+
+
+def threshold_for_far(histogram, target_far):
+    """Ngưỡng nhỏ nhất (cạnh dưới của một ô) mà FAR trên histogram không quá target_far."""
+    total = histogram.sum()
+    tail = np.cumsum(histogram[::-1])[::-1] / max(total, 1)
+    within = np.flatnonzero(tail <= target_far)
+    index = int(within[0]) if len(within) else HIST_BINS - 1
+    return _bin_edge(index), float(tail[index])
+
+
+def calibrate(embeddings, labels, target_far=CALIBRATION_TARGET_FAR, block_size=CALIBRATION_BLOCK_SIZE):
+    """Ngưỡng của một danh sách học sinh từ phân bố mạo danh. Quá ít cặp thì dùng default_threshold()."""
+    if not CALIBRATION_ENABLED or len(embeddings) < 2:
+        return Calibration(default_threshold(), 0, None)
+    histogram = impostor_histogram(embeddings, labels, block_size)
+    pairs = int(histogram.sum())
+    if pairs < CALIBRATION_MIN_PAIRS:
+        return Calibration(default_threshold(), 0, None)
+    threshold, _ = threshold_for_far(histogram, target_far)
+    threshold = min(max(threshold, CALIBRATION_MIN_SIMILARITY), CALIBRATION_MAX_SIMILARITY)
+    far = float(far_curve(histogram, [threshold])[0])
+    return Calibration(float(threshold), pairs, far)
+
+
+def _sample_vectors(faiss_index, id_mapping, max_vectors, seed=0):
+    """
+    (embeddings, labels) của cả chỉ mục, hoặc của max_vectors vector chọn ngẫu nhiên nếu chỉ mục lớn hơn:
+    không chép cả chỉ mục (có thể đang mmap) vào RAM, và số cặp giảm từ N² xuống max_vectors².
+    """
+    n = faiss_index.ntotal
+    if n <= max_vectors:
+        return faiss_index.reconstruct_n(0, n), id_mapping
+    rows = np.sort(np.random.default_rng(seed).choice(n, max_vectors, replace=False))
+    embeddings = np.vstack([faiss_index.reconstruct(int(row)) for row in rows])
+    return embeddings, [id_mapping[row] for row in rows]
+
+
+def calibrate_index(faiss_index, id_mapping, max_vectors=CALIBRATION_MAX_VECTORS):
+    """
+    Hiệu chỉnh từ các vector của một chỉ mục Faiss phẳng (đã chuẩn hóa) và ánh xạ student_id của nó.
+    Chỉ mục hơn max_vectors vector thì ước lượng FAR trên một mẫu ngẫu nhiên.
+    """
+    if faiss_index is None or faiss_index.ntotal < 2 or id_mapping is None:
+        return Calibration(default_threshold(), 0, None)
+    try:
+        embeddings, id_mapping = _sample_vectors(faiss_index, id_mapping, max_vectors)
+    except RuntimeError as e:
+        # Chỉ mục không hỗ trợ reconstruct (ví dụ chỉ mục nén): giữ ngưỡng cố định
+        logging.warning(f"Không thể đọc vector từ chỉ mục để hiệu chỉnh ngưỡng: {e}")
+        return Calibration(default_threshold(), 0, None)
+    calibration = calibrate(embeddings, id_mapping)
+    if calibration.pairs:
+        logging.info(f"Ngưỡng nhận diện hiệu chỉnh: {calibration.threshold:.3f} "
+                     f"(FAR {calibration.far:.2e} trên {calibration.pairs} cặp khác người).")
+    return calibration
+
+
+def open_set_match(similarities, neighbor_ids, threshold, margin=RECOGNITION_MARGIN):
+    """
+    Quyết định open-set cho một lô truy vấn từ k láng giềng gần nhất.
+    similarities [Q, k] giảm dần theo hàng (-inf cho ô không có láng giềng), neighbor_ids [Q, k] (student_id).
+    Trả về (accepted [Q], ambiguous [Q]): accepted = top-1 đạt ngưỡng và cách học sinh khác gần nhất ít nhất margin;
+    ambiguous = đạt ngưỡng nhưng không đủ cách biệt (bị coi là người lạ).
+    """
+    similarities = np.asarray(similarities, dtype=np.float32)
+    neighbor_ids = np.asarray(neighbor_ids).astype(str)
+    top1 = similarities[:, 0]
+    # Láng giềng gần nhất thuộc học sinh khác top-1 (một học sinh có thể có nhiều vector)
+    others = np.where(neighbor_ids != neighbor_ids[:, :1], similarities, -np.inf)
+    runner_up = others.max(axis=1) if others.shape[1] else np.full(len(top1), -np.inf)
+    matched = top1 >= threshold
+    separated = top1 - runner_up >= margin
+    return matched & separated, matched & ~separated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m calibration",
+                                     description="Hiệu chỉnh ngưỡng nhận diện theo danh sách học sinh hiện tại.")
+    parser.add_argument("--target-far", type=float, default=CALIBRATION_TARGET_FAR)
+    args = parser.parse_args(argv)
+
+    import faiss_manager
+    faiss_index, id_mapping = faiss_manager.load_index()
+    if faiss_index is None or faiss_index.ntotal < 2:
+        print("[Calibration] Chỉ mục có ít hơn 2 vector, dùng ngưỡng cố định "
+              f"{default_threshold():.3f}.")
+        return 0
+    embeddings = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+    histogram = impostor_histogram(embeddings, id_mapping)
+    thresholds = np.round(np.arange(0.20, 0.76, 0.05), 2)
+    print(f"[Calibration] {faiss_index.ntotal} vector, {int(histogram.sum())} cặp khác người.")
+    print(f"{'Ngưỡng':>8} {'FAR':>10}")
+    for threshold, far in zip(thresholds, far_curve(histogram, thresholds)):
+        print(f"{threshold:>8.2f} {far:>10.2e}")
+    threshold, far = threshold_for_far(histogram, args.target_far)
+    clamped = min(max(threshold, CALIBRATION_MIN_SIMILARITY), CALIBRATION_MAX_SIMILARITY)
+    print(f"[Calibration] Ngưỡng cho FAR <= {args.target_far:g}: {threshold:.3f} (FAR {far:.2e}); "
+          f"sau khi kẹp: {clamped:.3f}.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
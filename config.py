@@ -2,6 +2,34 @@
 
 import psutil
 
+# Các mức cấu hình theo phần cứng (dùng chung cho get_optimal_config và bộ benchmark)
+CONFIG_TIERS = {
+    # Cấu hình cho máy cấu hình cao (High-end)
+    "High-end": {
+        "SKIP_FRAMES": 5,
+        "RESIZE_FACTOR": 0.7,
+        "DET_SIZE": (320, 320),
+        "MAX_WORKERS": 4,  # Dùng nhiều luồng hơn
+        "FACE_DETECTOR": "SCRFD"
+    },
+    # Cấu hình cho máy tầm trung (Mid-range)
+    "Mid-range": {
+        "SKIP_FRAMES": 10,
+        "RESIZE_FACTOR": 0.6,
+        "DET_SIZE": (320, 320),
+        "MAX_WORKERS": 2,  # Mặc định
+        "FACE_DETECTOR": "SCRFD"
+    },
+    # Cấu hình cho máy cấu hình thấp (Low-end)
+    "Low-end": {
+        "SKIP_FRAMES": 15,
+        "RESIZE_FACTOR": 0.4,
+        "DET_SIZE": (160, 160),
+        "MAX_WORKERS": 1,  # Chỉ dùng 1 luồng để tiết kiệm tài nguyên
+        "FACE_DETECTOR": "SCRFD (cascade)"  # Cảnh trống/thưa không phải chạy SCRFD đầy đủ
+    },
+}
+
 def get_optimal_config():
     # Lấy số nhân vật lý của CPU và tổng RAM (GB)
     cpu_count = psutil.cpu_count(logical=False) # Ưu tiên nhân vật lý
@@ -10,33 +38,14 @@ def get_optimal_config():
         
     mem_gb = psutil.virtual_memory().total / (1024 ** 3)
 
-    # Cấu hình cho máy cấu hình cao (High-end)
     if mem_gb >= 16 and cpu_count >= 8:
-        print("[Config] Chế độ cấu hình: High-end")
-        return {
-            "SKIP_FRAMES": 5,
-            "RESIZE_FACTOR": 0.7,
-            "DET_SIZE": (320, 320),
-            "MAX_WORKERS": 4  # Dùng nhiều luồng hơn
-        }
-    # Cấu hình cho máy tầm trung (Mid-range)
+        tier = "High-end"
     elif mem_gb >= 8 and cpu_count >= 4:
-        print("[Config] Chế độ cấu hình: Mid-range")
-        return {
-            "SKIP_FRAMES": 10,
-            "RESIZE_FACTOR": 0.6,
-            "DET_SIZE": (320, 320),
-            "MAX_WORKERS": 2  # Mặc định
-        }
-    # Cấu hình cho máy cấu hình thấp (Low-end)
+        tier = "Mid-range"
     else:
-        print("[Config] Chế độ cấu hình: Low-end")
-        return {
-            "SKIP_FRAMES": 15,
-            "RESIZE_FACTOR": 0.4,
-            "DET_SIZE": (160, 160),
-            "MAX_WORKERS": 1  # Chỉ dùng 1 luồng để tiết kiệm tài nguyên
-        }
+        tier = "Low-end"
+    print(f"[Config] Chế độ cấu hình: {tier}")
+    return dict(CONFIG_TIERS[tier])
 
 # Lấy cấu hình và gán vào các biến
 config = get_optimal_config()
@@ -44,22 +53,149 @@ SKIP_FRAMES = config["SKIP_FRAMES"]
 RESIZE_FACTOR = config["RESIZE_FACTOR"]
 DET_SIZE = config["DET_SIZE"]
 MAX_WORKERS = config["MAX_WORKERS"] # Thêm biến mới
+FACE_DETECTOR = config["FACE_DETECTOR"]
 
 # Các hằng số khác
-RECOGNITION_TOLERANCE = 0.6
+RECOGNITION_TOLERANCE = 0.6   # Khoảng cách cosine (1 - S) tối đa; ngưỡng mặc định khi không hiệu chỉnh được
 MOTION_THRESHOLD = 25
 DB_NAME = 'student_faces.db'
 
-# Danh sách thuật toán phát hiện khuôn mặt
+# Tải chỉ mục Faiss bằng memory-map (nhiều tiến trình dùng chung page cache, khởi động gần như tức thì)
+FAISS_USE_MMAP = True
+
+# Nhận diện open-set (calibration.py): tìm k láng giềng, nhận học sinh top-1 khi độ tương đồng đạt ngưỡng của
+# danh sách và cách học sinh khác gần nhất ít nhất RECOGNITION_MARGIN
+RECOGNITION_TOP_K = 5
+RECOGNITION_MARGIN = 0.05
+# Ngưỡng theo danh sách, hiệu chỉnh từ độ tương đồng giữa các học sinh đã đăng ký (phân bố mạo danh)
+CALIBRATION_ENABLED = True
+CALIBRATION_TARGET_FAR = 1e-3        # Tỉ lệ cặp khác người được phép vượt ngưỡng
+CALIBRATION_MIN_SIMILARITY = 0.30    # Kẹp ngưỡng hiệu chỉnh trong khoảng này
+CALIBRATION_MAX_SIMILARITY = 0.60
+CALIBRATION_MIN_PAIRS = 100          # Ít cặp hơn (~15 học sinh) thì dùng ngưỡng mặc định
+CALIBRATION_BLOCK_SIZE = 1024        # Số hàng mỗi khối khi tính độ tương đồng mọi cặp
+CALIBRATION_MAX_VECTORS = 4000       # Chỉ mục lớn hơn thì hiệu chỉnh trên một mẫu ngẫu nhiên bấy nhiêu vector
+CALIBRATION_RECALIBRATE_FRACTION = 0.05  # Số vector đổi ít hơn tỉ lệ này so với lần hiệu chỉnh trước thì giữ ngưỡng
+
+# Phạm vi tìm kiếm theo nguồn (faiss_manager.parse_scope): "năm học/lớp", "lớp" hoặc "năm học/*".
+# Nguồn được nhận diện trong chỉ mục con của phạm vi (chỉ học sinh lớp đó); nguồn không có trong SOURCE_SCOPES
+# dùng DEFAULT_SCOPE ("" = toàn trường). Phạm vi không có học sinh nào dùng chỉ mục chung.
+SOURCE_SCOPES = {}                   # Ví dụ {"camera:0": "2025-2026/10A"}
+DEFAULT_SCOPE = ""
+SCOPE_FALLBACK_UNKNOWN = False       # True: khuôn mặt không thuộc phạm vi được tìm lại trong chỉ mục chung
+
+# Bộ nhớ đệm kết quả nhận diện cho các khuôn mặt lặp lại (so khớp bằng tích vô hướng với vài chục vector gần nhất)
+RECOGNITION_CACHE_SIZE = 48          # Số vector tối đa giữ trong cache
+RECOGNITION_CACHE_TTL = 5.0          # Thời gian sống của một mục (giây)
+RECOGNITION_CACHE_SIMILARITY = 0.85  # Độ tương đồng cosine tối thiểu để dùng lại kết quả
+# Mẫu đăng ký (embedding + ảnh crop + ảnh chân dung) của các khung hình vừa nhận diện, để đăng ký học sinh
+# từ khuôn mặt đang chọn mà không chạy lại model
+FRAME_SAMPLE_CACHE_SIZE = 16         # Số khung hình gần nhất được giữ
+FRAME_SAMPLE_TTL = 10.0              # Thời gian sống của một khung hình (giây)
+ENROLL_PHOTO_MARGIN = 0.6            # Lề của ảnh chân dung quanh khuôn mặt (tỉ lệ theo cạnh hộp, mỗi phía)
+
+# Điểm danh: gom các lần nhận diện thành khoảng thời gian có mặt của từng học sinh
+ATTENDANCE_MIN_DWELL = 3.0        # Thời gian có mặt tối thiểu (giây) để ghi nhận một khoảng
+ATTENDANCE_GAP = 10.0             # Vắng mặt quá khoảng này (giây) thì đóng khoảng hiện tại
+ATTENDANCE_FLUSH_INTERVAL = 5.0   # Chu kỳ ghi xuống CSDL của luồng nền (giây)
+ATTENDANCE_BATCH_SIZE = 200       # Số sự kiện tối đa trong một transaction
+ATTENDANCE_MAX_RETRIES = 5        # Số lần ghi thất bại liên tiếp (ví dụ CSDL đang bị khóa) trước khi bỏ lô
+ATTENDANCE_MAX_PENDING = 5000     # Số sự kiện tối đa giữ lại chờ ghi lại; vượt thì bỏ sự kiện cũ nhất
+
+# Chu kỳ ghi tóm tắt số đo hiệu năng (p50/p95/p99, bộ đếm) vào performance.log (giây)
+METRICS_LOG_INTERVAL = 60
+
+# Xuất số đo dạng Prometheus qua HTTP cục bộ (tắt mặc định; bật bằng --metrics-port khi chạy)
+METRICS_EXPORTER_ENABLED = False
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Dịch vụ nhận diện không giao diện (recognition_server.py)
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+SERVER_WORKERS = 4                   # Số luồng xử lý yêu cầu HTTP tối đa
+SERVER_MAX_BATCH = 8                 # Số ảnh tối đa gom vào một lần gọi model
+SERVER_MAX_WAIT_MS = 10              # Thời gian chờ tối đa để gom lô (ms)
+SERVER_MAX_BODY_BYTES = 32 * 1024 * 1024
+
+# Vòng lặp đọc video cho GUI: "qthread" (VideoThread, vòng lặp chặn) hoặc "async" (AsyncVideoThread, asyncio)
+VIDEO_PIPELINE = "qthread"
+
+# Tua video
+VIDEO_FRAME_CACHE_SIZE = 12          # Số khung hình đã giải mã giữ lại quanh vị trí hiện tại (LRU)
+VIDEO_SEEK_FORWARD_LIMIT = 60        # Tua tiến tối đa bấy nhiêu khung thì giải mã tiến thay vì cap.set
+
+# Dòng thời gian nhận diện tính trước cho video (recognition_timeline.py)
+TIMELINE_FRAME_STEP = SKIP_FRAMES    # Xử lý mỗi bấy nhiêu khung hình một lần
+TIMELINE_BATCH_SIZE = 8              # Số khung hình mỗi lần gọi recognize_batch
+
+# Danh sách thuật toán phát hiện khuôn mặt (tên backend trong face_backends.DETECTORS)
 FACE_DETECTION_ALGORITHMS = [
-    "Haar Cascade",
-    "MTCNN",
-    "Dlib HOG"
+    "SCRFD",
+    "SCRFD (cascade)",
+    "YuNet",
+    "Haar Cascade"
 ]
 
-# Danh sách thuật toán nhận diện khuôn mặt
+# Danh sách thuật toán nhận diện khuôn mặt (tên backend trong face_backends.RECOGNIZERS)
 FACE_RECOGNITION_ALGORITHMS = [
-    "ArcFace",
-    "FaceNet",
-    "OpenFace"
-]
\ No newline at end of file
+    "ArcFace (buffalo_sc)",
+    "ArcFace (buffalo_l)"
+]
+
+# Backend mặc định khi khởi động
+DEFAULT_FACE_DETECTOR = FACE_DETECTOR
+DEFAULT_FACE_RECOGNIZER = FACE_RECOGNITION_ALGORITHMS[0]
+# Backend dùng khi đăng ký học sinh: face_encoding trong CSDL (và chỉ mục Faiss dựng từ đó) thuộc không gian
+# embedding của ENROLLMENT_RECOGNIZER, bất kể backend đang chọn để nhận diện trực tiếp
+ENROLLMENT_DETECTOR = "SCRFD"
+ENROLLMENT_RECOGNIZER = "ArcFace (buffalo_sc)"
+# (Sau khi mã hóa lại bằng embedding_migration, CSDL ghi model_id của từng face_encoding và FaceProcessor
+# đăng ký bằng recognizer của model_id đó thay cho ENROLLMENT_RECOGNIZER.)
+
+# Haar Cascade: cạnh khuôn mặt nhỏ nhất (pixel, trên ảnh đã thu nhỏ RESIZE_FACTOR)
+HAAR_MIN_FACE = 24
+# YuNet (cv2.FaceDetectorYN): file ONNX từ opencv_zoo và ngưỡng điểm
+YUNET_MODEL_PATH = "models/face_detection_yunet_2023mar.onnx"
+YUNET_SCORE_THRESHOLD = 0.6
+
+# Phát hiện hai tầng "SCRFD (cascade)": detector rẻ quyết định có chạy SCRFD đầy đủ không và chạy ở vùng nào
+CASCADE_GATE = "SCRFD-small"       # "SCRFD-small" (SCRFD với ảnh vào CASCADE_GATE_SIZE), "Haar Cascade" hoặc "YuNet"
+CASCADE_GATE_SIZE = None           # None = một nửa DET_SIZE, làm tròn xuống bội số 32 (tối thiểu 64)
+CASCADE_GATE_MIN_SCORE = 0.5       # Ứng viên của tầng rẻ dưới ngưỡng này bị bỏ qua
+CASCADE_ACCEPT_SCORE = 0.8         # Mọi ứng viên đạt ngưỡng này (tầng rẻ có điểm mốc) thì dùng luôn, không chạy SCRFD đầy đủ
+CASCADE_ROI_MARGIN = 0.5           # Mở rộng hộp ứng viên (tỉ lệ theo cạnh) khi cắt vùng cho SCRFD đầy đủ
+CASCADE_MAX_ROI_FRACTION = 0.6     # Vùng cắt lớn hơn tỉ lệ diện tích khung này thì chạy SCRFD trên cả khung
+CASCADE_REFRESH_FRAMES = 30        # Cứ bấy nhiêu lần gọi thì chạy SCRFD đầy đủ một lần (0 = không bao giờ)
+
+# Chấm chất lượng khuôn mặt trước khi tính embedding (face_quality.py); kích thước tính trên ảnh đã thu nhỏ
+QUALITY_FILTER_ENABLED = True
+QUALITY_MIN_SIZE = 24              # Cạnh ngắn tối thiểu của hộp (pixel)
+QUALITY_GOOD_SIZE = 64             # Từ kích thước này trở lên không bị trừ điểm
+QUALITY_MIN_BLUR = 20.0            # Phương sai Laplacian tối thiểu (thấp hơn là mờ)
+QUALITY_GOOD_BLUR = 150.0
+QUALITY_MAX_YAW = 0.6              # |mũi - giữa hai mắt| / nửa khoảng cách hai mắt
+QUALITY_MIN_DET_SCORE = 0.5
+# Theo dõi khuôn mặt giữa các lần xử lý để dùng lại kết quả và ảnh crop tốt nhất
+QUALITY_TRACK_IOU = 0.3            # IoU tối thiểu để coi là cùng một khuôn mặt
+QUALITY_TRACK_TTL = 2.0            # Track không thấy lại sau bấy nhiêu giây thì bị bỏ
+QUALITY_RESULT_TTL = 3.0           # Kết quả nhận diện của track được dùng lại tối đa bấy nhiêu giây
+QUALITY_ENROLL_MATCH = 0.5         # Cosine tối thiểu giữa ảnh đăng ký và crop tốt nhất của track để dùng crop đó
+
+# Kho ảnh khuôn mặt đã căn chỉnh của học sinh đã đăng ký (crop_store.py), để tính lại embedding không cần phát hiện
+CROP_STORE_FILE = "face_crops.npy"
+CROP_SIZE = 112
+CROP_STORE_BATCH_SIZE = 64           # Số ảnh crop mỗi lần gọi model khi tính lại embedding
+
+# Mã hóa lại toàn bộ học sinh bằng mô hình nhận diện khác (embedding_migration.py)
+MIGRATION_BATCH_SIZE = CROP_STORE_BATCH_SIZE
+MIGRATION_WORKERS = 2                # Số lô tính song song; không dùng executor nhận diện trực tiếp
+MIGRATION_MAX_PASSES = 3             # Số lượt tính bù cho học sinh được thêm/sửa trong lúc đang mã hóa lại
+
+# Kho ảnh đăng ký (image_store.py): images/{mã}.jpg + images/thumbs/{mã}.jpg, gói zip tùy chọn
+IMAGE_DIR = "images"
+ENROLL_IMAGE_SIZE = (320, 320)       # Ảnh đăng ký được thu về kích thước này trước khi lưu
+THUMBNAIL_SIZE = 64                  # Cạnh dài của ảnh thu nhỏ trong danh sách học sinh
+IMAGE_JPEG_QUALITY = 95
+IMAGE_CACHE_SIZE = 256               # Số ảnh đã giải mã giữ trong LRU
+IMAGE_ARCHIVE_FILE = "images.zip"
@@ -0,0 +1,288 @@
+# crop_store.py
+"""
+Kho ảnh khuôn mặt đã căn chỉnh (112x112, kèm 5 điểm mốc trong hệ tọa độ của ảnh crop) cho mỗi học sinh đã đăng ký.
+Khi đổi model nhận diện hoặc dựng lại dữ liệu đăng ký, embedding của cả danh sách được tính lại bằng các lô
+get_feat trực tiếp trên kho này, không phải đọc lại ảnh trong images/ và chạy phát hiện khuôn mặt.
+
+Định dạng: một file .npy (mảng bản ghi cố định kích thước) mở bằng memory-map:
+    student_id  U32
+    crop        uint8 [112, 112, 3]   (BGR, như face_align.norm_crop)
+    landmarks   float32 [5, 2]        (NaN nếu ảnh crop không căn theo điểm mốc)
+    valid       uint8                 (0 = ô trống, dùng lại khi thêm)
+Sửa/xóa ghi thẳng vào ô của học sinh; khi đầy thì ghi file mới gấp đôi dung lượng rồi os.replace.
+GUI và recognition_server cùng ghi một kho: mỗi lần ghi giữ khóa file (<kho>.lock) và đọc lại bảng ô trống
+trước khi chọn ô; lần đọc thấy file đã bị tiến trình khác thay (inode/kích thước khác) thì mở lại memory-map.
+
+Chạy `python -m crop_store --backfill` để tạo ảnh crop cho các học sinh đăng ký trước khi có kho này
+(phát hiện một lần trên ảnh trong images/).
+"""
+import argparse
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from insightface.utils import face_align
+
+from config import CROP_STORE_FILE, CROP_SIZE, CROP_STORE_BATCH_SIZE
+
+RECORD_DTYPE = np.dtype([
+    ("student_id", "U32"),
+    ("crop", np.uint8, (CROP_SIZE, CROP_SIZE, 3)),
+    ("landmarks", np.float32, (5, 2)),
+    ("valid", np.uint8),
+])
+INITIAL_CAPACITY = 64
+
+
+def default_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), CROP_STORE_FILE)
+
+
+@contextmanager
+def _process_lock(path):
+    """Khóa độc quyền giữa các tiến trình trên file path (tạo nếu chưa có), chờ đến khi lấy được."""
+    with open(path, "a+b") as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class CropStore:
+    """
+    Kho ảnh crop theo student_id. An toàn đa luồng trong một tiến trình; nhiều tiến trình cùng ghi
+    được tuần tự hóa bằng khóa file.
+    """
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self.lock_path = self.path + ".lock"
+        self._lock = threading.Lock()
+        self._records = None
+        self._slots = {}      # student_id -> chỉ số bản ghi
+        self._free = []
+        self._file_id = None  # (inode, kích thước) của file đang memory-map
+        self._open()
+
+    def _current_file_id(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size
+
+    def _open(self):
+        """(Mở lại) memory-map và dựng bảng ô từ nội dung file hiện tại."""
+        self._records = None
+        self._slots = {}
+        self._free = []
+        self._file_id = self._current_file_id()
+        if self._file_id is None:
+            return
+        records = np.load(self.path, mmap_mode='r+', allow_pickle=False)
+        if records.dtype != RECORD_DTYPE:
+            logging.warning(f"Kho ảnh crop '{self.path}' có định dạng khác, sẽ được tạo lại.")
+            return
+        self._records = records
+        valid = records["valid"].astype(bool)
+        self._slots = {str(sid): int(slot) for slot, sid in zip(np.flatnonzero(valid), records["student_id"][valid])}
+        self._free = np.flatnonzero(~valid).tolist()
+
+    def _refresh(self):
+        """Mở lại nếu tiến trình khác đã thay file (_grow); gọi khi giữ self._lock."""
+        if self._current_file_id() != self._file_id:
+            self._open()
+
+    def _grow(self):
+        """Ghi file mới gấp đôi dung lượng (file tạm + os.replace) rồi mở lại bằng memory-map; gọi khi giữ khóa file."""
+        old_capacity = 0 if self._records is None else len(self._records)
+        capacity = max(INITIAL_CAPACITY, old_capacity * 2)
+        tmp_path = self.path + ".tmp.npy"
+        records = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=RECORD_DTYPE, shape=(capacity,))
+        if old_capacity:
+            records[:old_capacity] = self._records
+            self._records.flush()
+        records.flush()
+        del records
+        self._records = None
+        os.replace(tmp_path, self.path)
+        self._records = np.load(self.path, mmap_mode='r+', allow_pickle=False)
+        self._file_id = self._current_file_id()
+        self._free.extend(range(old_capacity, capacity))
+
+    def put(self, student_id, crop, landmarks=None):
+        """Thêm hoặc thay ảnh crop của một học sinh."""
+        student_id = str(student_id)
+        if crop.shape != (CROP_SIZE, CROP_SIZE, 3):
+            raise ValueError(f"Ảnh crop phải có kích thước {CROP_SIZE}x{CROP_SIZE}x3, nhận {crop.shape}.")
+        with self._lock, _process_lock(self.lock_path):
+            # Tiến trình khác có thể đã dùng ô trống hoặc thay file kể từ lần đọc trước
+            self._open()
+            slot = self._slots.get(student_id)
+            if slot is None:
+                if not self._free:
+                    self._grow()
+                slot = self._free.pop(0)
+            records = self._records
+            records["student_id"][slot] = student_id
+            records["crop"][slot] = crop
+            records["landmarks"][slot] = np.nan if landmarks is None else np.asarray(landmarks, dtype=np.float32)
+            records["valid"][slot] = 1
+            records.flush()
+            self._slots[student_id] = slot
+
+    def remove(self, student_id):
+        with self._lock, _process_lock(self.lock_path):
+            self._open()
+            slot = self._slots.pop(str(student_id), None)
+            if slot is None:
+                return False
+            self._records["valid"][slot] = 0
+            self._records.flush()
+            self._free.append(slot)
+            return True
+
+    def get(self, student_id):
+        """(crop, landmarks) của học sinh hoặc None. landmarks là None nếu không có."""
+        student_id = str(student_id)
+        with self._lock:
+            self._refresh()
+            slot = self._slots.get(student_id)
+            records = self._records
+            if slot is not None and (not records["valid"][slot] or records["student_id"][slot] != student_id):
+                # Ô đã bị tiến trình khác xóa/dùng lại tại chỗ
+                self._open()
+                slot = self._slots.get(student_id)
+            if slot is None:
+                return None
+            landmarks = np.array(self._records["landmarks"][slot])
+            crop = np.array(self._records["crop"][slot])
+        return crop, (None if np.isnan(landmarks).any() else landmarks)
+
+    def __contains__(self, student_id):
+        with self._lock:
+            self._refresh()
+            return str(student_id) in self._slots
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._slots)
+
+    def ids(self):
+        with self._lock:
+            self._open()
+            return list(self._slots)
+
+    def iter_batches(self, batch_size=CROP_STORE_BATCH_SIZE, student_ids=None):
+        """Sinh các lô (ids, crops [B, 112, 112, 3], landmarks [B, 5, 2]); mặc định mọi học sinh trong kho."""
+        with self._lock:
+            self._open()
+            items = sorted(self._slots.items(), key=lambda item: item[1])
+            if student_ids is not None:
+                wanted = set(str(s) for s in student_ids)
+                items = [item for item in items if item[0] in wanted]
+            records = self._records
+        for start in range(0, len(items), batch_size):
+            chunk = items[start:start + batch_size]
+            slots = np.fromiter((slot for _, slot in chunk), dtype=np.int64, count=len(chunk))
+            # Đọc theo thứ tự ô tăng dần: truy cập tuần tự trên file memory-map
+            batch = records[slots]
+            yield [sid for sid, _ in chunk], np.array(batch["crop"]), np.array(batch["landmarks"])
+
+
+def realign(crops, landmarks, image_size):
+    """
+    Đưa ảnh crop 112x112 về kích thước đầu vào khác của một model nhận diện, căn lại theo điểm mốc
+    (mẫu ArcFace) nếu có, ngược lại chỉ thu/phóng.
+    """
+    output = []
+    for crop, kps in zip(crops, landmarks):
+        if np.isnan(kps).any():
+            output.append(cv2.resize(crop, (image_size, image_size)))
+        else:
+            output.append(face_align.norm_crop(crop, landmark=kps, image_size=image_size))
+    return output
+
+
+def embed_store(recognizer, store=None, batch_size=CROP_STORE_BATCH_SIZE, student_ids=None, should_stop=None):
+    """
+    Tính embedding cho mọi ảnh crop trong kho bằng recognizer (face_backends), theo lô, không phát hiện lại.
+    Trả về (ids, embeddings [N, dim] float32), hoặc None nếu should_stop() trả về True giữa chừng.
+    """
+    if store is None:
+        store = CropStore()
+    all_ids, chunks = [], []
+    for ids, crops, landmarks in store.iter_batches(batch_size, student_ids):
+        if should_stop is not None and should_stop():
+            return None
+        if recognizer.input_size != CROP_SIZE:
+            crops = realign(crops, landmarks, recognizer.input_size)
+        else:
+            crops = list(crops)
+        chunks.append(np.asarray(recognizer.get_feat(crops), dtype=np.float32))
+        all_ids.extend(ids)
+    if not chunks:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return all_ids, np.concatenate(chunks)
+
+
+def backfill_from_images(processor, store=None, students=None):
+    """
+    Tạo ảnh crop cho các học sinh chưa có trong kho, từ ảnh đăng ký (image_path, đọc qua ImageStore nên
+    dùng được cả gói images.zip). Trả về số ảnh đã thêm.
+    """
+    import database_manager as db
+    from image_store import ImageStore
+    if store is None:
+        store = CropStore()
+    images = ImageStore(cache_size=0)
+    students = db.get_all_students() if students is None else students
+    added = 0
+    for student in students:
+        if student["id"] in store or not images.exists(student.get("image_path")):
+            continue
+        image = images.load(student["image_path"])
+        sample = processor.get_single_face_sample(image, []) if image is not None else None
+        if sample is None:
+            print(f"[CropStore] Bỏ qua {student['id']}: không lấy được đúng một khuôn mặt từ ảnh.")
+            continue
+        store.put(student["id"], sample.crop, sample.landmarks)
+        added += 1
+    print(f"[CropStore] Đã thêm {added} ảnh crop, kho có {len(store)} học sinh.")
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m crop_store", description="Kho ảnh khuôn mặt đã căn chỉnh.")
+    parser.add_argument("--backfill", action="store_true",
+                        help="Tạo ảnh crop từ images/ cho các học sinh chưa có trong kho.")
+    args = parser.parse_args(argv)
+    if args.backfill:
+        from face_processor import FaceProcessor
+        processor = FaceProcessor(None, None, [])
+        try:
+            backfill_from_images(processor)
+        finally:
+            processor.shutdown()
+    else:
+        print(f"[CropStore] {default_path()}: {len(CropStore())} học sinh.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
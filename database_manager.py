@@ -3,6 +3,9 @@ import os
 import numpy as np
 from config import DB_NAME 
 
+# Mã hóa ghi trước khi CSDL có cột embedding_model đều được tính bằng buffalo_sc
+LEGACY_EMBEDDING_MODEL = "buffalo_sc"
+
 def get_db_path(db_name=DB_NAME) -> str:
     """Trả về đường dẫn tuyệt đối tới file database trong thư mục chứa file Python"""
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -24,18 +27,73 @@ def create_table():
                 school_year TEXT
             )
         ''')
+        # Không gian embedding của face_encoding (model_id của recognizer, xem face_backends) và số chiều.
+        # CSDL cũ chưa có hai cột này: thêm bằng ALTER TABLE và gắn nhãn buffalo_sc cho các dòng đã có.
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(students)")}
+        for column, column_type in (("embedding_model", "TEXT"), ("embedding_dim", "INTEGER")):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE students ADD COLUMN {column} {column_type}")
+        cursor.execute("""
+            UPDATE students SET embedding_model = ?, embedding_dim = length(face_encoding) / 8
+            WHERE embedding_model IS NULL
+        """, (LEGACY_EMBEDDING_MODEL,))
         # Tạo chỉ mục cho face_encoding
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_face_encoding ON students (face_encoding)')
+        # Bảng phiên bản danh sách: tăng mỗi khi bảng students thay đổi (dùng để đối chiếu với chỉ mục Faiss)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS roster_meta (
+                key TEXT PRIMARY KEY NOT NULL,
+                value INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO roster_meta (key, value) VALUES ('version', 0)")
+        for trigger_name, event in (("students_version_ins", "INSERT"),
+                                    ("students_version_upd", "UPDATE OF id, face_encoding"),
+                                    ("students_version_del", "DELETE")):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {trigger_name} AFTER {event} ON students
+                BEGIN
+                    UPDATE roster_meta SET value = value + 1 WHERE key = 'version';
+                END
+            ''')
+        # Bảng điểm danh: mỗi dòng là một khoảng thời gian có mặt của học sinh
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attendance (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id TEXT NOT NULL,
+                source TEXT,                  -- Nguồn video/camera
+                first_seen REAL NOT NULL,     -- Thời điểm bắt đầu (epoch giây)
+                last_seen REAL NOT NULL,      -- Thời điểm cuối cùng nhìn thấy (epoch giây)
+                duration REAL NOT NULL        -- Thời gian có mặt (giây)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance (student_id, first_seen)')
         conn.commit()
         print(f"[DB] Đã kiểm tra/tạo bảng 'students' và chỉ mục 'idx_face_encoding'.")
 
+def get_roster_version():
+    """
+    Trả về số phiên bản của bảng students (tăng sau mỗi lần thêm/sửa mã hóa/xóa).
+    Trả về None nếu CSDL chưa có bảng roster_meta.
+    """
+    try:
+        with sqlite3.connect(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT value FROM roster_meta WHERE key = 'version'")
+            row = cursor.fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        print(f"[DB Lỗi] Không thể đọc phiên bản danh sách: {e}")
+        return None
+
 def get_all_students():
     """Lấy tất cả học sinh từ CSDL."""
     try:
         with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            cursor.execute("SELECT id, name, dob, class, gender, school_year, stt, image_path, face_encoding FROM students")
+            cursor.execute("SELECT id, name, dob, class, gender, school_year, stt, image_path, face_encoding, "
+                           "embedding_model, embedding_dim FROM students")
             students = []
             while True:
                 rows = cursor.fetchmany(100)
@@ -57,15 +115,21 @@ def get_all_students():
                         "school_year": row["school_year"],
                         "stt": row["stt"],
                         "image_path": row["image_path"],
-                        "face_encoding": face_encoding
+                        "face_encoding": face_encoding,
+                        "embedding_model": row["embedding_model"],
+                        "embedding_dim": row["embedding_dim"]
                     })
         return students
     except sqlite3.Error as e:
         print(f"[DB Lỗi] Không thể lấy danh sách học sinh: {e}")
         return []
 
-def add_student(student_id,name, dob, student_class, face_encoding, gender, school_year, stt, image_path=None):
-    """Thêm một học sinh mới vào CSDL và trả về ID của học sinh đó."""
+def add_student(student_id,name, dob, student_class, face_encoding, gender, school_year, stt, image_path=None,
+                embedding_model=LEGACY_EMBEDDING_MODEL):
+    """
+    Thêm một học sinh mới vào CSDL và trả về ID của học sinh đó.
+    embedding_model: model_id của recognizer đã tính face_encoding (FaceProcessor.enrollment_model_id).
+    """
     try:
         if not student_id or not student_id.strip():
             raise ValueError("ID học sinh không được để trống.")
@@ -76,17 +140,20 @@ def add_student(student_id,name, dob, student_class, face_encoding, gender, scho
             encoding_blob = face_encoding.astype(np.float64).tobytes()
 
             cursor.execute("""
-                INSERT INTO students (id, name, dob, class, face_encoding, gender, school_year, stt, image_path)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (student_id, name, dob, student_class, encoding_blob, gender, school_year, stt, image_path))
+                INSERT INTO students (id, name, dob, class, face_encoding, gender, school_year, stt, image_path,
+                                      embedding_model, embedding_dim)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (student_id, name, dob, student_class, encoding_blob, gender, school_year, stt, image_path,
+                  embedding_model, len(face_encoding)))
             conn.commit()
             return cursor.lastrowid # Trả về ID
     except sqlite3.Error as e:
         print(f"[DB Lỗi] Không thể thêm học sinh {student_id}: {e}")
         return None # Trả về None nếu lỗi
 
-def update_student(student_id, new_name, new_dob, new_class, new_gender, new_school_year, new_stt, new_image_path, face_encoding=None):
-    """Cập nhật tên và lớp cho học sinh dựa trên ID."""
+def update_student(student_id, new_name, new_dob, new_class, new_gender, new_school_year, new_stt, new_image_path, face_encoding=None,
+                   embedding_model=LEGACY_EMBEDDING_MODEL):
+    """Cập nhật tên và lớp cho học sinh dựa trên ID. embedding_model chỉ được ghi cùng face_encoding."""
     try:
         with sqlite3.connect(db_path) as conn:
             cursor = conn.cursor()     
@@ -105,8 +172,8 @@ def update_student(student_id, new_name, new_dob, new_class, new_gender, new_sch
             ]
             if face_encoding is not None:
                 encoding_blob = face_encoding.astype(np.float64).tobytes()
-                query += ", face_encoding = ?"
-                params.append(encoding_blob)
+                query += ", face_encoding = ?, embedding_model = ?, embedding_dim = ?"
+                params.extend([encoding_blob, embedding_model, len(face_encoding)])
 
             query += " WHERE id = ?"
             params.append(student_id)
@@ -130,12 +197,9 @@ def delete_student(student_id):
             row = cursor.fetchone()
 
             if row and row["image_path"]:
-                image_path = row["image_path"]
-                try:
-                    if os.path.exists(image_path):
-                        os.remove(image_path)
-                except OSError as e:
-                    print(f"[DB Lỗi] Không thể xóa ảnh {image_path}: {e}")
+                # Xóa cả ảnh thu nhỏ; ảnh đã bị xóa trước đó không phải lỗi
+                from image_store import ImageStore
+                ImageStore().remove(row["image_path"])
 
             # Thực hiện xóa
             cursor.execute("DELETE FROM students WHERE id = ?", (student_id,))
@@ -146,6 +210,78 @@ def delete_student(student_id):
         print(f"[DB Lỗi] Không thể xóa học sinh ID={student_id}: {e}")
         return False
 
+def get_embedding_model():
+    """
+    model_id của phần lớn face_encoding trong CSDL (không gian embedding của chỉ mục Faiss dựng từ CSDL).
+    Trả về None nếu chưa có học sinh nào.
+    """
+    try:
+        with sqlite3.connect(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT embedding_model FROM students GROUP BY embedding_model
+                ORDER BY COUNT(*) DESC LIMIT 1
+            """)
+            row = cursor.fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        print(f"[DB Lỗi] Không thể đọc mô hình embedding: {e}")
+        return None
+
+def get_stale_encodings(model_id):
+    """Các học sinh có face_encoding chưa thuộc không gian model_id: dict id -> face_encoding (bytes)."""
+    try:
+        with sqlite3.connect(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, face_encoding FROM students WHERE embedding_model IS NOT ?", (model_id,))
+            return {row[0]: row[1] for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        print(f"[DB Lỗi] Không thể đọc mã hóa cần tính lại: {e}")
+        return {}
+
+def replace_encodings(rows, model_id):
+    """
+    Thay face_encoding của nhiều học sinh trong một transaction (chuyển sang không gian model_id).
+    rows: danh sách (student_id, face_encoding mới, face_encoding cũ dạng bytes); dòng nào đã bị sửa/xóa
+    kể từ lúc đọc mã hóa cũ thì được giữ nguyên. Trả về số dòng đã thay, hoặc None nếu lỗi (không thay dòng nào).
+    """
+    try:
+        with sqlite3.connect(db_path) as conn:
+            cursor = conn.cursor()
+            updated = 0
+            for student_id, face_encoding, old_blob in rows:
+                cursor.execute("""
+                    UPDATE students SET face_encoding = ?, embedding_model = ?, embedding_dim = ?
+                    WHERE id = ? AND face_encoding = ?
+                """, (np.asarray(face_encoding).astype(np.float64).tobytes(), model_id, len(face_encoding),
+                      student_id, old_blob))
+                updated += cursor.rowcount
+            conn.commit()
+        return updated
+    except sqlite3.Error as e:
+        print(f"[DB Lỗi] Không thể thay mã hóa sang mô hình {model_id}: {e}")
+        return None
+
+def add_attendance_events(events):
+    """
+    Ghi một lô sự kiện điểm danh trong một transaction duy nhất.
+    events: danh sách tuple (student_id, source, first_seen, last_seen, duration).
+    Trả về True nếu ghi thành công.
+    """
+    if not events:
+        return True
+    try:
+        with sqlite3.connect(db_path) as conn:
+            conn.executemany("""
+                INSERT INTO attendance (student_id, source, first_seen, last_seen, duration)
+                VALUES (?, ?, ?, ?, ?)
+            """, events)
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        print(f"[DB Lỗi] Không thể ghi {len(events)} sự kiện điểm danh: {e}")
+        return False
+
 db_path = get_db_path()
 
 # def get_student_by_id(student_id):
@@ -0,0 +1,177 @@
+# embedding_migration.py
+"""
+Mã hóa lại toàn bộ học sinh bằng một mô hình nhận diện khác trong khi chỉ mục cũ vẫn phục vụ nhận diện.
+
+Mỗi face_encoding trong CSDL được gắn model_id và số chiều (cột embedding_model, embedding_dim); chỉ mục Faiss
+chỉ dựng từ mã hóa của một mô hình. EmbeddingMigration chạy hai bước:
+- run() (luồng nền): tính embedding mới từ kho ảnh crop (crop_store), tạo ảnh crop từ images/ cho học sinh
+  chưa có, theo các lô chạy song song. Không ghi gì vào CSDL hay chỉ mục.
+- commit() (luồng đăng ký học sinh, ví dụ luồng GUI): tính bù học sinh được thêm/sửa trong lúc chạy, thay mọi
+  face_encoding trong một transaction, dựng chỉ mục của mô hình mới rồi chuyển FaceProcessor sang bằng
+  swap_snapshot + set_enrollment_recognizer (mỗi bước là một phép gán, luồng nhận diện không phải dừng).
+  Chỉ chuyển khi mọi học sinh đã được mã hóa lại; học sinh không tính lại được (thiếu ảnh) sẽ bị loại khỏi
+  chỉ mục mới nên commit() ném MigrationIncomplete kèm danh sách, và chỉ chuyển khi người dùng chấp nhận
+  đúng danh sách đó (commit(accept_excluded=...)). Cho tới lúc đó chỉ mục cũ vẫn phục vụ.
+
+Chạy `python -m embedding_migration "ArcFace (buffalo_l)"` để mã hóa lại không cần giao diện
+(thêm --accept-excluded để chuyển dù có học sinh không tính lại được).
+"""
+import argparse
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import database_manager as db
+import faiss_manager
+import metrics
+from config import MIGRATION_BATCH_SIZE, MIGRATION_WORKERS, MIGRATION_MAX_PASSES
+from crop_store import CropStore, backfill_from_images, embed_store
+
+# migrated: số học sinh đã chuyển sang model_id; skipped: số học sinh giữ mã hóa cũ (không có ảnh crop/ảnh gốc)
+MigrationResult = namedtuple("MigrationResult", ["model_id", "migrated", "skipped",
+                                                 "faiss_index", "id_mapping", "students"])
+
+
+class MigrationError(RuntimeError):
+    """Không thể chuyển CSDL sang mô hình mới; CSDL và chỉ mục được giữ nguyên."""
+
+
+class MigrationIncomplete(MigrationError):
+    """Còn học sinh chưa mã hóa lại được (excluded: danh sách student_id); chưa chuyển gì."""
+    def __init__(self, excluded):
+        self.excluded = excluded
+        super().__init__(f"{len(excluded)} học sinh không mã hóa lại được (thiếu ảnh crop và ảnh gốc) "
+                         "và sẽ không được nhận diện sau khi chuyển.")
+
+
+class EmbeddingMigration:
+    """
+    Mã hóa lại CSDL bằng recognizer recognizer_name (tên trong config.FACE_RECOGNITION_ALGORITHMS).
+    progress(done, total) được gọi sau mỗi lô; stop() dừng run() sau lô đang chạy.
+    """
+    def __init__(self, processor, recognizer_name, store=None, batch_size=MIGRATION_BATCH_SIZE,
+                 workers=MIGRATION_WORKERS, progress=None):
+        self.processor = processor
+        self.recognizer_name = recognizer_name
+        self.store = CropStore() if store is None else store
+        self.batch_size = batch_size
+        self.workers = workers
+        self.progress = progress
+        self.recognizer = None
+        self._stopped = False
+        self._computed = {}   # student_id -> (embedding mới, face_encoding cũ dạng bytes lúc tính)
+
+    def stop(self):
+        self._stopped = True
+
+    def _embed(self, stale):
+        """
+        Tính embedding cho các học sinh trong stale (id -> face_encoding cũ) chưa tính, hoặc đã đổi mã hóa
+        kể từ lần tính trước. Trả về số học sinh đã tính.
+        """
+        pending = {sid: blob for sid, blob in stale.items()
+                   if sid not in self._computed or self._computed[sid][1] != blob}
+        if not pending:
+            return 0
+        missing = [s for s in db.get_all_students() if s["id"] in pending and s["id"] not in self.store]
+        if missing:
+            backfill_from_images(self.processor, self.store, missing)
+        ids = [sid for sid in pending if sid in self.store]
+        chunks = [ids[start:start + self.batch_size] for start in range(0, len(ids), self.batch_size)]
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(embed_store, self.recognizer, self.store, self.batch_size, chunk,
+                                       lambda: self._stopped)
+                       for chunk in chunks]
+            for future in as_completed(futures):
+                result = future.result()
+                if result is None:
+                    continue
+                chunk_ids, embeddings = result
+                for sid, embedding in zip(chunk_ids, embeddings):
+                    self._computed[sid] = (embedding, pending[sid])
+                done += len(chunk_ids)
+                if self.progress is not None:
+                    self.progress(done, len(ids))
+        return done
+
+    def run(self):
+        """Bước chạy nền: nạp recognizer và tính embedding mới cho mọi học sinh. Trả về False nếu bị dừng."""
+        self.recognizer = self.processor.load_recognizer(self.recognizer_name)
+        with metrics.timer("migration_embed"):
+            computed = self._embed(db.get_stale_encodings(self.recognizer.model_id))
+        logging.info(f"Đã tính {computed} embedding {self.recognizer.model_id} để mã hóa lại CSDL.")
+        return not self._stopped
+
+    def commit(self, accept_excluded=()):
+        """
+        Chuyển CSDL, chỉ mục và FaceProcessor sang mô hình mới. Gọi trên luồng đăng ký học sinh để không có
+        học sinh nào được thêm bằng mô hình cũ sau lượt tính bù cuối.
+        Ném MigrationIncomplete nếu còn học sinh không tính lại được mà không nằm trong accept_excluded
+        (danh sách người dùng đã chấp nhận loại khỏi chỉ mục mới); khi đó không chuyển gì.
+        """
+        if self.recognizer is None:
+            raise MigrationError("Chưa chạy run().")
+        model_id = self.recognizer.model_id
+        for _ in range(MIGRATION_MAX_PASSES):
+            if not self._embed(db.get_stale_encodings(model_id)):
+                break
+
+        stale = db.get_stale_encodings(model_id)
+        rows = [(sid, embedding, blob) for sid, (embedding, blob) in self._computed.items()
+                if stale.get(sid) == blob]
+        computed = {sid for sid, _, _ in rows}
+        excluded = sorted(sid for sid in stale if sid not in computed)
+        if stale and not rows:
+            raise MigrationError("Không mã hóa lại được học sinh nào (thiếu ảnh crop và ảnh gốc).")
+        if not set(excluded) <= set(accept_excluded):
+            raise MigrationIncomplete(excluded)
+        with metrics.timer("migration_commit"):
+            migrated = db.replace_encodings(rows, model_id)
+            if migrated is None:
+                raise MigrationError("Không thể ghi mã hóa mới vào CSDL.")
+            faiss_manager.build_and_save_index()
+            faiss_index, id_mapping = faiss_manager.load_index()
+            students = db.get_all_students()
+            self.processor.swap_snapshot(faiss_index, id_mapping, students, model_id)
+            self.processor.set_enrollment_recognizer(self.recognizer_name)
+        skipped = len(stale) - migrated
+        print(f"[Migration] Đã chuyển {migrated} học sinh sang {model_id}"
+              + (f", {skipped} học sinh giữ mã hóa cũ." if skipped else "."))
+        return MigrationResult(model_id, migrated, skipped, faiss_index, id_mapping, students)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m embedding_migration",
+                                     description="Mã hóa lại toàn bộ học sinh bằng một mô hình nhận diện khác.")
+    parser.add_argument("recognizer", help="Tên recognizer, ví dụ \"ArcFace (buffalo_l)\".")
+    parser.add_argument("--accept-excluded", action="store_true",
+                        help="Vẫn chuyển khi có học sinh không mã hóa lại được (họ bị loại khỏi chỉ mục mới).")
+    args = parser.parse_args(argv)
+
+    from face_processor import FaceProcessor
+    db.create_table()
+    faiss_index, id_mapping = faiss_manager.load_index()
+    processor = FaceProcessor(faiss_index, id_mapping, db.get_all_students())
+    try:
+        migration = EmbeddingMigration(processor, args.recognizer,
+                                       progress=lambda done, total: print(f"[Migration] {done}/{total}"))
+        migration.run()
+        try:
+            migration.commit()
+        except MigrationIncomplete as e:
+            print(f"[Migration] Không mã hóa lại được: {', '.join(e.excluded)}")
+            if not args.accept_excluded:
+                raise
+            migration.commit(accept_excluded=e.excluded)
+    except MigrationError as e:
+        print(f"[Migration Lỗi] {e}")
+        return 1
+    finally:
+        processor.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
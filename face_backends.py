@@ -0,0 +1,340 @@
+# face_backends.py
+"""
+Các backend phát hiện (detector) và nhận diện (recognizer) khuôn mặt, đăng ký theo tên hiển thị
+trong config.FACE_DETECTION_ALGORITHMS / FACE_RECOGNITION_ALGORITHMS để FaceProcessor đổi lúc chạy.
+
+Detector.detect(img) -> (bboxes [N, 5] float32 (x1, y1, x2, y2, score), kpss [N, 5, 2] hoặc None),
+cùng định dạng với det_model.detect của InsightFace. 5 điểm mốc theo thứ tự của ArcFace
+(mắt trái, mắt phải, mũi, khóe miệng trái, khóe miệng phải - theo ảnh).
+
+Recognizer: model_id là khóa không gian embedding (embedding của hai model_id khác nhau không so sánh
+được với nhau, nên mỗi model_id có chỉ mục Faiss riêng); crop(img, bbox, kps) -> ảnh đã căn chỉnh;
+get_feat(crops) -> [N, dim].
+"""
+import itertools
+import logging
+import math
+import os
+import threading
+
+import cv2
+import numpy as np
+import insightface
+from insightface.utils import face_align
+
+import metrics
+from config import (DET_SIZE, HAAR_MIN_FACE, YUNET_MODEL_PATH, YUNET_SCORE_THRESHOLD,
+                    CASCADE_GATE, CASCADE_GATE_SIZE, CASCADE_GATE_MIN_SCORE, CASCADE_ACCEPT_SCORE,
+                    CASCADE_ROI_MARGIN, CASCADE_MAX_ROI_FRACTION, CASCADE_REFRESH_FRAMES)
+
+DETECTORS = {}
+RECOGNIZERS = {}
+# Tên recognizer -> model_id, biết được mà không cần nạp model (ví dụ để chọn recognizer theo CSDL)
+RECOGNIZER_MODEL_IDS = {}
+
+
+class BackendUnavailable(RuntimeError):
+    """Backend đã đăng ký nhưng không dùng được trên máy này (thiếu file model, OpenCV quá cũ...)."""
+
+
+def register_detector(name):
+    def decorator(factory):
+        DETECTORS[name] = factory
+        return factory
+    return decorator
+
+
+def register_recognizer(name, model_id):
+    def decorator(factory):
+        RECOGNIZERS[name] = factory
+        RECOGNIZER_MODEL_IDS[name] = model_id
+        return factory
+    return decorator
+
+
+def recognizer_name_for(model_id):
+    """Tên recognizer đã đăng ký có không gian embedding model_id, hoặc None."""
+    return next((name for name, mid in RECOGNIZER_MODEL_IDS.items() if mid == model_id), None)
+
+
+def create_detector(name, model):
+    """Tạo detector theo tên; model là FaceAnalysis (buffalo_sc) đã nạp của FaceProcessor."""
+    if name not in DETECTORS:
+        raise BackendUnavailable(f"Không có detector '{name}'.")
+    return DETECTORS[name](model)
+
+
+def create_recognizer(name, model):
+    if name not in RECOGNIZERS:
+        raise BackendUnavailable(f"Không có recognizer '{name}'.")
+    return RECOGNIZERS[name](model)
+
+
+def _empty_detection():
+    return np.empty((0, 5), dtype=np.float32), None
+
+
+# ---------------------------------------------------------------- detectors
+
+@register_detector("SCRFD")
+class SCRFDDetector:
+    """
+    SCRFD của gói buffalo_sc (dùng chung model đã nạp), có 5 điểm mốc.
+    input_size=None dùng DET_SIZE đã prepare; kích thước nhỏ hơn (ví dụ 160x160) rẻ hơn nhiều nhưng sót mặt nhỏ.
+    """
+    name = "SCRFD"
+    has_landmarks = True
+
+    def __init__(self, model, input_size=None):
+        self.det_model = model.det_model
+        self.input_size = input_size
+
+    def detect(self, img, input_size=None):
+        return self.det_model.detect(img, input_size=input_size or self.input_size, max_num=0, metric='default')
+
+
+@register_detector("Haar Cascade")
+class HaarDetector:
+    """
+    Haar Cascade của OpenCV: chỉ dùng CPU, rất nhẹ, không có điểm mốc.
+    CascadeClassifier không an toàn đa luồng nên mỗi luồng của executor có một bản riêng.
+    Điểm tin cậy = sigmoid(levelWeight) của tầng cuối, chỉ dùng để xếp hạng.
+    """
+    name = "Haar Cascade"
+    has_landmarks = False
+    CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+    def __init__(self, model=None):
+        self._path = os.path.join(cv2.data.haarcascades, self.CASCADE_FILE)
+        if not os.path.exists(self._path):
+            raise BackendUnavailable(f"Không tìm thấy {self.CASCADE_FILE} trong OpenCV.")
+        self._local = threading.local()
+
+    def _cascade(self):
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(self._path)
+        return cascade
+
+    def detect(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        rects, _, weights = self._cascade().detectMultiScale3(
+            gray, scaleFactor=1.1, minNeighbors=5, minSize=(HAAR_MIN_FACE, HAAR_MIN_FACE),
+            outputRejectLevels=True)
+        if len(rects) == 0:
+            return _empty_detection()
+        rects = np.asarray(rects, dtype=np.float32).reshape(-1, 4)
+        scores = 1.0 / (1.0 + np.exp(-np.asarray(weights, dtype=np.float32).reshape(-1)))
+        bboxes = np.empty((len(rects), 5), dtype=np.float32)
+        bboxes[:, 0:2] = rects[:, 0:2]
+        bboxes[:, 2:4] = rects[:, 0:2] + rects[:, 2:4]
+        bboxes[:, 4] = scores
+        return bboxes, None
+
+
+@register_detector("YuNet")
+class YuNetDetector:
+    """
+    YuNet (cv2.FaceDetectorYN, OpenCV >= 4.5.4): CNN nhỏ chạy trên CPU, có 5 điểm mốc nên vẫn căn chỉnh
+    được cho ArcFace. Cần file ONNX ở YUNET_MODEL_PATH. Mỗi luồng một bản (setInputSize thay đổi trạng thái).
+    """
+    name = "YuNet"
+    has_landmarks = True
+
+    def __init__(self, model=None):
+        if not hasattr(cv2, "FaceDetectorYN"):
+            raise BackendUnavailable("OpenCV hiện tại không có FaceDetectorYN (cần >= 4.5.4).")
+        if not os.path.exists(YUNET_MODEL_PATH):
+            raise BackendUnavailable(f"Không tìm thấy model YuNet tại '{YUNET_MODEL_PATH}'.")
+        self._local = threading.local()
+
+    def _detector(self, w, h):
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = self._local.detector = cv2.FaceDetectorYN.create(
+                YUNET_MODEL_PATH, "", (w, h), YUNET_SCORE_THRESHOLD)
+        detector.setInputSize((w, h))
+        return detector
+
+    def detect(self, img):
+        h, w = img.shape[:2]
+        _, faces = self._detector(w, h).detect(img)
+        if faces is None or len(faces) == 0:
+            return _empty_detection()
+        faces = np.asarray(faces, dtype=np.float32)
+        bboxes = np.empty((len(faces), 5), dtype=np.float32)
+        bboxes[:, 0:2] = faces[:, 0:2]
+        bboxes[:, 2:4] = faces[:, 0:2] + faces[:, 2:4]
+        bboxes[:, 4] = faces[:, 14]
+        # YuNet: mắt phải, mắt trái (của người trong ảnh) = mắt trái, mắt phải theo ảnh như ArcFace
+        kpss = faces[:, 4:14].reshape(-1, 5, 2)
+        return bboxes, kpss
+
+
+def _ceil_to(value, multiple):
+    return max(multiple, int(math.ceil(value / multiple)) * multiple)
+
+
+def _floor_to(value, multiple, minimum):
+    return max(minimum, int(value // multiple) * multiple)
+
+
+def gate_size_for(det_size):
+    """
+    Kích thước ảnh vào của tầng "SCRFD-small" cho SCRFD đầy đủ chạy ở det_size: CASCADE_GATE_SIZE nếu đặt và
+    nhỏ hơn det_size, ngược lại một nửa det_size làm tròn xuống bội số 32 (tối thiểu 64). Tầng rẻ phải nhỏ hơn
+    hẳn SCRFD đầy đủ, nếu không cảnh trống chẳng tiết kiệm được gì mà cảnh có ứng viên phải trả thêm tầng rẻ.
+    """
+    derived = (_floor_to(det_size[0] / 2, 32, 64), _floor_to(det_size[1] / 2, 32, 64))
+    if CASCADE_GATE_SIZE is None:
+        return derived
+    size = (int(CASCADE_GATE_SIZE[0]), int(CASCADE_GATE_SIZE[1]))
+    if size[0] * size[1] >= det_size[0] * det_size[1]:
+        logging.warning(f"CASCADE_GATE_SIZE {size} không nhỏ hơn DET_SIZE {tuple(det_size)}, "
+                        f"dùng {derived} cho tầng rẻ.")
+        return derived
+    return size
+
+
+def _create_gate(model, det_size):
+    if CASCADE_GATE == "SCRFD-small":
+        return SCRFDDetector(model, input_size=gate_size_for(det_size))
+    return create_detector(CASCADE_GATE, model)
+
+
+@register_detector("SCRFD (cascade)")
+class CascadeDetector:
+    """
+    Phát hiện hai tầng: tầng rẻ (CASCADE_GATE) chạy trên mọi khung hình,
+    - không có ứng viên nào đạt CASCADE_GATE_MIN_SCORE: bỏ qua SCRFD đầy đủ (cảnh trống);
+    - mọi ứng viên đạt CASCADE_ACCEPT_SCORE và tầng rẻ có điểm mốc: dùng luôn kết quả tầng rẻ;
+    - còn lại: chạy SCRFD đầy đủ chỉ trên vùng bao các ứng viên (mở rộng CASCADE_ROI_MARGIN), với ảnh vào
+      thu nhỏ theo cùng tỉ lệ như khi chạy cả khung nên chi phí tỉ lệ với diện tích vùng.
+    Cứ CASCADE_REFRESH_FRAMES lần gọi thì chạy SCRFD đầy đủ trên cả khung một lần để bù mặt tầng rẻ bỏ sót.
+    Với tầng "SCRFD-small" (ảnh vào gate_size_for(DET_SIZE)), ngưỡng det_thresh của model vẫn áp dụng trước
+    CASCADE_GATE_MIN_SCORE.
+    """
+    name = "SCRFD (cascade)"
+    has_landmarks = True
+
+    def __init__(self, model):
+        self.full = SCRFDDetector(model)
+        det_size = self.full.det_model.input_size or DET_SIZE
+        self.det_size = (int(det_size[0]), int(det_size[1]))
+        self.gate = _create_gate(model, self.det_size)
+        self._calls = itertools.count()
+
+    def detect(self, img):
+        if CASCADE_REFRESH_FRAMES and next(self._calls) % CASCADE_REFRESH_FRAMES == 0:
+            metrics.inc("cascade_full")
+            return self.full.detect(img)
+
+        with metrics.timer("cascade_gate"):
+            bboxes, kpss = self.gate.detect(img)
+        keep = bboxes[:, 4] >= CASCADE_GATE_MIN_SCORE
+        if not keep.any():
+            metrics.inc("cascade_skipped")
+            return _empty_detection()
+        bboxes = bboxes[keep]
+        if self.gate.has_landmarks and kpss is not None and (bboxes[:, 4] >= CASCADE_ACCEPT_SCORE).all():
+            metrics.inc("cascade_handoff")
+            return bboxes, kpss[keep]
+        return self._detect_roi(img, bboxes)
+
+    def _detect_roi(self, img, candidates):
+        h, w = img.shape[:2]
+        sides = np.maximum(candidates[:, 2] - candidates[:, 0], candidates[:, 3] - candidates[:, 1])
+        margin = (sides * CASCADE_ROI_MARGIN)[:, None]
+        x1, y1 = np.maximum((candidates[:, 0:2] - margin).min(axis=0), 0).astype(int)
+        x2, y2 = np.minimum((candidates[:, 2:4] + margin).max(axis=0), (w, h)).astype(int)
+        if (x2 - x1) * (y2 - y1) > CASCADE_MAX_ROI_FRACTION * w * h:
+            metrics.inc("cascade_full")
+            return self.full.detect(img)
+
+        # Giữ tỉ lệ thu nhỏ như khi SCRFD chạy cả khung, làm tròn lên bội số 32 (stride lớn nhất của SCRFD)
+        scale = min(self.det_size[0] / w, self.det_size[1] / h)
+        input_size = (_ceil_to((x2 - x1) * scale, 32), _ceil_to((y2 - y1) * scale, 32))
+        metrics.inc("cascade_roi")
+        bboxes, kpss = self.full.detect(img[y1:y2, x1:x2], input_size=input_size)
+        if len(bboxes):
+            bboxes[:, 0:4] += (x1, y1, x1, y1)
+            if kpss is not None:
+                kpss += (x1, y1)
+        return bboxes, kpss
+
+
+# -------------------------------------------------------------- recognizers
+
+def box_crop(img, bbox, size):
+    """
+    Cắt vuông quanh hộp rồi đưa về size x size, cho detector không có điểm mốc.
+    Kém chính xác hơn norm_crop vì khuôn mặt không được căn theo mẫu ArcFace.
+    """
+    x1, y1, x2, y2 = [float(v) for v in bbox[:4]]
+    side = max(x2 - x1, y2 - y1) * 1.15
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    s = size / max(side, 1.0)
+    matrix = np.array([[s, 0.0, size / 2 - s * cx], [0.0, s, size / 2 - s * cy]], dtype=np.float32)
+    return cv2.warpAffine(img, matrix, (size, size), borderValue=0.0)
+
+
+class ArcFaceRecognizer:
+    def __init__(self, rec_model, model_id):
+        self.rec_model = rec_model
+        self.model_id = model_id
+        self.input_size = rec_model.input_size[0]
+
+    @property
+    def dim(self):
+        return int(self.rec_model.output_shape[1])
+
+    def crop(self, img, bbox, kps):
+        if kps is not None:
+            return face_align.norm_crop(img, landmark=kps, image_size=self.input_size)
+        return box_crop(img, bbox, self.input_size)
+
+    def align(self, img, bbox, kps):
+        """Như crop, kèm 5 điểm mốc đã biến đổi sang tọa độ ảnh crop (None nếu không có điểm mốc)."""
+        if kps is None:
+            return box_crop(img, bbox, self.input_size), None
+        matrix = face_align.estimate_norm(kps, self.input_size)
+        crop = cv2.warpAffine(img, matrix, (self.input_size, self.input_size), borderValue=0.0)
+        landmarks = np.asarray(kps, dtype=np.float32) @ matrix[:, 0:2].T.astype(np.float32) + matrix[:, 2]
+        return crop, landmarks.astype(np.float32)
+
+    def get_feat(self, crops):
+        return self.rec_model.get_feat(crops)
+
+
+@register_recognizer("ArcFace (buffalo_sc)", "buffalo_sc")
+def _buffalo_sc(model):
+    """MobileFaceNet (w600k_mbf) đã nạp sẵn cùng FaceProcessor."""
+    return ArcFaceRecognizer(model.models["recognition"], "buffalo_sc")
+
+
+@register_recognizer("ArcFace (buffalo_l)", "buffalo_l")
+def _buffalo_l(model):
+    """ResNet50 (w600k_r50): chính xác hơn, chậm hơn nhiều trên CPU. Tải gói buffalo_l nếu chưa có."""
+    providers = model.models["recognition"].session.get_providers()
+    ctx_id = 0 if "CUDAExecutionProvider" in providers else -1
+    try:
+        pack = insightface.app.FaceAnalysis(name='buffalo_l', allowed_modules=['detection', 'recognition'],
+                                            providers=providers)
+        pack.prepare(ctx_id=ctx_id, det_size=DET_SIZE)
+    except Exception as e:
+        raise BackendUnavailable(f"Không thể nạp gói buffalo_l: {e}") from e
+    return ArcFaceRecognizer(pack.models["recognition"], "buffalo_l")
+
+
+def iou_matrix(a, b):
+    """IoU giữa hai tập hộp (x1, y1, x2, y2): mảng [len(a), len(b)]."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
@@ -1,19 +1,83 @@
 # face_processor.py
 """
-Module 1 & 3: Tiền xử lý ảnh, phát hiện và nhận diện khuôn mặt bằng InsightFace (ArcFace).
+Module 1 & 3: Tiền xử lý ảnh, phát hiện và nhận diện khuôn mặt (backend chọn lúc chạy trong face_backends,
+mặc định InsightFace SCRFD + ArcFace).
 """
 import cv2
 import numpy as np
 import insightface
 import gc
-import math
 import logging
 import faiss
-from config import RESIZE_FACTOR, RECOGNITION_TOLERANCE, DET_SIZE, MAX_WORKERS
+import itertools
+import threading
+import metrics
+from time import perf_counter
+from collections import namedtuple, Counter
+import calibration
+import face_backends
+import faiss_manager
+import face_quality
+from time import monotonic
+from config import (RESIZE_FACTOR, RECOGNITION_TOP_K, RECOGNITION_MARGIN, DET_SIZE, MAX_WORKERS,
+                    DEFAULT_FACE_DETECTOR, DEFAULT_FACE_RECOGNIZER, ENROLLMENT_DETECTOR, ENROLLMENT_RECOGNIZER,
+                    QUALITY_FILTER_ENABLED, QUALITY_ENROLL_MATCH, ENROLL_PHOTO_MARGIN, SCOPE_FALLBACK_UNKNOWN,
+                    CALIBRATION_RECALIBRATE_FRACTION)
 from concurrent.futures import ThreadPoolExecutor
+from recognition_cache import RecognitionCache, FrameSampleCache
+
+# Ảnh chụp bất biến của dữ liệu nhận diện: chỉ mục Faiss, ánh xạ ID và danh sách học sinh (id -> dict).
+# FaceProcessor chỉ thay cả bộ bằng một phép gán tham chiếu duy nhất, nên luồng đang nhận diện
+# giữ (pin) ảnh chụp cũ cho đến hết tác vụ và không bao giờ ghép chỉ mục mới với ánh xạ cũ.
+# model_id là không gian embedding của các vector trong chỉ mục (xem face_backends); threshold là ngưỡng
+# độ tương đồng cosine hiệu chỉnh cho danh sách trong chỉ mục (calibration).
+IndexSnapshot = namedtuple("IndexSnapshot", ["faiss_index", "id_mapping", "students_dict", "generation", "model_id",
+                                             "threshold"])
+_snapshot_generation = itertools.count()
+
+# Cặp detector + recognizer đang dùng, thay bằng một phép gán như IndexSnapshot
+Backends = namedtuple("Backends", ["detector", "recognizer"])
+
+# Kết quả đăng ký một khuôn mặt: embedding kèm ảnh crop đã căn chỉnh (lưu vào crop_store để tính lại về sau)
+FaceSample = namedtuple("FaceSample", ["results", "encoding", "crop", "landmarks", "quality"])
+
+def make_snapshot(faiss_index, id_mapping, known_students=None, model_id=None, threshold=None):
+    """
+    Tạo IndexSnapshot mới. known_students=None nghĩa là chưa có danh sách học sinh.
+    threshold=None dùng ngưỡng mặc định; ngưỡng hiệu chỉnh được FaceProcessor tính trên luồng nền rồi thay vào.
+    """
+    students_dict = None
+    if known_students is not None:
+        students_dict = {s["id"]: s for s in known_students}
+    if threshold is None:
+        threshold = calibration.default_threshold()
+    return IndexSnapshot(faiss_index, id_mapping, students_dict, next(_snapshot_generation), model_id, threshold)
+
+def _stored_recognizer(known_students):
+    """Recognizer của mô hình đã tính phần lớn face_encoding trong CSDL (cột embedding_model), hoặc None."""
+    models = Counter(s.get("embedding_model") for s in known_students or [] if s.get("embedding_model"))
+    if not models:
+        return None
+    return face_backends.recognizer_name_for(models.most_common(1)[0][0])
+
+def _face_photo(frame, bbox):
+    """Ảnh chân dung vuông quanh một khuôn mặt (bbox trên ảnh đã thu nhỏ RESIZE_FACTOR), cắt từ khung hình gốc."""
+    h, w = frame.shape[:2]
+    x1, y1, x2, y2 = (float(v) / RESIZE_FACTOR for v in bbox[:4])
+    half = max(x2 - x1, y2 - y1) * (0.5 + ENROLL_PHOTO_MARGIN)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    left, top = int(max(cx - half, 0)), int(max(cy - half, 0))
+    right, bottom = int(min(cx + half, w)), int(min(cy + half, h))
+    return frame[top:bottom, left:right].copy()
+
+def _unknown_ratio():
+    recognized = metrics.REGISTRY.counter("faces_recognized").value
+    unknown = metrics.REGISTRY.counter("faces_unknown").value
+    total = recognized + unknown
+    return unknown / total if total else 0.0
 
 class FaceProcessor:
-    def __init__(self, faiss_index, id_mapping):
+    def __init__(self, faiss_index, id_mapping, known_students=None):
         # Khởi tạo model ArcFace chỉ 1 lần
         try:
             # Thử khởi tạo với GPU trước
@@ -27,32 +91,345 @@ class FaceProcessor:
             self.model.prepare(ctx_id=-1, det_size=DET_SIZE)
             logging.info("Khởi tạo FaceProcessor với CPUExecutionProvider.")
         self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
-        self.faiss_index = faiss_index         
-        self.id_mapping = id_mapping 
+        # Backend đã nạp (tên -> đối tượng), để đổi qua lại không phải nạp lại model
+        self._detectors = {}
+        self._recognizers = {}
+        # Đăng ký học sinh luôn dùng cặp backend cố định để face_encoding trong CSDL cùng một không gian;
+        # CSDL đã mã hóa lại bằng mô hình khác (embedding_migration) thì đăng ký và nhận diện bằng mô hình đó
+        enrollment_recognizer = _stored_recognizer(known_students) or ENROLLMENT_RECOGNIZER
+        self._enrollment = Backends(self._load_detector(ENROLLMENT_DETECTOR),
+                                    self._load_recognizer(enrollment_recognizer))
+        self.enrollment_model_id = self._enrollment.recognizer.model_id
+        self.detector_name = DEFAULT_FACE_DETECTOR
+        self.recognizer_name = (DEFAULT_FACE_RECOGNIZER if enrollment_recognizer == ENROLLMENT_RECOGNIZER
+                                else enrollment_recognizer)
+        self._backends = Backends(self._load_detector(DEFAULT_FACE_DETECTOR),
+                                  self._load_recognizer(self.recognizer_name))
+        # Hiệu chỉnh ngưỡng (O(N²) cặp) chạy trên một luồng nền; ảnh chụp giữ ngưỡng cũ cho tới khi có ngưỡng mới.
+        # _snapshot_lock chỉ để luồng hiệu chỉnh không ghi đè ảnh chụp vừa được thay; đọc vẫn không cần khóa
+        self._calibration_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Calibration")
+        self._snapshot_lock = threading.Lock()
+        self._calibrated_sizes = {}   # model_id -> số vector của chỉ mục ở lần hiệu chỉnh gần nhất
+        # Mỗi không gian embedding (model_id) có ảnh chụp chỉ mục riêng; _snapshot là của recognizer đang dùng
+        self._index_snapshots = {
+            self.enrollment_model_id: make_snapshot(faiss_index, id_mapping, known_students, self.enrollment_model_id)
+        }
+        self._snapshot = self._snapshot_for(self._backends.recognizer.model_id)
+        self._schedule_calibration(self.enrollment_model_id, faiss_index)
+        # Phạm vi tìm kiếm của nguồn đang nhận diện (faiss_manager.Scope, None = toàn trường) và các ảnh chụp con
+        # (generation, phạm vi) -> IndexSnapshot, chỉ giữ của thế hệ ảnh chụp mới nhất
+        self.scope = None
+        self._scoped_snapshots = {}
+        # Theo dõi khuôn mặt của luồng video trực tiếp: dùng lại kết quả và ảnh crop tốt nhất của mỗi track
+        self.tracker = face_quality.FaceTracker()
+        # Mẫu đăng ký của các khuôn mặt trong vài khung hình vừa nhận diện (đăng ký không chạy lại model)
+        self.frame_samples = FrameSampleCache()
+        # Cache gắn với thế hệ ảnh chụp nên tự làm mới khi chỉ mục/danh sách học sinh thay đổi
+        self.recognition_cache = RecognitionCache()
+        self._register_gauges()
         print(f"[FaceProcessor] Khởi tạo với {MAX_WORKERS} luồng xử lý.")
 
-    def process_frame_for_faces(self, frame):
+    def _register_gauges(self):
+        """Gauge được tính khi đọc (metrics exporter / log), không tốn chi phí trên đường xử lý nóng."""
+        registry = metrics.REGISTRY
+        registry.gauge("recognition_queue_depth", "Số tác vụ nhận diện đang chờ trong executor").set_function(
+            lambda: self.executor._work_queue.qsize() if self.executor is not None else 0)
+        registry.gauge("index_size", "Số vector trong chỉ mục Faiss đang dùng").set_function(
+            lambda: 0 if self._snapshot.faiss_index is None else self._snapshot.faiss_index.ntotal)
+        registry.gauge("recognition_cache_hit_ratio", "Tỉ lệ trúng cache nhận diện").set_function(
+            lambda: self.recognition_cache.stats()[2])
+        registry.gauge("recognition_unknown_ratio", "Tỉ lệ khuôn mặt không nhận diện được").set_function(
+            _unknown_ratio)
+
+    def _load_detector(self, name):
+        detector = self._detectors.get(name)
+        if detector is None:
+            detector = self._detectors[name] = face_backends.create_detector(name, self.model)
+        return detector
+
+    def _load_recognizer(self, name):
+        recognizer = self._recognizers.get(name)
+        if recognizer is None:
+            recognizer = self._recognizers[name] = face_backends.create_recognizer(name, self.model)
+        return recognizer
+
+    def load_recognizer(self, name):
+        """Nạp (hoặc lấy lại) recognizer theo tên mà không đổi recognizer đang dùng."""
+        return self._load_recognizer(name)
+
+    def has_index_for(self, name):
+        """True nếu không gian embedding của recognizer name đã có chỉ mục khác rỗng (không cần nạp model)."""
+        snapshot = self._index_snapshots.get(face_backends.RECOGNIZER_MODEL_IDS.get(name))
+        return snapshot is not None and snapshot.faiss_index is not None and snapshot.faiss_index.ntotal > 0
+
+    def _snapshot_for(self, model_id):
+        """Ảnh chụp chỉ mục của không gian embedding model_id; chưa có thì trả về ảnh chụp rỗng (mọi người là người lạ)."""
+        snapshot = self._index_snapshots.get(model_id)
+        if snapshot is None:
+            enrollment = self._index_snapshots[self.enrollment_model_id]
+            snapshot = make_snapshot(None, None, None, model_id)._replace(students_dict=enrollment.students_dict)
+        return snapshot
+
+    @property
+    def backends(self):
+        return self._backends
+
+    def set_detector(self, name):
+        """
+        Đổi detector lúc chạy (tác vụ đang chạy vẫn dùng detector cũ đến hết).
+        Ném face_backends.BackendUnavailable nếu không dùng được; khi đó giữ nguyên detector hiện tại.
+        """
+        detector = self._load_detector(name)
+        self._backends = self._backends._replace(detector=detector)
+        self.detector_name = name
+        logging.info(f"Đã chuyển detector sang {name}.")
+
+    def set_recognizer(self, name):
+        """
+        Đổi recognizer lúc chạy và chuyển sang chỉ mục của không gian embedding tương ứng.
+        Trả về True nếu không gian đó đã có chỉ mục (ngược lại mọi khuôn mặt là người lạ cho tới khi
+        có chỉ mục cho model này). Ném face_backends.BackendUnavailable nếu không nạp được.
+        """
+        recognizer = self._load_recognizer(name)
+        self._backends = self._backends._replace(recognizer=recognizer)
+        self._snapshot = self._snapshot_for(recognizer.model_id)
+        self.recognizer_name = name
+        has_index = self._snapshot.faiss_index is not None and self._snapshot.faiss_index.ntotal > 0
+        if not has_index:
+            logging.warning(f"Chưa có chỉ mục cho mô hình {recognizer.model_id}; không nhận ra học sinh nào.")
+        logging.info(f"Đã chuyển recognizer sang {name}.")
+        return has_index
+
+    @property
+    def snapshot(self):
+        """Ảnh chụp hiện hành. Đọc một lần và dùng cho cả tác vụ để có dữ liệu nhất quán."""
+        return self._snapshot
+
+    @property
+    def faiss_index(self):
+        return self._snapshot.faiss_index
+
+    @property
+    def id_mapping(self):
+        return self._snapshot.id_mapping
+
+    def swap_snapshot(self, faiss_index, id_mapping, known_students=None, model_id=None):
+        """
+        Thay chỉ mục, ánh xạ (và danh sách học sinh nếu có) bằng một phép gán duy nhất, không cần khóa.
+        Nếu known_students=None thì giữ lại danh sách học sinh của ảnh chụp hiện tại.
+        model_id là không gian embedding của chỉ mục; mặc định là của recognizer đăng ký (chỉ mục dựng từ CSDL).
         """
-        Tiền xử lý một khung hình và phát hiện các khuôn mặt.
+        model_id = model_id or self.enrollment_model_id
+        with self._snapshot_lock:
+            # Giữ ngưỡng hiện tại; chỉ mục mới được hiệu chỉnh lại trên luồng nền nếu đổi đáng kể
+            previous = self._index_snapshots.get(model_id)
+            threshold = previous.threshold if previous is not None else None
+            snapshot = make_snapshot(faiss_index, id_mapping, known_students, model_id, threshold)
+            if known_students is None:
+                snapshot = snapshot._replace(students_dict=self._snapshot_for(model_id).students_dict)
+            self._index_snapshots[model_id] = snapshot
+            if model_id == self._backends.recognizer.model_id:
+                self._snapshot = snapshot
+        if previous is None or previous.faiss_index is not faiss_index:
+            self._schedule_calibration(model_id, faiss_index)
+        logging.info(f"Đã thay ảnh chụp chỉ mục {model_id} (thế hệ {snapshot.generation}, "
+                     f"{0 if faiss_index is None else faiss_index.ntotal} vector).")
+
+    def _schedule_calibration(self, model_id, faiss_index):
+        """
+        Hiệu chỉnh ngưỡng cho chỉ mục faiss_index của model_id trên luồng nền, trừ khi số vector đổi chưa tới
+        CALIBRATION_RECALIBRATE_FRACTION so với lần hiệu chỉnh trước (ví dụ sửa một học sinh).
+        """
+        if faiss_index is None or self._calibration_executor is None:
+            return
+        calibrated = self._calibrated_sizes.get(model_id)
+        if calibrated is not None and abs(faiss_index.ntotal - calibrated) < max(
+                1, CALIBRATION_RECALIBRATE_FRACTION * calibrated):
+            return
+
+        def store(snapshot):
+            self._index_snapshots[model_id] = snapshot
+            self._calibrated_sizes[model_id] = faiss_index.ntotal
+            if model_id == self._backends.recognizer.model_id:
+                self._snapshot = snapshot
+
+        self._calibration_executor.submit(self._recalibrate, faiss_index, lambda: self._index_snapshots.get(model_id),
+                                          store)
+
+    def _recalibrate(self, faiss_index, current, store):
+        """
+        Chạy trên luồng hiệu chỉnh. current() là ảnh chụp đang dùng; nếu nó vẫn dùng faiss_index thì
+        store(ảnh chụp đó với ngưỡng mới). Chỉ mục đã bị thay trong lúc chờ thì bỏ kết quả.
+        """
+        try:
+            snapshot = current()
+            if snapshot is None or snapshot.faiss_index is not faiss_index:
+                return
+            with metrics.timer("calibrate"):
+                threshold = calibration.calibrate_index(faiss_index, snapshot.id_mapping).threshold
+            with self._snapshot_lock:
+                snapshot = current()
+                if snapshot is None or snapshot.faiss_index is not faiss_index:
+                    return
+                # Thế hệ mới để cache nhận diện và ảnh chụp phạm vi không giữ kết quả theo ngưỡng cũ
+                store(snapshot._replace(threshold=threshold, generation=next(_snapshot_generation)))
+        except Exception:
+            logging.exception("Lỗi khi hiệu chỉnh ngưỡng nhận diện")
+
+    def set_enrollment_recognizer(self, name):
+        """
+        Chuyển recognizer đăng ký sau khi CSDL đã được mã hóa lại bằng mô hình của nó (embedding_migration).
+        Ảnh chụp chỉ mục của mô hình mới phải được swap_snapshot trước; ảnh chụp của mô hình cũ bị bỏ
+        vì CSDL không còn mã hóa của mô hình đó.
+        """
+        recognizer = self._load_recognizer(name)
+        if recognizer.model_id not in self._index_snapshots:
+            raise ValueError(f"Chưa có ảnh chụp chỉ mục cho mô hình {recognizer.model_id}.")
+        old_model_id = self.enrollment_model_id
+        self._enrollment = self._enrollment._replace(recognizer=recognizer)
+        self.enrollment_model_id = recognizer.model_id
+        if old_model_id != recognizer.model_id:
+            # Mẫu đăng ký đã giữ thuộc không gian embedding cũ
+            self.frame_samples.clear()
+            self._index_snapshots.pop(old_model_id, None)
+            if self._snapshot.model_id == old_model_id:
+                self._snapshot = self._snapshot_for(old_model_id)
+        logging.info(f"Đã chuyển recognizer đăng ký sang {name}.")
+
+    def update_roster(self, known_students):
+        """Chỉ cập nhật danh sách học sinh (ví dụ sau khi sửa tên/lớp), giữ nguyên chỉ mục của mọi mô hình."""
+        for model_id, current in list(self._index_snapshots.items()):
+            self.swap_snapshot(current.faiss_index, current.id_mapping, known_students, model_id)
+        if self._snapshot.model_id not in self._index_snapshots:
+            self._snapshot = self._snapshot_for(self._snapshot.model_id)
+
+    def set_scope(self, scope):
+        """
+        Giới hạn nhận diện trong một phạm vi (faiss_manager.Scope hoặc chuỗi "năm học/lớp"); None là toàn trường.
+        Chỉ mục con được cắt từ ảnh chụp chỉ mục chung khi dùng lần đầu (một lần cho mỗi thế hệ).
+        """
+        scope = faiss_manager.parse_scope(scope)
+        if scope == self.scope:
+            return
+        self.scope = scope
+        # Kết quả của các track thuộc phạm vi cũ
+        self.tracker.clear()
+        logging.info(f"Đã chuyển phạm vi nhận diện sang {faiss_manager.format_scope(scope)}.")
+
+    def _scoped(self, snapshot):
+        """Ảnh chụp con của snapshot trong phạm vi hiện hành, hoặc chính snapshot (toàn trường/phạm vi rỗng)."""
+        scope = self.scope
+        if scope is None or snapshot.faiss_index is None or not snapshot.students_dict:
+            return snapshot
+        key = (snapshot.generation, scope)
+        scoped = self._scoped_snapshots.get(key)
+        if scoped is not None:
+            return scoped
+        members = faiss_manager.scope_members(snapshot.students_dict.values(), scope)
+        with metrics.timer("scope_index"):
+            faiss_index, id_mapping = faiss_manager.build_scoped_index(snapshot.faiss_index, snapshot.id_mapping,
+                                                                       members)
+        if faiss_index is None:
+            logging.warning(f"Phạm vi {faiss_manager.format_scope(scope)} không có học sinh nào trong chỉ mục, "
+                            "dùng chỉ mục chung.")
+            scoped = snapshot
+        else:
+            # Thế hệ riêng nên cache nhận diện không trộn kết quả của phạm vi với chỉ mục chung; dùng ngưỡng
+            # của chỉ mục chung cho tới khi ngưỡng cho danh sách của phạm vi được hiệu chỉnh xong
+            scoped = make_snapshot(faiss_index, id_mapping, None, snapshot.model_id, snapshot.threshold)._replace(
+                students_dict=snapshot.students_dict)
+        with self._snapshot_lock:
+            scoped_snapshots = {k: v for k, v in self._scoped_snapshots.items() if k[0] == snapshot.generation}
+            scoped_snapshots[key] = scoped
+            self._scoped_snapshots = scoped_snapshots
+        if scoped is not snapshot and self._calibration_executor is not None:
+            self._calibration_executor.submit(self._recalibrate, scoped.faiss_index,
+                                              lambda: self._scoped_snapshots.get(key),
+                                              lambda new: self._store_scoped(key, new))
+        return scoped
+
+    def _store_scoped(self, key, scoped):
+        scoped_snapshots = dict(self._scoped_snapshots)
+        scoped_snapshots[key] = scoped
+        self._scoped_snapshots = scoped_snapshots
+
+    def _detect(self, frame, backends):
+        """Thu nhỏ khung hình và phát hiện khuôn mặt. Trả về (small_frame, bboxes, kpss)."""
+        with metrics.timer("resize"):
+            small_frame = cv2.resize(frame, (0, 0), fx=RESIZE_FACTOR, fy=RESIZE_FACTOR)
+        with metrics.timer("detect"):
+            bboxes, kpss = backends.detector.detect(small_frame)
+        metrics.observe("faces_per_frame", len(bboxes))
+        return small_frame, bboxes, kpss
+
+    def _filter_quality(self, small_frame, bboxes, kpss):
+        """Bỏ các khuôn mặt quá nhỏ, mờ, nghiêng hoặc điểm phát hiện thấp (nếu QUALITY_FILTER_ENABLED)."""
+        if not QUALITY_FILTER_ENABLED or len(bboxes) == 0:
+            return bboxes, kpss
+        with metrics.timer("quality"):
+            accepted = face_quality.assess_faces(small_frame, bboxes, kpss).accepted
+        metrics.inc("faces_low_quality", int(len(accepted) - accepted.sum()))
+        return bboxes[accepted], None if kpss is None else kpss[accepted]
+
+    def process_frame_for_faces(self, frame, backends=None):
+        """
+        Tiền xử lý một khung hình và phát hiện các khuôn mặt bằng cặp backend (mặc định: đang chọn).
+        Khuôn mặt không đạt chất lượng bị bỏ trước khi tính embedding.
         Trả về: vị trí các khuôn mặt và mã hóa của chúng.
         """
-        small_frame = cv2.resize(frame, (0, 0), fx=RESIZE_FACTOR, fy=RESIZE_FACTOR)
-        faces = self.model.get(small_frame)
-        face_locations = []
-        face_embeddings = []
+        if backends is None:
+            backends = self._backends
+        small_frame, bboxes, kpss = self._detect(frame, backends)
+        bboxes, kpss = self._filter_quality(small_frame, bboxes, kpss)
+        if len(bboxes) == 0:
+            return [], []
 
-        for face in faces:
+        recognizer = backends.recognizer
+        crops = [recognizer.crop(small_frame, bboxes[i], None if kpss is None else kpss[i])
+                 for i in range(len(bboxes))]
+        # Tính embedding cho mọi khuôn mặt trong một lần gọi model
+        with metrics.timer("embed"):
+            embeddings = recognizer.get_feat(crops)
+
+        face_locations = []
+        for i in range(len(bboxes)):
             # Lấy vị trí khuôn mặt (top, right, bottom, left)
-            box = face.bbox.astype(int)
-            left, top, right, bottom = box[0], box[1], box[2], box[3]
+            left, top, right, bottom = bboxes[i, 0:4].astype(int)
             face_locations.append((top, right, bottom, left))
-            # Lấy embedding (vector đặc trưng)
-            face_embeddings.append(face.embedding.astype(float))
-
+        face_embeddings = [embedding.astype(float) for embedding in embeddings]
         return face_locations, face_embeddings
 
-    def identify_faces(self, face_embeddings, known_students): 
-        if self.faiss_index is None or self.faiss_index.ntotal == 0:
+    def identify_faces(self, face_embeddings, known_students=None, snapshot=None, model_id=None, scoped=True):
+        """
+        Nhận diện các embedding dựa trên một ảnh chụp chỉ mục.
+        snapshot=None dùng ảnh chụp hiện hành. Danh sách học sinh của ảnh chụp được ưu tiên;
+        known_students chỉ được dùng khi ảnh chụp chưa có danh sách học sinh.
+        model_id: không gian embedding của face_embeddings; nếu khác của ảnh chụp (vừa đổi recognizer)
+        thì dùng ảnh chụp của model_id, vì khoảng cách giữa hai không gian không có nghĩa.
+        scoped: tìm trong chỉ mục con của phạm vi hiện hành (set_scope); False thì tìm trong toàn trường.
+        """
+        if snapshot is None:
+            snapshot = self._snapshot
+        if model_id is not None and snapshot.model_id != model_id:
+            snapshot = self._snapshot_for(model_id)
+        search_snapshot = self._scoped(snapshot) if scoped else snapshot
+        with metrics.timer("identify"):
+            names, ids, scores = self._identify_faces(face_embeddings, known_students, search_snapshot)
+            if SCOPE_FALLBACK_UNKNOWN and search_snapshot is not snapshot:
+                # Khuôn mặt không thuộc phạm vi: tìm lại trong chỉ mục chung
+                rows = [i for i, student_id in enumerate(ids) if student_id is None]
+                if rows:
+                    fallback = self._identify_faces([face_embeddings[i] for i in rows], known_students, snapshot)
+                    for i, name, student_id, score in zip(rows, *fallback):
+                        names[i], ids[i], scores[i] = name, student_id, score
+        metrics.inc("faces_recognized", sum(1 for i in ids if i is not None))
+        metrics.inc("faces_unknown", sum(1 for i in ids if i is None))
+        return names, ids, scores
+
+    def _identify_faces(self, face_embeddings, known_students, snapshot):
+        if snapshot is None:
+            snapshot = self._snapshot
+        if snapshot.faiss_index is None or snapshot.faiss_index.ntotal == 0:
             num_faces = len(face_embeddings)
             return ["Người lạ"] * num_faces, [None] * num_faces, [0.0] * num_faces
 
@@ -60,36 +437,43 @@ class FaceProcessor:
         query_embeddings = np.array(face_embeddings).astype('float32')
         faiss.normalize_L2(query_embeddings)
 
-        # Tìm kiếm 1 vector gần nhất (k=1)
-        # D là khoảng cách (L2 distance), I là chỉ số (index) của vector trong file Faiss
-        k = 1
-        distances, indices = self.faiss_index.search(query_embeddings, k)
-
-        identified_ids = []
-        identified_names = []
-        similarity_scores = []
-        
-        # Ngưỡng nhận diện cần được chuyển từ Cosine Similarity sang L2 Distance
-        # D^2 = 2 - 2 * S  =>  D = sqrt(2 * (1 - S))
-        # RECOGNITION_TOLERANCE cũ là khoảng cách (0.6), nhưng S là độ tương đồng.
-        # Giả sử ngưỡng tương đồng là (1 - 0.6) = 0.4
-        # Thì ngưỡng khoảng cách là sqrt(2 * (1 - 0.4)) = sqrt(1.2) ~= 1.095
-        # Bạn cần tinh chỉnh lại ngưỡng này cho phù hợp
-        # InsightFace thường dùng ngưỡng cosine là 0.5, tương ứng L2 là 1.0
-        # RECOGNITION_TOLERANCE biểu thị ngưỡng khoảng cách cho phép (1 - S)
-        # Ví dụ: tolerance 0.6 -> S = 0.4 -> ngưỡng L2 ≈ sqrt(1.2) ≈ 1.095
-        DISTANCE_THRESHOLD = math.sqrt(2 * RECOGNITION_TOLERANCE) 
-
-        # known_students giờ được dùng để tra cứu tên từ ID
-        known_students_dict = {s["id"]: s for s in known_students}
-
-        for i in range(len(query_embeddings)):
-            faiss_index = indices[i][0]
-            distance = distances[i][0]
-
-            if distance < DISTANCE_THRESHOLD:
-                # Lấy student_id từ file ánh xạ dựa vào chỉ số của Faiss
-                student_id = self.id_mapping[faiss_index]
+        num_faces = len(query_embeddings)
+        identified_ids = [None] * num_faces
+        identified_names = [None] * num_faces
+        similarity_scores = [0.0] * num_faces
+
+        # Kiểm tra cache trước: khuôn mặt vừa được nhận diện gần đây không cần tìm lại trong Faiss
+        cached = self.recognition_cache.lookup(query_embeddings, snapshot.generation)
+        miss_rows = []
+        for i, entry in enumerate(cached):
+            if entry is None:
+                miss_rows.append(i)
+            else:
+                identified_ids[i], identified_names[i], similarity_scores[i] = entry
+        if not miss_rows:
+            return identified_names, identified_ids, similarity_scores
+
+        # Tìm k vector gần nhất cho các khuôn mặt không có trong cache để so top-1 với học sinh khác gần nhất
+        # D là bình phương khoảng cách L2 (IndexFlatL2), I là chỉ số của vector trong file Faiss
+        k = min(RECOGNITION_TOP_K, snapshot.faiss_index.ntotal)
+        with metrics.timer("search"):
+            distances, indices = snapshot.faiss_index.search(query_embeddings[miss_rows], k)
+        # Các vector đã chuẩn hóa: D = d² = 2 - 2S  =>  S = 1 - D/2
+        similarities = np.where(indices >= 0, 1 - distances / 2, -np.inf)
+        # Ánh xạ có thể là mảng memory-map nên chuyển về str thuần
+        neighbor_ids = np.asarray(snapshot.id_mapping)[np.maximum(indices, 0)].astype(str)
+        accepted, ambiguous = calibration.open_set_match(similarities, neighbor_ids, snapshot.threshold,
+                                                         RECOGNITION_MARGIN)
+        metrics.inc("faces_ambiguous", int(ambiguous.sum()))
+
+        # Tra cứu tên từ ID bằng danh sách học sinh của ảnh chụp
+        known_students_dict = snapshot.students_dict
+        if known_students_dict is None:
+            known_students_dict = {s["id"]: s for s in (known_students or [])}
+
+        for row, i in enumerate(miss_rows):
+            if accepted[row]:
+                student_id = str(neighbor_ids[row][0])
                 # Tra cứu thông tin từ dict
                 student_info = known_students_dict.get(student_id)
                 if student_info:
@@ -98,62 +482,260 @@ class FaceProcessor:
                     name = "Không rõ" # Trường hợp ID có trong Faiss nhưng không có trong dict
                     student_id = None
             else:
+                # Dưới ngưỡng, hoặc gần như ngang nhau giữa hai học sinh
                 student_id = None
                 name = "Người lạ"
-            
-            # Tính điểm tương đồng từ khoảng cách để hiển thị nếu cần
-            score = 1 - (distance**2) / 2
-            
-            identified_ids.append(student_id)
-            identified_names.append(name)
-            similarity_scores.append(score)
-        
+
+            # Điểm tương đồng cosine của vector gần nhất để hiển thị
+            score = float(similarities[row][0])
+
+            identified_ids[i] = student_id
+            identified_names[i] = name
+            similarity_scores[i] = score
+            # Chỉ lưu học sinh đã nhận diện được; người lạ luôn được tìm lại
+            if student_id is not None:
+                self.recognition_cache.insert(query_embeddings[i], student_id, name, score, snapshot.generation)
+
         return identified_names, identified_ids, similarity_scores
 
+    def recognize_batch(self, frames, snapshot=None):
+        """
+        Nhận diện nhiều ảnh cùng lúc: phát hiện từng ảnh, sau đó tính embedding cho mọi khuôn mặt
+        trong MỘT lần gọi model nhận diện và tìm kiếm Faiss trong MỘT lần gọi.
+        Trả về list (mỗi ảnh một list kết quả {"name", "id", "score", "location"}).
+        """
+        if snapshot is None:
+            snapshot = self._snapshot
+        backends = self._backends
+        recognizer = backends.recognizer
+        crops = []
+        owners = []     # Chỉ số ảnh chứa từng khuôn mặt
+        locations = []
+        for frame_index, frame in enumerate(frames):
+            small_frame, bboxes, kpss = self._detect(frame, backends)
+            bboxes, kpss = self._filter_quality(small_frame, bboxes, kpss)
+            for i in range(len(bboxes)):
+                left, top, right, bottom = bboxes[i, 0:4].astype(int)
+                crops.append(recognizer.crop(small_frame, bboxes[i], None if kpss is None else kpss[i]))
+                owners.append(frame_index)
+                locations.append((top, right, bottom, left))
+
+        results = [[] for _ in frames]
+        if not crops:
+            return results
+        with metrics.timer("embed"):
+            embeddings = recognizer.get_feat(crops)
+        names, ids, scores = self.identify_faces(list(embeddings), snapshot=snapshot, model_id=recognizer.model_id)
+        for owner, name, student_id, score, location in zip(owners, names, ids, scores, locations):
+            results[owner].append({"name": name, "id": student_id, "score": float(score), "location": location})
+        return results
+
+    def search_embedding(self, embedding, k=5, snapshot=None):
+        """Trả về tối đa k học sinh gần nhất với một embedding: list {"id", "name", "score"}."""
+        if snapshot is None:
+            snapshot = self._snapshot
+        if snapshot.faiss_index is None or snapshot.faiss_index.ntotal == 0:
+            return []
+        query = np.array([embedding], dtype='float32')
+        faiss.normalize_L2(query)
+        k = min(k, snapshot.faiss_index.ntotal)
+        with metrics.timer("search"):
+            distances, indices = snapshot.faiss_index.search(query, k)
+        students_dict = snapshot.students_dict or {}
+        matches = []
+        for distance, faiss_index in zip(distances[0], indices[0]):
+            if faiss_index < 0:
+                continue
+            student_id = str(snapshot.id_mapping[faiss_index])
+            student_info = students_dict.get(student_id)
+            matches.append({
+                "id": student_id,
+                "name": student_info["name"] if student_info else None,
+                # IndexFlatL2 trả về bình phương khoảng cách L2: cos = 1 - d²/2
+                "score": float(1 - distance / 2),
+            })
+        return matches
+
+    def submit_recognition(self, frame, known_students):
+        """Gửi tác vụ nhận diện vào thread pool, trả về concurrent.futures.Future chứa danh sách kết quả."""
+        return self.executor.submit(self._recognize_in_background, frame, known_students, perf_counter())
+
     def submit_face_recognition_task(self, frame, known_students, callback):
         """Gửi tác vụ nhận diện vào a thread pool và gọi callback khi hoàn thành."""
-        future = self.executor.submit(self._recognize_in_background, frame, known_students)
+        future = self.submit_recognition(frame, known_students)
         future.add_done_callback(lambda f: callback(f.result()))
 
-    def _recognize_in_background(self, frame, known_students):
+    def _recognize_in_background(self, frame, known_students, submitted_at=None):
         """Hàm này sẽ chạy trong một luồng riêng của ThreadPoolExecutor."""
+        if submitted_at is not None:
+            # Thời gian tác vụ phải chờ trong hàng đợi của executor
+            metrics.REGISTRY.histogram("queue_wait").record((perf_counter() - submitted_at) * 1000)
+        # Giữ ảnh chụp chỉ mục và cặp backend trong suốt tác vụ, kể cả khi chúng được thay giữa chừng
+        snapshot = self._snapshot
+        backends = self._backends
         try:
-            locations, encodings = self.process_frame_for_faces(frame)
-            frame = None
-            if not encodings:
-                return [] # Trả về danh sách rỗng nếu không có khuôn mặt
+            with metrics.timer("recognize"):
+                return self._recognize_tracked(frame, known_students, snapshot, backends)
+        except Exception:
+            metrics.inc("recognition_errors")
+            logging.exception("Lỗi trong luồng xử lý khuôn mặt")
+            return []
 
-            names, ids, _ = self.identify_faces(encodings, known_students)
-            results = [{"name": n, "id": i, "location": l} for n, i, l in zip(names, ids, locations)]
-            return results
-        except Exception as e:
-            # Nên có logging ở đây                                                                                      
-            print(f"Lỗi trong luồng xử lý khuôn mặt: {e}")
+    def _recognize_tracked(self, frame, known_students, snapshot, backends):
+        """
+        Nhận diện một khung hình của luồng video trực tiếp, có chấm chất lượng và theo dõi khuôn mặt:
+        - track đã có kết quả (cùng chỉ mục, còn mới) và lần này không tốt hơn: dùng lại, không tính embedding;
+        - khuôn mặt không đạt chất lượng và track chưa có kết quả: hoãn (không trả về) thay vì gán "Người lạ";
+        - còn lại: tính embedding trong một lần gọi model và ghi kết quả + crop tốt nhất vào track.
+        Nếu recognizer đang dùng cũng là recognizer đăng ký, mẫu đăng ký của mọi khuôn mặt trả về được giữ
+        trong frame_samples và kết quả mang "frame_seq" để sample_for_result lấy lại.
+        """
+        small_frame, bboxes, kpss = self._detect(frame, backends)
+        if len(bboxes) == 0:
             return []
+        recognizer = backends.recognizer
+        with metrics.timer("quality"):
+            quality = face_quality.assess_faces(small_frame, bboxes, kpss)
+        accepted = quality.accepted if QUALITY_FILTER_ENABLED else np.ones(len(bboxes), dtype=bool)
+        now = monotonic()
+        tracks = self.tracker.assign(bboxes, small_frame.shape, now)
+        result_key = (snapshot.generation, recognizer.model_id)
 
-    def get_single_face_encoding(self, image_to_process, known_students):
+        results = [None] * len(bboxes)
+        embed_rows = []
+        for i, track in enumerate(tracks):
+            reused = self.tracker.reusable_result(track, float(quality.score[i]), bool(accepted[i]), result_key, now)
+            if reused is not None:
+                results[i] = reused
+                metrics.inc("faces_track_reused")
+            elif accepted[i]:
+                embed_rows.append(i)
+            else:
+                metrics.inc("faces_low_quality")
+
+        fresh = {}
+        if embed_rows:
+            aligned = [recognizer.align(small_frame, bboxes[i], None if kpss is None else kpss[i])
+                       for i in embed_rows]
+            with metrics.timer("embed"):
+                embeddings = recognizer.get_feat([crop for crop, _ in aligned])
+            names, ids, _ = self.identify_faces(list(embeddings), known_students, snapshot,
+                                                model_id=recognizer.model_id)
+            for row, (crop, landmarks), embedding, name, student_id in zip(embed_rows, aligned, embeddings,
+                                                                           names, ids):
+                results[row] = {"name": name, "id": student_id}
+                # Chỉ giữ crop đã căn theo điểm mốc để có thể dùng lại khi đăng ký
+                aligned_crop = crop if landmarks is not None else None
+                self.tracker.update(tracks[row], results[row], float(quality.score[row]), result_key,
+                                    aligned_crop, landmarks, now, embedding, recognizer.model_id)
+                # Embedding của box_crop (detector không có điểm mốc) không cùng phân bố với mẫu đăng ký
+                if landmarks is not None:
+                    fresh[row] = (embedding, crop, landmarks)
+
+        output = []
+        samples = {}
+        keep_samples = recognizer.model_id == self.enrollment_model_id
+        for i, result in enumerate(results):
+            if result is None:
+                continue
+            left, top, right, bottom = bboxes[i, 0:4].astype(int)
+            result["location"] = (top, right, bottom, left)
+            output.append(result)
+            if keep_samples:
+                # Không có mẫu đã căn chỉnh: vẫn giữ ảnh chân dung để đăng ký mã hóa lại bằng cặp backend đăng ký
+                sample = self._tracked_sample(tracks[i], fresh.get(i), float(quality.score[i]), result)
+                samples[result["location"]] = (sample, _face_photo(frame, bboxes[i]))
+        if samples:
+            frame_seq = self.frame_samples.put(samples, now)
+            for result in output:
+                result["frame_seq"] = frame_seq
+        return output
+
+    def _tracked_sample(self, track, fresh, score, result):
+        """
+        Mẫu đăng ký của một khuôn mặt đang theo dõi: lần nhìn thấy tốt nhất của track (đã có embedding),
+        ngược lại embedding vừa tính ở khung này; None nếu khung này không tính và track chưa có, hoặc
+        detector đang dùng không có điểm mốc (crop không được căn theo mẫu ArcFace như khi đăng ký).
+        """
+        best = self.tracker.best_sample(track, self.enrollment_model_id)
+        if best is not None:
+            crop, landmarks, score, embedding = best
+        elif fresh is not None:
+            embedding, crop, landmarks = fresh
+        else:
+            return None
+        results = [{"name": result["name"], "id": result["id"], "location": result["location"]}]
+        return FaceSample(results, np.asarray(embedding, dtype=float), crop, landmarks, score)
+
+    def sample_for_result(self, result):
+        """
+        (FaceSample, ảnh chân dung) đã tính sẵn cho một kết quả nhận diện của luồng video trực tiếp, để đăng ký
+        khuôn mặt đó (kể cả trong khung hình nhiều người) không cần gọi model. FaceSample là None khi không có
+        mẫu đã căn chỉnh: khi đó mã hóa ảnh chân dung bằng get_single_face_sample. None nếu không còn trong cache.
+        """
+        if not result or result.get("frame_seq") is None:
+            return None
+        return self.frame_samples.get(result["frame_seq"], result["location"])
+
+    def get_single_face_sample(self, image_to_process, known_students):
+        """
+        Mã hóa ảnh đăng ký có đúng một khuôn mặt. Trả về FaceSample (kết quả nhận diện, embedding,
+        ảnh crop đã căn chỉnh + điểm mốc, điểm chất lượng) hoặc None nếu không có/có nhiều khuôn mặt.
+        """
         if image_to_process is None:
             print("[Lỗi] Không có ảnh để xử lý.")
             return None
 
-        # Sử dụng phương thức của chính đối tượng này
-        locations, encodings = self.process_frame_for_faces(image_to_process)
+        # Luôn dùng cặp backend đăng ký để mã hóa lưu vào CSDL cùng không gian với chỉ mục
+        small_frame, bboxes, kpss = self._detect(image_to_process, self._enrollment)
 
-        if len(encodings) == 0:
+        if len(bboxes) == 0:
             print("[Lỗi] Không tìm thấy khuôn mặt nào trong ảnh.")
             return None
-        if len(encodings) > 1:
+        if len(bboxes) > 1:
             print("[Lỗi] Phát hiện nhiều hơn một khuôn mặt. Vui lòng chỉ có một người trong ảnh.")
             return None
-        
-        names, ids, _ = self.identify_faces(encodings, known_students)
-        results = [{"name": n, "id": i, "location": l} for n, i, l in zip(names, ids, locations)]
 
-        return results, encodings[0]
-    
+        recognizer = self._enrollment.recognizer
+        quality = face_quality.assess_faces(small_frame, bboxes, kpss)
+        crop, landmarks = recognizer.align(small_frame, bboxes[0], None if kpss is None else kpss[0])
+        score = float(quality.score[0])
+        crops = [crop]
+        # Ảnh lấy từ video trực tiếp: track trùng vị trí có thể đã có crop tốt hơn (nhìn thẳng, rõ nét hơn)
+        best = self.tracker.best_crop_for(bboxes[0], small_frame.shape)
+        if best is not None and best[2] > score and best[0].shape == crop.shape:
+            crops.append(best[0])
+        embeddings = recognizer.get_feat(crops)
+        encoding = embeddings[0]
+        if len(embeddings) > 1:
+            current, candidate = embeddings[0], embeddings[1]
+            similarity = float(np.dot(current, candidate) / (np.linalg.norm(current) * np.linalg.norm(candidate)))
+            # Chỉ dùng crop của track khi chắc chắn là cùng một người
+            if similarity >= QUALITY_ENROLL_MATCH:
+                print(f"[FaceProcessor] Dùng ảnh crop tốt nhất của khuôn mặt đang theo dõi "
+                      f"(chất lượng {best[2]:.2f} > {score:.2f}).")
+                encoding, crop, landmarks, score = candidate, best[0], best[1], best[2]
+        if encoding is embeddings[0] and not quality.accepted[0]:
+            print("[Cảnh báo] Ảnh khuôn mặt chất lượng thấp (nhỏ, mờ hoặc nghiêng), nhận diện về sau có thể kém.")
+        encoding = encoding.astype(float)
+
+        left, top, right, bottom = bboxes[0, 0:4].astype(int)
+        names, ids, _ = self.identify_faces([encoding], known_students, model_id=self.enrollment_model_id,
+                                            scoped=False)
+        results = [{"name": names[0], "id": ids[0], "location": (top, right, bottom, left)}]
+        return FaceSample(results, encoding, crop, landmarks, score)
+
+    def get_single_face_encoding(self, image_to_process, known_students):
+        sample = self.get_single_face_sample(image_to_process, known_students)
+        if sample is None:
+            return None
+        return sample.results, sample.encoding
+
     def clear_cache(self):
         """Dọn dẹp bộ nhớ cache (nếu có) và gọi garbage collector."""
         gc.collect()
+        self.tracker.clear()
+        self.frame_samples.clear()
         if hasattr(self.model, 'clear'):
             self.model.clear()
         print("Cache cleared.")
@@ -163,5 +745,8 @@ class FaceProcessor:
         if hasattr(self, 'executor') and self.executor is not None:
             self.executor.shutdown(wait=True)
             self.executor = None
+        if getattr(self, '_calibration_executor', None) is not None:
+            self._calibration_executor.shutdown(wait=False)
+            self._calibration_executor = None
         if hasattr(self, 'model'):
             self.model = None
\ No newline at end of file
@@ -0,0 +1,208 @@
+# face_quality.py
+"""
+Chấm chất lượng khuôn mặt trước khi tính embedding, và theo dõi khuôn mặt giữa các lần xử lý.
+
+assess_faces tính cho cả mảng hộp cùng lúc:
+- size: cạnh ngắn của hộp (pixel trên ảnh đã thu nhỏ);
+- blur: phương sai Laplacian trong hộp, lấy từ ảnh tích phân (integral2) của một lần cv2.Laplacian
+  trên vùng bao các khuôn mặt, không cắt từng mặt;
+- yaw: |mũi - trung điểm hai mắt| / nửa khoảng cách hai mắt (0 = nhìn thẳng, ~1 = mũi nằm trên một mắt);
+  0 nếu detector không có điểm mốc;
+- det_score: điểm của detector.
+Khuôn mặt không đạt ngưỡng (accepted=False) không được tính embedding.
+
+FaceTracker ghép khuôn mặt giữa các lần xử lý theo IoU, giữ ảnh crop tốt nhất và kết quả nhận diện
+của mỗi track: mặt chất lượng thấp (nghiêng, mờ) dùng lại kết quả của track thay vì thành "Người lạ",
+mặt đã nhận diện ở chất lượng cao hơn không phải tính lại embedding.
+"""
+import itertools
+import threading
+from collections import namedtuple
+from time import monotonic
+
+import cv2
+import numpy as np
+
+from config import (QUALITY_MIN_SIZE, QUALITY_GOOD_SIZE, QUALITY_MIN_BLUR, QUALITY_GOOD_BLUR,
+                    QUALITY_MAX_YAW, QUALITY_MIN_DET_SCORE, QUALITY_TRACK_IOU, QUALITY_TRACK_TTL,
+                    QUALITY_RESULT_TTL)
+from face_backends import iou_matrix
+
+FaceQuality = namedtuple("FaceQuality", ["size", "blur", "yaw", "det_score", "score", "accepted"])
+
+
+def _box_sums(integral, x1, y1, x2, y2):
+    return integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+
+
+def laplacian_variance(img, bboxes):
+    """Phương sai Laplacian trong từng hộp (x1, y1, x2, y2), vector hóa bằng ảnh tích phân."""
+    h, w = img.shape[:2]
+    boxes = np.rint(np.asarray(bboxes, dtype=np.float64)[:, 0:4]).astype(np.int64)
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, w)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, h)
+    # Chỉ tính Laplacian trên vùng bao mọi khuôn mặt
+    ox, oy = boxes[:, 0].min(), boxes[:, 1].min()
+    ex, ey = boxes[:, 2].max(), boxes[:, 3].max()
+    if ex - ox < 3 or ey - oy < 3:
+        return np.zeros(len(boxes), dtype=np.float32)
+    region = img[oy:ey, ox:ex]
+    gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY) if region.ndim == 3 else region
+    lap = cv2.Laplacian(gray, cv2.CV_32F)
+    total, squares = cv2.integral2(lap, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    x1, y1, x2, y2 = (boxes[:, 0] - ox, boxes[:, 1] - oy, boxes[:, 2] - ox, boxes[:, 3] - oy)
+    area = np.maximum((x2 - x1) * (y2 - y1), 1)
+    mean = _box_sums(total, x1, y1, x2, y2) / area
+    variance = _box_sums(squares, x1, y1, x2, y2) / area - mean ** 2
+    return np.maximum(variance, 0).astype(np.float32)
+
+
+def estimate_yaw(kpss):
+    """Chỉ số quay ngang từ 5 điểm mốc [N, 5, 2]; None nếu detector không có điểm mốc."""
+    if kpss is None:
+        return None
+    kpss = np.asarray(kpss, dtype=np.float32)
+    eye_mid = (kpss[:, 0, 0] + kpss[:, 1, 0]) / 2
+    half_eye_distance = np.maximum(np.abs(kpss[:, 1, 0] - kpss[:, 0, 0]) / 2, 1.0)
+    return np.abs(kpss[:, 2, 0] - eye_mid) / half_eye_distance
+
+
+def assess_faces(img, bboxes, kpss=None):
+    """Chấm chất lượng cho mọi khuôn mặt (bboxes [N, 5] như detector trả về). Trả về FaceQuality (mảng [N])."""
+    bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 5)
+    size = np.minimum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1])
+    det_score = bboxes[:, 4]
+    if len(bboxes) == 0:
+        empty = np.zeros(0, dtype=np.float32)
+        return FaceQuality(empty, empty, empty, empty, empty, np.zeros(0, dtype=bool))
+    blur = laplacian_variance(img, bboxes)
+    yaw = estimate_yaw(kpss)
+    if yaw is None:
+        yaw = np.zeros(len(bboxes), dtype=np.float32)
+
+    accepted = ((size >= QUALITY_MIN_SIZE) & (blur >= QUALITY_MIN_BLUR)
+                & (yaw <= QUALITY_MAX_YAW) & (det_score >= QUALITY_MIN_DET_SCORE))
+    # Điểm tổng hợp trong [0, 1] để so sánh các lần nhìn thấy cùng một khuôn mặt
+    score = (np.clip(size / QUALITY_GOOD_SIZE, 0, 1)
+             * np.clip(blur / QUALITY_GOOD_BLUR, 0, 1)
+             * np.clip(1 - 0.5 * yaw / QUALITY_MAX_YAW, 0, 1)
+             * np.clip(det_score, 0, 1))
+    return FaceQuality(size, blur, yaw, det_score, score.astype(np.float32), accepted)
+
+
+class Track:
+    """Một khuôn mặt được theo dõi. Các trường chỉ được sửa khi giữ khóa của FaceTracker."""
+    __slots__ = ("track_id", "box", "last_seen", "result", "result_quality", "result_time", "result_key",
+                 "best_crop", "best_landmarks", "best_quality", "best_embedding", "best_model_id")
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.last_seen = now
+        self.result = None          # {"name", "id"} của lần nhận diện gần nhất
+        self.result_quality = 0.0
+        self.result_time = 0.0
+        self.result_key = None      # (thế hệ ảnh chụp chỉ mục, model_id) của kết quả
+        self.best_crop = None       # Ảnh crop đã căn chỉnh theo điểm mốc, chất lượng cao nhất
+        self.best_landmarks = None  # Điểm mốc của best_crop (tọa độ ảnh crop)
+        self.best_quality = 0.0
+        self.best_embedding = None  # Embedding của best_crop, trong không gian best_model_id
+        self.best_model_id = None
+
+
+class FaceTracker:
+    """Ghép khuôn mặt giữa các lần xử lý theo IoU (tham lam, IoU giảm dần). An toàn đa luồng."""
+    def __init__(self, iou_threshold=QUALITY_TRACK_IOU, ttl=QUALITY_TRACK_TTL, result_ttl=QUALITY_RESULT_TTL):
+        self.iou_threshold = iou_threshold
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._tracks = []
+        self._ids = itertools.count(1)
+        self._frame_shape = None
+
+    def assign(self, bboxes, frame_shape, now=None):
+        """Trả về một Track cho mỗi hộp (tạo track mới nếu không ghép được); track quá ttl bị bỏ."""
+        now = monotonic() if now is None else now
+        boxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 5)[:, 0:4]
+        with self._lock:
+            if frame_shape != self._frame_shape:
+                # Đổi nguồn/kích thước khung hình: các track cũ không còn nghĩa
+                self._tracks = []
+                self._frame_shape = frame_shape
+            self._tracks = [t for t in self._tracks if now - t.last_seen <= self.ttl]
+            assigned = [None] * len(boxes)
+            if self._tracks and len(boxes):
+                iou = iou_matrix(boxes, np.array([t.box for t in self._tracks]))
+                used = set()
+                for row, col in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                    if iou[row, col] < self.iou_threshold:
+                        break
+                    if assigned[row] is None and col not in used:
+                        assigned[row] = self._tracks[col]
+                        used.add(col)
+            for row, box in enumerate(boxes):
+                track = assigned[row]
+                if track is None:
+                    track = assigned[row] = Track(next(self._ids), box, now)
+                    self._tracks.append(track)
+                track.box = box
+                track.last_seen = now
+            return assigned
+
+    def reusable_result(self, track, quality, accepted, result_key, now=None):
+        """
+        Kết quả cũ của track nếu còn dùng được: cùng chỉ mục/mô hình, chưa quá result_ttl, và khuôn mặt lần này
+        không tốt hơn lần đã nhận diện (hoặc không đạt ngưỡng chất lượng). Ngược lại None.
+        """
+        now = monotonic() if now is None else now
+        with self._lock:
+            if (track.result is None or track.result_key != result_key
+                    or now - track.result_time > self.result_ttl):
+                return None
+            if accepted and quality > track.result_quality:
+                return None
+            return dict(track.result)
+
+    def update(self, track, result, quality, result_key, crop=None, landmarks=None, now=None,
+               embedding=None, model_id=None):
+        """
+        Ghi kết quả nhận diện mới; giữ crop (cùng điểm mốc và embedding của model_id) nếu đây là lần nhìn thấy
+        tốt nhất, hoặc nếu embedding của lần tốt nhất trước thuộc mô hình khác.
+        """
+        now = monotonic() if now is None else now
+        with self._lock:
+            track.result = {"name": result["name"], "id": result["id"]}
+            track.result_quality = quality
+            track.result_time = now
+            track.result_key = result_key
+            if crop is not None and (quality > track.best_quality or track.best_model_id != model_id):
+                track.best_crop = crop
+                track.best_landmarks = landmarks
+                track.best_quality = quality
+                track.best_embedding = embedding
+                track.best_model_id = model_id
+
+    def best_sample(self, track, model_id):
+        """(crop, landmarks, quality, embedding) tốt nhất của track nếu có embedding của model_id, ngược lại None."""
+        with self._lock:
+            if track.best_crop is None or track.best_embedding is None or track.best_model_id != model_id:
+                return None
+            return track.best_crop, track.best_landmarks, track.best_quality, track.best_embedding
+
+    def best_crop_for(self, bbox, frame_shape):
+        """(crop, landmarks, quality) tốt nhất của track trùng với hộp bbox trên khung hình cùng kích thước, hoặc None."""
+        with self._lock:
+            if frame_shape != self._frame_shape or not self._tracks:
+                return None
+            iou = iou_matrix(np.asarray(bbox, dtype=np.float32)[None, 0:4], np.array([t.box for t in self._tracks]))[0]
+            col = int(np.argmax(iou))
+            track = self._tracks[col]
+            if iou[col] < self.iou_threshold or track.best_crop is None:
+                return None
+            return track.best_crop, track.best_landmarks, track.best_quality
+
+    def clear(self):
+        with self._lock:
+            self._tracks = []
+            self._frame_shape = None
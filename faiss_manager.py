@@ -1,27 +1,330 @@
 import faiss
 import numpy as np
 import os
+import re
 import json
+import zlib
+from collections import namedtuple
 import database_manager as db
+from config import FAISS_USE_MMAP, SOURCE_SCOPES, DEFAULT_SCOPE
 
-# Đặt tên file cho chỉ mục và file ánh xạ ID
+# Tên file chỉ mục/ánh xạ kiểu cũ (trước khi có manifest), chỉ dùng để chuyển đổi
 FAISS_INDEX_FILE = "student_faces.index"
-ID_MAPPING_FILE = "student_ids.json"
+# Ánh xạ ID lưu dạng mảng NumPy chuỗi độ dài cố định (.npy) để có thể memory-map
+ID_MAPPING_FILE = "student_ids.npy"
+# File ánh xạ JSON cũ, chỉ dùng để chuyển đổi sang định dạng mới
+LEGACY_ID_MAPPING_FILE = "student_ids.json"
+
+# Mỗi lần lưu tạo một "thế hệ" (generation) file mới; manifest trỏ tới thế hệ hiện hành.
+# Không bao giờ ghi đè file đang được đọc/memory-map, manifest là điểm commit duy nhất.
+MANIFEST_FILE = "student_index.manifest.json"
+INDEX_FILE_PATTERN = "student_faces.g{:06d}.index"
+MAPPING_FILE_PATTERN = "student_ids.g{:06d}.npy"
+GENERATION_FILE_RE = re.compile(r"^student_(?:faces|ids)\.g(\d{6})\.(?:index|npy)(?:\.tmp)?$")
+KEEP_GENERATIONS = 2  # Giữ lại thế hệ trước để tiến trình khác đang mmap vẫn đọc được
+
+# Thư mục chứa chỉ mục; None = thư mục chứa file Python (có thể đổi, ví dụ khi chạy benchmark)
+INDEX_DIR = None
+
+def _get_base_dir():
+    if INDEX_DIR is not None:
+        return INDEX_DIR
+    return os.path.dirname(os.path.abspath(__file__))
+
+def _get_paths():
+    """Trả về đường dẫn tuyệt đối tới file chỉ mục và file ánh xạ ID kiểu cũ (không có manifest)."""
+    base_dir = _get_base_dir()
+    index_path = os.path.join(base_dir, FAISS_INDEX_FILE)
+    mapping_path = os.path.join(base_dir, ID_MAPPING_FILE)
+    return index_path, mapping_path
+
+def _get_generation_paths(generation):
+    """Trả về đường dẫn file chỉ mục và file ánh xạ của một thế hệ."""
+    base_dir = _get_base_dir()
+    index_path = os.path.join(base_dir, INDEX_FILE_PATTERN.format(generation))
+    mapping_path = os.path.join(base_dir, MAPPING_FILE_PATTERN.format(generation))
+    return index_path, mapping_path
+
+def _fsync_file(path):
+    with open(path, 'rb+') as f:
+        os.fsync(f.fileno())
+
+def _fsync_dir(dir_path):
+    """Đảm bảo thao tác đổi tên đã được ghi xuống đĩa (không hỗ trợ trên Windows)."""
+    if os.name == 'nt':
+        return
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _file_checksum(path):
+    """CRC32 của toàn bộ file, đọc theo từng khối 1 MB."""
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def _manifest_checksum(manifest):
+    """Checksum gắn kết thế hệ, nội dung chỉ mục, ánh xạ và phiên bản CSDL."""
+    key = "{generation}:{count}:{index_crc32}:{mapping_crc32}:{roster_version}".format(**manifest)
+    return zlib.crc32(key.encode('utf-8'))
+
+def _read_manifest():
+    """Đọc manifest hiện hành. Trả về None nếu chưa có hoặc manifest hỏng."""
+    manifest_path = os.path.join(_get_base_dir(), MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get("checksum") != _manifest_checksum(manifest):
+            print("[Faiss Lỗi] Checksum của manifest không khớp, bỏ qua manifest.")
+            return None
+        return manifest
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[Faiss Lỗi] Không thể đọc manifest: {e}")
+        return None
+
+def _save_id_mapping(id_mapping, mapping_path):
+    """Ghi ánh xạ ID ra file .npy (mảng unicode độ dài cố định, không cần pickle)."""
+    mapping_array = np.asarray([str(i) for i in id_mapping], dtype=np.str_)
+    with open(mapping_path, 'wb') as f:
+        np.save(f, mapping_array, allow_pickle=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _load_id_mapping(mapping_path, mmap=False):
+    """
+    Đọc ánh xạ ID từ file .npy.
+    mmap=True: trả về mảng chỉ đọc được memory-map (các tiến trình dùng chung page cache).
+    mmap=False: trả về list[str] để có thể sửa (append/pop).
+    """
+    mapping_array = np.load(mapping_path, mmap_mode='r' if mmap else None, allow_pickle=False)
+    if mmap:
+        return mapping_array
+    return mapping_array.tolist()
+
+def _migrate_legacy_mapping(mapping_path):
+    """Chuyển file ánh xạ JSON cũ (nếu có) sang định dạng .npy."""
+    legacy_path = os.path.join(os.path.dirname(mapping_path), LEGACY_ID_MAPPING_FILE)
+    if os.path.exists(mapping_path) or not os.path.exists(legacy_path):
+        return
+    try:
+        with open(legacy_path, 'r') as f:
+            id_mapping = json.load(f)
+        _save_id_mapping(id_mapping, mapping_path)
+        print(f"[Faiss] Đã chuyển ánh xạ '{LEGACY_ID_MAPPING_FILE}' sang '{ID_MAPPING_FILE}'.")
+    except (OSError, ValueError) as e:
+        print(f"[Faiss Lỗi] Không thể chuyển đổi ánh xạ JSON cũ: {e}")
+
+def _read_index(index_path, mmap=False):
+    """
+    Đọc chỉ mục Faiss. Với mmap=True, dùng IO_FLAG_MMAP để ánh xạ file thay vì đọc toàn bộ vào RAM.
+    Nếu loại chỉ mục/phiên bản Faiss không hỗ trợ mmap thì đọc bình thường.
+    """
+    if mmap and hasattr(faiss, "IO_FLAG_MMAP"):
+        flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+        try:
+            return faiss.read_index(index_path, flags)
+        except RuntimeError as e:
+            print(f"[Faiss] Không thể memory-map chỉ mục ({e}), chuyển sang đọc thông thường.")
+    return faiss.read_index(index_path)
+
+def _model_encodings(students, model_id):
+    """
+    face_encoding của các học sinh thuộc không gian embedding model_id (id -> vector).
+    Mã hóa của mô hình khác (đang mã hóa lại dở dang) không được trộn vào cùng chỉ mục.
+    """
+    encodings = {s["id"]: s["face_encoding"] for s in students
+                 if s["face_encoding"] is not None and s.get("embedding_model") == model_id}
+    skipped = sum(1 for s in students if s["face_encoding"] is not None) - len(encodings)
+    if skipped:
+        print(f"[Faiss] Bỏ qua {skipped} mã hóa không thuộc mô hình {model_id}.")
+    return encodings
+
+def _write_snapshot(index, id_mapping, roster_version=None, model_id=None):
+    """
+    Ghi chỉ mục và ánh xạ thành một thế hệ mới theo cách an toàn khi bị crash:
+    ghi file tạm -> fsync -> đổi tên, sau đó mới thay manifest (điểm commit).
+    Nếu crash giữa chừng, manifest cũ vẫn trỏ tới cặp file cũ còn nguyên vẹn.
+    model_id: không gian embedding của chỉ mục, mặc định là của phần lớn mã hóa trong CSDL.
+    """
+    base_dir = _get_base_dir()
+    current = _read_manifest()
+    generation = (current["generation"] if current else 0) + 1
+    if roster_version is None:
+        roster_version = db.get_roster_version()
+    if model_id is None:
+        model_id = db.get_embedding_model() or db.LEGACY_EMBEDDING_MODEL
+    index_path, mapping_path = _get_generation_paths(generation)
+
+    index_tmp = index_path + ".tmp"
+    faiss.write_index(index, index_tmp)
+    _fsync_file(index_tmp)
+    os.replace(index_tmp, index_path)
+
+    mapping_tmp = mapping_path + ".tmp"
+    _save_id_mapping(id_mapping, mapping_tmp)
+    os.replace(mapping_tmp, mapping_path)
+
+    manifest = {
+        "generation": generation,
+        "count": int(index.ntotal),
+        "dim": int(index.d),
+        "index_file": os.path.basename(index_path),
+        "mapping_file": os.path.basename(mapping_path),
+        "index_size": os.path.getsize(index_path),
+        "mapping_size": os.path.getsize(mapping_path),
+        "index_crc32": _file_checksum(index_path),
+        "mapping_crc32": _file_checksum(mapping_path),
+        "roster_version": roster_version,
+        "model_id": model_id,
+    }
+    manifest["checksum"] = _manifest_checksum(manifest)
+
+    manifest_path = os.path.join(base_dir, MANIFEST_FILE)
+    manifest_tmp = manifest_path + ".tmp"
+    with open(manifest_tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest_tmp, manifest_path)
+    _fsync_dir(base_dir)
+
+    _prune_generations(generation)
+    return manifest
+
+def _prune_generations(current_generation):
+    """Xóa các thế hệ cũ và file tạm sót lại. Bỏ qua file đang bị khóa (ví dụ đang mmap trên Windows)."""
+    base_dir = _get_base_dir()
+    oldest_kept = current_generation - KEEP_GENERATIONS + 1
+    for name in os.listdir(base_dir):
+        match = GENERATION_FILE_RE.match(name)
+        if not match:
+            continue
+        generation = int(match.group(1))
+        if generation < oldest_kept or (name.endswith(".tmp") and generation != current_generation):
+            try:
+                os.remove(os.path.join(base_dir, name))
+            except OSError:
+                pass
+
+def _open_snapshot(manifest, mmap, verify_checksum=False):
+    """
+    Mở thế hệ mà manifest trỏ tới và kiểm tra nhanh tính nhất quán
+    (kích thước file, số vector, độ dài ánh xạ). Ném ValueError nếu không khớp.
+    verify_checksum=True đọc lại toàn bộ file để so CRC32 (chậm hơn).
+    """
+    index_path, mapping_path = _get_generation_paths(manifest["generation"])
+    for path, size_key, crc_key in ((index_path, "index_size", "index_crc32"),
+                                    (mapping_path, "mapping_size", "mapping_crc32")):
+        if os.path.getsize(path) != manifest[size_key]:
+            raise ValueError(f"Kích thước '{os.path.basename(path)}' không khớp với manifest.")
+        if verify_checksum and _file_checksum(path) != manifest[crc_key]:
+            raise ValueError(f"Checksum '{os.path.basename(path)}' không khớp với manifest.")
+
+    index = _read_index(index_path, mmap)
+    id_mapping = _load_id_mapping(mapping_path, mmap)
+    if index.ntotal != len(id_mapping) or index.ntotal != manifest["count"]:
+        raise ValueError(f"Số vector ({index.ntotal}) và ánh xạ ({len(id_mapping)}) không khớp.")
+    return index, id_mapping
+
+def _repair_index(index, id_mapping):
+    """
+    Sửa chỉ mục lệch với CSDL theo kiểu tăng dần: giữ lại các vector vẫn khớp với mã hóa trong CSDL,
+    bỏ vector của học sinh đã xóa/đổi ảnh và chỉ thêm vector còn thiếu, thay vì xây dựng lại toàn bộ.
+    """
+    students = db.get_all_students()
+    db_encodings = _model_encodings(students, db.get_embedding_model())
+    d = len(next(iter(db_encodings.values()))) if db_encodings else index.d
+
+    n = min(index.ntotal, len(id_mapping)) if index.d == d else 0
+    kept_ids = []
+    kept_vectors = np.empty((0, d), dtype='float32')
+    if n > 0:
+        vectors = index.reconstruct_n(0, n)
+        expected = np.zeros((n, d), dtype='float32')
+        present = np.zeros(n, dtype=bool)
+        for row, student_id in enumerate(id_mapping[:n]):
+            encoding = db_encodings.get(str(student_id))
+            if encoding is not None:
+                expected[row] = encoding
+                present[row] = True
+        faiss.normalize_L2(expected)
+        # Vector khớp nếu cosine gần như bằng 1 với mã hóa hiện tại trong CSDL
+        keep = present & (np.einsum('ij,ij->i', vectors, expected) > 0.9999)
+        seen = set()
+        for row in np.flatnonzero(keep):
+            student_id = str(id_mapping[row])
+            if student_id in seen:
+                keep[row] = False
+            else:
+                seen.add(student_id)
+                kept_ids.append(student_id)
+        kept_vectors = vectors[keep]
+
+    kept = set(kept_ids)
+    missing_ids = [sid for sid in db_encodings if sid not in kept]
+
+    repaired = faiss.IndexFlatL2(d)
+    if len(kept_vectors):
+        repaired.add(np.ascontiguousarray(kept_vectors))
+    if missing_ids:
+        missing_vectors = np.array([db_encodings[sid] for sid in missing_ids]).astype('float32')
+        faiss.normalize_L2(missing_vectors)
+        repaired.add(missing_vectors)
+
+    print(f"[Faiss] Sửa chỉ mục: giữ {len(kept_ids)}, bỏ {n - len(kept_ids)}, thêm {len(missing_ids)} vector.")
+    return repaired, kept_ids + missing_ids
+
+def _migrate_legacy_files():
+    """
+    Chuyển cặp file kiểu cũ (student_faces.index + ánh xạ) sang thế hệ đầu tiên có manifest.
+    Trả về True nếu đã chuyển.
+    """
+    index_path, mapping_path = _get_paths()
+    _migrate_legacy_mapping(mapping_path)
+    if not os.path.exists(index_path) or not os.path.exists(mapping_path):
+        return False
+    try:
+        index = faiss.read_index(index_path)
+        id_mapping = _load_id_mapping(mapping_path)
+    except (RuntimeError, OSError, ValueError) as e:
+        print(f"[Faiss Lỗi] Không thể đọc chỉ mục kiểu cũ: {e}")
+        return False
+    # File cũ có thể đã lệch nhau nên luôn đối chiếu với CSDL trước khi ghi thế hệ mới
+    index, id_mapping = _repair_index(index, id_mapping)
+    _write_snapshot(index, id_mapping)
+    for path in (index_path, mapping_path, os.path.join(_get_base_dir(), LEGACY_ID_MAPPING_FILE)):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+    print("[Faiss] Đã chuyển chỉ mục kiểu cũ sang định dạng có manifest.")
+    return True
 
 def build_and_save_index():
     """
     Lấy tất cả các face encoding từ CSDL, xây dựng chỉ mục Faiss và lưu ra file.
     """
     print("[Faiss] Bắt đầu xây dựng chỉ mục từ CSDL...")
+    # Đọc phiên bản trước khi đọc dữ liệu: nếu CSDL đổi trong lúc xây dựng, lần tải sau sẽ tự sửa
+    roster_version = db.get_roster_version()
+    model_id = db.get_embedding_model()
     students = db.get_all_students()
 
     if not students:
         print("[Faiss] CSDL rỗng, không có gì để xây dựng.")
         return
 
-    # Lấy ra các mã hóa khuôn mặt và ID tương ứng
-    face_encodings = [s["face_encoding"] for s in students if s["face_encoding"] is not None]
-    student_ids = [s["id"] for s in students if s["face_encoding"] is not None]
+    # Lấy ra các mã hóa khuôn mặt (cùng một mô hình) và ID tương ứng
+    encodings = _model_encodings(students, model_id)
+    face_encodings = list(encodings.values())
+    student_ids = list(encodings)
 
     if not face_encodings:
         print("[Faiss] Không tìm thấy face encoding hợp lệ trong CSDL.")
@@ -29,7 +332,7 @@ def build_and_save_index():
 
     # Chuyển đổi danh sách thành một mảng NumPy
     encodings_matrix = np.array(face_encodings).astype('float32')
-    
+
     # Chuẩn hóa các vector (quan trọng để so sánh cosine)
     faiss.normalize_L2(encodings_matrix)
 
@@ -38,121 +341,141 @@ def build_and_save_index():
 
     # Tạo chỉ mục Faiss. IndexFlatL2 là chỉ mục đơn giản nhất, thực hiện tìm kiếm chính xác.
     index = faiss.IndexFlatL2(d)
-    
+
     # Thêm các vector vào chỉ mục
     index.add(encodings_matrix)
 
     print(f"[Faiss] Đã xây dựng xong chỉ mục với {index.ntotal} vector.")
 
     # --- Lưu chỉ mục và file ánh xạ ---
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    index_path = os.path.join(base_dir, FAISS_INDEX_FILE)
-    mapping_path = os.path.join(base_dir, ID_MAPPING_FILE)
-    
-    faiss.write_index(index, index_path)
-    with open(mapping_path, 'w') as f:
-        json.dump(student_ids, f)
-        
-    print(f"[Faiss] Đã lưu chỉ mục vào '{FAISS_INDEX_FILE}' và ánh xạ vào '{ID_MAPPING_FILE}'.")
+    manifest = _write_snapshot(index, student_ids, roster_version, model_id)
 
+    print(f"[Faiss] Đã lưu chỉ mục thế hệ {manifest['generation']} ({model_id}) vào '{manifest['index_file']}'.")
 
-def load_index():
+
+def load_index(mmap=None):
     """
-    Tải chỉ mục Faiss và file ánh xạ ID từ file.
-    Nếu file không tồn tại, gọi hàm build_and_save_index().
+    Tải chỉ mục Faiss và file ánh xạ ID theo manifest hiện hành.
+    - Chưa có manifest: chuyển từ file kiểu cũ hoặc gọi build_and_save_index().
+    - File hỏng/không khớp manifest: xây dựng lại toàn bộ.
+    - Phiên bản CSDL khác với lúc lưu: sửa chỉ mục tăng dần (_repair_index).
+    - CSDL đã được mã hóa lại bằng mô hình khác (model_id của manifest khác): xây dựng lại toàn bộ.
+    mmap=None dùng giá trị FAISS_USE_MMAP trong config. Khi mmap=True, chỉ mục và ánh xạ là chỉ đọc.
     """
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    index_path = os.path.join(base_dir, FAISS_INDEX_FILE)
-    mapping_path = os.path.join(base_dir, ID_MAPPING_FILE)
+    if mmap is None:
+        mmap = FAISS_USE_MMAP
 
-    if not os.path.exists(index_path) or not os.path.exists(mapping_path):
+    manifest = _read_manifest()
+    if manifest is None and not _migrate_legacy_files():
         print("[Faiss] Không tìm thấy file chỉ mục. Bắt đầu xây dựng lại từ đầu...")
         build_and_save_index()
+    manifest = _read_manifest()
+    if manifest is None:
+        print("[Faiss] Không có chỉ mục để tải.")
+        return None, None
+
+    # Manifest trước khi có model_id đều là chỉ mục buffalo_sc
+    model_id = db.get_embedding_model()
+    if model_id is not None and manifest.get("model_id", db.LEGACY_EMBEDDING_MODEL) != model_id:
+        print(f"[Faiss] Chỉ mục thuộc mô hình {manifest.get('model_id', db.LEGACY_EMBEDDING_MODEL)}, "
+              f"CSDL đã chuyển sang {model_id}. Xây dựng lại...")
+        build_and_save_index()
+        manifest = _read_manifest()
 
     try:
         print("[Faiss] Đang tải chỉ mục...")
-        index = faiss.read_index(index_path)
-        with open(mapping_path, 'r') as f:
-            id_mapping = json.load(f)
-        print(f"[Faiss] Tải thành công chỉ mục với {index.ntotal} vector.")
-        return index, id_mapping
+        index, id_mapping = _open_snapshot(manifest, mmap)
     except Exception as e:
         print(f"[Faiss Lỗi] Không thể tải chỉ mục: {e}. Thử xây dựng lại.")
         build_and_save_index()
         # Thử tải lại lần nữa sau khi xây dựng
         try:
-            index = faiss.read_index(index_path)
-            with open(mapping_path, 'r') as f:
-                id_mapping = json.load(f)
-            return index, id_mapping
+            manifest = _read_manifest()
+            index, id_mapping = _open_snapshot(manifest, mmap, verify_checksum=True)
         except Exception as final_e:
             print(f"[Faiss Lỗi nghiêm trọng] Không thể tải chỉ mục ngay cả sau khi xây dựng lại: {final_e}")
             return None, None
-    
-def add_to_index(student_id, face_encoding):
+
+    roster_version = db.get_roster_version()
+    if manifest.get("roster_version") != roster_version:
+        print(f"[Faiss] Chỉ mục (phiên bản {manifest.get('roster_version')}) lệch với CSDL "
+              f"(phiên bản {roster_version}). Sửa chỉ mục...")
+        index, id_mapping = _repair_index(index, list(id_mapping))
+        manifest = _write_snapshot(index, id_mapping, roster_version)
+        if mmap:
+            index, id_mapping = _open_snapshot(manifest, mmap)
+
+    print(f"[Faiss] Tải thành công chỉ mục thế hệ {manifest['generation']} với {index.ntotal} vector.")
+    return index, id_mapping
+
+def sync_index():
     """
-    Thêm 1 face_encoding và student_id vào Faiss index và cập nhật file ánh xạ.
+    Đưa chỉ mục về khớp với CSDL sau khi thêm/sửa mã hóa/xóa học sinh (CSDL là nguồn duy nhất).
+    Trigger của bảng students đã tăng roster_version nên load_index chạy đúng một lần _repair_index
+    (giữ vector còn khớp, thêm/bỏ phần thay đổi) và ghi đúng một thế hệ mới với roster_version hiện tại;
+    CSDL không đổi thì không ghi gì. Trả về (index, id_mapping) không mmap.
     """
-    if face_encoding is None or student_id is None:
-        print("[Faiss] Thông tin không hợp lệ, không thể thêm vào chỉ mục.")
-        return
+    index, id_mapping = load_index(mmap=False)
+    if index is not None:
+        print(f"[Faiss] Chỉ mục đã khớp với CSDL: {index.ntotal} vector.")
+    return index, id_mapping
 
-    # Đọc index hiện tại hoặc tạo mới
-    index, id_mapping = load_index()
-    if index is None:
-        print("[Faiss] Tạo mới chỉ mục Faiss.")
-        d = len(face_encoding)
-        index = faiss.IndexFlatL2(d)
-        id_mapping = []
-
-    # Chuẩn hóa và thêm vector
-    face_vector = np.array([face_encoding], dtype='float32')
-    faiss.normalize_L2(face_vector)
-    index.add(face_vector)
-    id_mapping.append(student_id)
-
-    # Lưu lại
-    _save_index_and_mapping(index, id_mapping)
-    print(f"[Faiss] Đã thêm 1 vector vào chỉ mục. Tổng số: {index.ntotal} vector.")
-
-def _save_index_and_mapping(index, id_mapping):
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    index_path = os.path.join(base_dir, FAISS_INDEX_FILE)
-    mapping_path = os.path.join(base_dir, ID_MAPPING_FILE)
-
-    faiss.write_index(index, index_path)
-    with open(mapping_path, 'w') as f:
-        json.dump(id_mapping, f)
+# Phạm vi tìm kiếm của một camera/nguồn: chỉ so khớp với học sinh của một năm học và/hoặc một lớp
+# (cột school_year, class). None ở một trường là mọi giá trị; phạm vi None là toàn trường (chỉ mục chung).
+Scope = namedtuple("Scope", ["school_year", "class_name"])
 
-def remove_from_index(student_id):
+def parse_scope(text):
     """
-    Xóa face_encoding và student_id khỏi Faiss index và file ánh xạ.
+    "2025-2026/10A" -> năm học + lớp, "10A" -> lớp (mọi năm học), "2025-2026/*" -> cả năm học.
+    Chuỗi rỗng, None hoặc "*" là toàn trường (trả về None).
     """
-    index, id_mapping = load_index()
-    if index is None or id_mapping is None:
-        print("[Faiss] Không thể tải chỉ mục để xóa.")
-        return
+    if text is None or isinstance(text, Scope):
+        return text
+    school_year, _, class_name = str(text).strip().rpartition("/")
+    school_year = school_year.strip() if school_year.strip() not in ("", "*") else None
+    class_name = class_name.strip() if class_name.strip() not in ("", "*") else None
+    if school_year is None and class_name is None:
+        return None
+    return Scope(school_year, class_name)
 
-    try:
-        remove_idx = id_mapping.index(student_id)
-    except ValueError:
-        print(f"[Faiss] Không tìm thấy student_id {student_id} trong ánh xạ.")
-        return
+def format_scope(scope):
+    """Dạng chuỗi của phạm vi (ngược với parse_scope); "*" là toàn trường."""
+    if scope is None:
+        return "*"
+    if scope.school_year is None:
+        return scope.class_name
+    return f"{scope.school_year}/{scope.class_name or '*'}"
 
-    # Xóa vector bằng cách tạo lại index mới trừ đi phần tử đó
-    vectors = index.reconstruct_n(0, index.ntotal)
-    vectors = np.delete(vectors, remove_idx, axis=0)
-    id_mapping.pop(remove_idx)
-
-    if len(vectors) == 0:
-        print("[Faiss] Đã xóa hết vector, làm trống chỉ mục.")
-        d = index.d
-        index = faiss.IndexFlatL2(d)
-    else:
-        faiss.normalize_L2(vectors)
-        d = vectors.shape[1]
-        index = faiss.IndexFlatL2(d)
-        index.add(vectors)
-
-    _save_index_and_mapping(index, id_mapping)
-    print(f"[Faiss] Đã xóa 1 vector. Còn lại: {index.ntotal} vector.")
+def scope_for_source(source):
+    """Phạm vi cấu hình cho nguồn (ví dụ "camera:0" hoặc đường dẫn video) trong SOURCE_SCOPES, mặc định DEFAULT_SCOPE."""
+    return parse_scope(SOURCE_SCOPES.get(str(source), DEFAULT_SCOPE))
+
+def available_scopes(students):
+    """Các phạm vi có học sinh: từng năm học, rồi từng lớp trong năm học đó (đã sắp xếp)."""
+    pairs = {(s.get("school_year"), s.get("class")) for s in students if s.get("school_year") and s.get("class")}
+    scopes = []
+    for school_year in sorted({year for year, _ in pairs}):
+        scopes.append(Scope(school_year, None))
+        scopes.extend(Scope(school_year, class_name) for class_name in sorted(c for y, c in pairs if y == school_year))
+    return scopes
+
+def scope_members(students, scope):
+    """ID các học sinh thuộc phạm vi."""
+    return [s["id"] for s in students
+            if (scope.school_year is None or s.get("school_year") == scope.school_year)
+            and (scope.class_name is None or s.get("class") == scope.class_name)]
+
+def build_scoped_index(index, id_mapping, student_ids):
+    """
+    Chỉ mục con chỉ chứa vector của student_ids, cắt từ chỉ mục chung (cùng không gian embedding, vector đã
+    chuẩn hóa nên không cần đọc lại CSDL). Trả về (index, id_mapping) hoặc (None, None) nếu không có vector nào.
+    """
+    if index is None or id_mapping is None or index.ntotal == 0:
+        return None, None
+    mapping = np.asarray(id_mapping).astype(str)
+    rows = np.flatnonzero(np.isin(mapping, np.asarray(list(student_ids), dtype=str)))
+    if len(rows) == 0:
+        return None, None
+    scoped = faiss.IndexFlatL2(index.d)
+    scoped.add(np.ascontiguousarray(index.reconstruct_n(0, index.ntotal)[rows]))
+    return scoped, mapping[rows]
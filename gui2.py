@@ -1,28 +1,43 @@
 import sys
 import gc
+import argparse
 import os
 import pynvml
 import psutil
 import logging
 import uuid
+import config
 import faiss_manager
+import metrics
+import profiling
+from metrics_exporter import MetricsExporter
 import cv2
 import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget, 
-                             QPushButton, QListWidget, QComboBox, QGroupBox, QHBoxLayout, 
-                             QFileDialog, QMessageBox, QListWidgetItem, QGridLayout,
+                             QPushButton, QListView, QComboBox, QGroupBox, QHBoxLayout, 
+                             QFileDialog, QMessageBox, QLineEdit, QTabWidget, QGridLayout,
                              QStatusBar, QStyle, QDialog, QSlider,
                              QStyleOptionSlider)
-from PyQt5.QtCore import Qt, QSize, QTimer, QRect
-from PyQt5.QtGui import QPixmap, QImage, QPainter, QColor, QPen
+from PyQt5.QtCore import Qt, QTimer, QModelIndex, QSize
+from PyQt5.QtGui import QPixmap
 import database_manager as db
 from face_processor import FaceProcessor
+from face_backends import BackendUnavailable
+from crop_store import CropStore
+from image_store import ImageStore
+from embedding_migration import EmbeddingMigration, MigrationError, MigrationIncomplete
+from attendance import AttendanceTracker
 from add_student_dialog import AddStudentDialog
-from config import (RESIZE_FACTOR,
+from config import (METRICS_LOG_INTERVAL,
+                    METRICS_EXPORTER_ENABLED,
+                    METRICS_PORT,
                     FACE_DETECTION_ALGORITHMS,
-                    FACE_RECOGNITION_ALGORITHMS)
+                    FACE_RECOGNITION_ALGORITHMS,
+                    THUMBNAIL_SIZE)
 from scaler import FixedScaler
-from Video_Thread import VideoThread
+from overlay_renderer import OverlayRenderThread
+from student_list_model import RecognizedFacesModel, RosterModel, RosterFilterModel
+from Video_Thread import create_video_thread, TimelineThread, EmbeddingMigrationThread
 from time import time
 
 class CustomSlider(QSlider):
@@ -78,6 +93,10 @@ class MainWindow(QMainWindow):
 
         # --- Bước 1: Khởi tạo các đối tượng xử lý và dữ liệu ---
         self.scaler = FixedScaler(target_width=640)
+        # Dựng khung hình hiển thị (thu nhỏ, lật, vẽ kết quả) ngoài luồng GUI
+        self.overlay_thread = OverlayRenderThread(self.scaler, parent=self)
+        self.overlay_thread.rendered_signal.connect(self.on_overlay_rendered)
+        self.overlay_thread.start()
 
         # Tải chỉ mục Faiss và ánh xạ ID
         self.faiss_index, self.id_mapping = faiss_manager.load_index()
@@ -86,18 +105,38 @@ class MainWindow(QMainWindow):
         self.known_students_dict = {s['id']: s for s in self.known_students}
         
         # Khởi tạo FaceProcessor với chỉ mục Faiss
-        self.face_processor = FaceProcessor(self.faiss_index, self.id_mapping)
+        self.face_processor = FaceProcessor(self.faiss_index, self.id_mapping, self.known_students)
+
+        # Ảnh khuôn mặt đã căn chỉnh của học sinh đã đăng ký, để tính lại embedding không cần phát hiện lại
+        self.crop_store = CropStore()
+        # Ảnh đăng ký và ảnh thu nhỏ (giải mã có cache) cho dialog và danh sách học sinh
+        self.image_store = ImageStore()
+
+        # Điểm danh: ghi nhận khoảng thời gian có mặt, ghi CSDL bằng luồng nền
+        self.attendance = AttendanceTracker()
 
         # --- Bước 2: Khởi tạo các biến trạng thái của ứng dụng ---
         self.thread = None
+        # Dòng thời gian nhận diện tính trước của video đang mở
+        self.timeline_thread = None
+        self.timeline = None
+        self.timeline_video = None
+        # Mã hóa lại CSDL bằng mô hình nhận diện khác (chạy nền)
+        self.migration_thread = None
         self.current_frame = None  # Đổi tên từ current_frame_cv cho nhất quán
         self.recognition_results = []
         self.selected_student_id = None
+        # (FaceSample, ảnh chân dung) đã tính sẵn của khuôn mặt đang chọn, dùng khi đăng ký
+        self.selected_sample = None
         self.last_results = []
 
         # --- Bước 3: Khai báo trước các biến sẽ chứa Widget (được tạo trong init_ui) ---
         self.image_label = None
-        self.student_list_widget = None
+        self.student_list_view = None
+        self.faces_model = None
+        self.roster_view = None
+        self.roster_model = None
+        self.roster_filter = None
         self.detect_algo_combo = None
         self.recognize_algo_combo = None
 
@@ -132,6 +171,11 @@ class MainWindow(QMainWindow):
         self.resource_timer = QTimer(self)
         self.resource_timer.timeout.connect(self.update_resource_usage)
         self.resource_timer.start(2000)  # Cập nhật mỗi 2 giây
+
+        # Định kỳ ghi tóm tắt số đo hiệu năng vào performance.log
+        self.metrics_log_timer = QTimer(self)
+        self.metrics_log_timer.timeout.connect(metrics.log_summary)
+        self.metrics_log_timer.start(METRICS_LOG_INTERVAL * 1000)
         
         # Khởi tạo pynvml để theo dõi GPU
         self.gpu_available = False
@@ -203,7 +247,8 @@ class MainWindow(QMainWindow):
         # -------------------------
         # 📌 Kết nối sự kiện
         # -------------------------
-        self.student_list_widget.itemClicked.connect(self.display_student_info)
+        self.student_list_view.clicked.connect(self.display_student_info)
+        self.roster_view.clicked.connect(self.display_student_info)
         self.image_label.mousePressEvent = self.on_image_click
 
     def create_algorithm_group(self):
@@ -213,9 +258,13 @@ class MainWindow(QMainWindow):
 
         self.detect_algo_combo = QComboBox()
         self.detect_algo_combo.addItems(FACE_DETECTION_ALGORITHMS)
+        self.detect_algo_combo.setCurrentText(self.face_processor.detector_name)
+        self.detect_algo_combo.currentTextChanged.connect(self.change_detector)
 
         self.recognize_algo_combo = QComboBox()
         self.recognize_algo_combo.addItems(FACE_RECOGNITION_ALGORITHMS)
+        self.recognize_algo_combo.setCurrentText(self.face_processor.recognizer_name)
+        self.recognize_algo_combo.currentTextChanged.connect(self.change_recognizer)
 
         detect_row = QHBoxLayout()
         detect_row.addWidget(QLabel("Detect"))
@@ -225,41 +274,222 @@ class MainWindow(QMainWindow):
         recognize_row = QHBoxLayout()
         recognize_row.addWidget(QLabel("Recognize"))
         recognize_row.addWidget(self.recognize_algo_combo)
-        
+
+        # Phạm vi tìm kiếm (năm học/lớp) của nguồn đang mở; mặc định lấy theo config.SOURCE_SCOPES khi mở nguồn
+        self.scope_combo = QComboBox()
+        self._refresh_scope_combo()
+        self.scope_combo.currentIndexChanged.connect(self.change_scope)
+
+        scope_row = QHBoxLayout()
+        scope_row.addWidget(QLabel("Phạm vi"))
+        scope_row.addWidget(self.scope_combo)
 
         layout.addLayout(detect_row, 0, 0)
         layout.addLayout(recognize_row, 0, 1)
+        layout.addLayout(scope_row, 0, 2)
         layout.setContentsMargins(10, 0, 280, 0)    #left, top, right, bottom  
         layout.setHorizontalSpacing(30)  
         
         group.setLayout(layout)
         return group
     
-    def create_list_group(self):
-        """Tạo group box cho danh sách học sinh nhận diện."""
-        group = QGroupBox("Danh sách nhận diện")
-        layout = QVBoxLayout()
-        self.student_list_widget = QListWidget()
-        
-        # --- THAY ĐỔI 1: Áp dụng Style Sheet và đổi con trỏ chuột ---
-        self.student_list_widget.setCursor(Qt.PointingHandCursor)
-        self.student_list_widget.setStyleSheet("""
-            QListWidget::item:selected, QListWidget::item:selected:!active {
+    def _revert_combo(self, combo, text):
+        """Chọn lại mục cũ mà không phát lại tín hiệu đổi backend."""
+        combo.blockSignals(True)
+        combo.setCurrentText(text)
+        combo.blockSignals(False)
+
+    def change_detector(self, name):
+        """Đổi detector của FaceProcessor; khung hình kế tiếp dùng detector mới."""
+        try:
+            self.face_processor.set_detector(name)
+        except BackendUnavailable as e:
+            QMessageBox.warning(self, "Lỗi", f"Không thể dùng detector {name}: {e}")
+            self._revert_combo(self.detect_algo_combo, self.face_processor.detector_name)
+            return
+        self.status_bar.showMessage(f"Detector: {name}", 3000)
+
+    def _refresh_scope_combo(self):
+        """Nạp lại các phạm vi có học sinh (toàn trường, từng năm học, từng lớp), giữ phạm vi đang chọn."""
+        current = self.face_processor.scope
+        scopes = faiss_manager.available_scopes(self.known_students)
+        if current is not None and current not in scopes:
+            scopes.append(current)
+        self.scope_combo.blockSignals(True)
+        self.scope_combo.clear()
+        self.scope_combo.addItem("Toàn trường", "")
+        for scope in scopes:
+            self.scope_combo.addItem(faiss_manager.format_scope(scope), faiss_manager.format_scope(scope))
+        self.scope_combo.setCurrentIndex(max(self.scope_combo.findData(faiss_manager.format_scope(current)), 0))
+        self.scope_combo.blockSignals(False)
+
+    def change_scope(self, row):
+        """Chỉ so khớp với học sinh của phạm vi chọn; khung hình kế tiếp dùng chỉ mục con của phạm vi."""
+        self.face_processor.set_scope(self.scope_combo.itemData(row))
+        self.status_bar.showMessage(f"Phạm vi: {self.scope_combo.itemText(row)}", 3000)
+
+    def _apply_source_scope(self, source):
+        """Đặt phạm vi cấu hình cho nguồn (config.SOURCE_SCOPES) khi mở camera/video."""
+        self.face_processor.set_scope(faiss_manager.scope_for_source(source))
+        self._refresh_scope_combo()
+
+    def change_recognizer(self, name):
+        """Đổi recognizer; mỗi mô hình dùng chỉ mục riêng vì embedding của các mô hình không so sánh được."""
+        if self.known_students and not self.face_processor.has_index_for(name):
+            self._offer_migration(name)
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)  # Lần đầu chọn có thể phải nạp (hoặc tải) model
+        try:
+            has_index = self.face_processor.set_recognizer(name)
+        except BackendUnavailable as e:
+            QApplication.restoreOverrideCursor()
+            QMessageBox.warning(self, "Lỗi", f"Không thể dùng recognizer {name}: {e}")
+            self._revert_combo(self.recognize_algo_combo, self.face_processor.recognizer_name)
+            return
+        QApplication.restoreOverrideCursor()
+        if not has_index:
+            QMessageBox.information(self, "Thông báo",
+                                    f"Chưa có chỉ mục khuôn mặt cho {name}. Học sinh sẽ hiển thị là người lạ "
+                                    f"cho tới khi dữ liệu được mã hóa lại bằng mô hình này.")
+        self.status_bar.showMessage(f"Recognizer: {name}", 3000)
+
+    def _offer_migration(self, name):
+        """Mô hình chưa có chỉ mục: giữ recognizer hiện tại và đề nghị mã hóa lại toàn bộ học sinh ở nền."""
+        self._revert_combo(self.recognize_algo_combo, self.face_processor.recognizer_name)
+        if self.migration_thread is not None and self.migration_thread.isRunning():
+            QMessageBox.information(self, "Thông báo", "Đang mã hóa lại dữ liệu khuôn mặt, vui lòng chờ.")
+            return
+        answer = QMessageBox.question(
+            self, "Mã hóa lại",
+            f"Chưa có chỉ mục khuôn mặt cho {name}. Mã hóa lại {len(self.known_students)} học sinh bằng mô hình này?\n"
+            f"Trong lúc chạy, nhận diện vẫn dùng {self.face_processor.recognizer_name}.",
+            QMessageBox.Yes | QMessageBox.No)
+        if answer != QMessageBox.Yes:
+            return
+        migration = EmbeddingMigration(self.face_processor, name, store=self.crop_store)
+        self.migration_thread = EmbeddingMigrationThread(migration, parent=self)
+        self.migration_thread.progress_signal.connect(
+            lambda done, total: self.status_bar.showMessage(f"Mã hóa lại bằng {name}: {done}/{total}", 3000))
+        self.migration_thread.ready_signal.connect(self.on_migration_ready)
+        self.migration_thread.error_signal.connect(
+            lambda message: QMessageBox.warning(self, "Lỗi", f"Không thể mã hóa lại bằng {name}: {message}"))
+        self.migration_thread.start()
+
+    def on_migration_ready(self, migration):
+        """Embedding mới đã tính xong: chuyển CSDL, chỉ mục và recognizer sang mô hình mới (trên luồng GUI)."""
+        accepted = ()
+        while True:
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                result = migration.commit(accept_excluded=accepted)
+                break
+            except MigrationIncomplete as e:
+                QApplication.restoreOverrideCursor()
+                # Chỉ chuyển khi người dùng chấp nhận đúng danh sách học sinh bị loại; ngược lại giữ mô hình cũ
+                if not self._confirm_migration_exclusions(migration.recognizer_name, e.excluded):
+                    QMessageBox.information(self, "Thông báo",
+                                            f"Chưa chuyển sang {migration.recognizer_name}; vẫn dùng mô hình cũ.")
+                    return
+                accepted = e.excluded
+            except MigrationError as e:
+                QApplication.restoreOverrideCursor()
+                QMessageBox.warning(self, "Lỗi", f"Không thể chuyển sang {migration.recognizer_name}: {e}")
+                return
+        QApplication.restoreOverrideCursor()
+        self.faiss_index, self.id_mapping = result.faiss_index, result.id_mapping
+        self._set_known_students(result.students)
+        self.face_processor.set_recognizer(migration.recognizer_name)
+        self._revert_combo(self.recognize_algo_combo, migration.recognizer_name)
+        message = f"Đã mã hóa lại {result.migrated} học sinh bằng {migration.recognizer_name}."
+        if result.skipped:
+            message += f" {result.skipped} học sinh không có ảnh để mã hóa lại, cần đăng ký lại ảnh."
+        QMessageBox.information(self, "Thành công", message)
+
+    def _confirm_migration_exclusions(self, recognizer_name, excluded):
+        """Hỏi người dùng có chấp nhận loại các học sinh không mã hóa lại được khỏi chỉ mục của mô hình mới."""
+        names = [f"{sid} - {self.known_students_dict[sid]['name']}" if sid in self.known_students_dict else sid
+                 for sid in excluded]
+        box = QMessageBox(QMessageBox.Warning, "Mã hóa lại chưa đầy đủ",
+                          f"{len(excluded)} học sinh không có ảnh để mã hóa lại bằng {recognizer_name}. "
+                          "Nếu chuyển, các học sinh này sẽ hiển thị là người lạ cho tới khi đăng ký lại ảnh.\n\n"
+                          "Vẫn chuyển sang mô hình mới?",
+                          QMessageBox.Yes | QMessageBox.No, self)
+        box.setDetailedText("\n".join(names))
+        box.setDefaultButton(QMessageBox.No)
+        return box.exec() == QMessageBox.Yes
+
+    def _create_student_view(self, model):
+        """QListView dùng chung style cho danh sách nhận diện và danh sách toàn bộ học sinh."""
+        view = QListView()
+        view.setModel(model)
+        view.setCursor(Qt.PointingHandCursor)
+        view.setStyleSheet("""
+            QListView::item:selected, QListView::item:selected:!active {
                 background-color: #3399ff;
                 color: white;
                 font-weight: bold;
             }
-            QListWidget::item:hover {
+            QListView::item:hover {
                 background-color: #e0e0e0;
             }
         """)
-        # -----------------------------------------------------------
-        layout.addWidget(self.student_list_widget)
+        view.setSelectionMode(QListView.SingleSelection)
+        view.setFocusPolicy(Qt.StrongFocus)
+        view.setUniformItemSizes(True)  # Mọi hàng cao bằng nhau: chỉ đo một hàng, chỉ vẽ các hàng đang hiện
+        return view
+
+    def create_list_group(self):
+        """Tạo group box cho danh sách học sinh nhận diện và danh sách toàn bộ học sinh (tìm kiếm được)."""
+        group = QGroupBox("Danh sách nhận diện")
+        layout = QVBoxLayout()
+        tabs = QTabWidget()
+
+        # Tab 1: các khuôn mặt trong khung hình hiện tại
+        self.faces_model = RecognizedFacesModel(self.known_students_dict, parent=self)
+        self.student_list_view = self._create_student_view(self.faces_model)
+        tabs.addTab(self.student_list_view, "Trong khung hình")
+
+        # Tab 2: toàn bộ học sinh, lọc theo tên/mã/lớp
+        self.roster_model = RosterModel(self.known_students, parent=self, image_store=self.image_store)
+        self.roster_filter = RosterFilterModel(parent=self)
+        self.roster_filter.setSourceModel(self.roster_model)
+        roster_tab = QWidget()
+        roster_layout = QVBoxLayout(roster_tab)
+        roster_layout.setContentsMargins(0, 0, 0, 0)
+        search_box = QLineEdit()
+        search_box.setPlaceholderText("Tìm theo tên, mã hoặc lớp...")
+        search_box.setClearButtonEnabled(True)
+        search_box.textChanged.connect(self.roster_filter.set_search_text)
+        self.roster_view = self._create_student_view(self.roster_filter)
+        self.roster_view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        roster_layout.addWidget(search_box)
+        roster_layout.addWidget(self.roster_view)
+        tabs.addTab(roster_tab, "Tất cả học sinh")
+
+        layout.addWidget(tabs)
         group.setLayout(layout)
-        self.student_list_widget.setSelectionMode(QListWidget.SingleSelection)  # hoặc ExtendedSelection nếu cần chọn nhiều
-        self.student_list_widget.setFocusPolicy(Qt.StrongFocus)
         return group
 
+    def _set_known_students(self, students):
+        """Cập nhật danh sách học sinh, dict tra cứu và các model hiển thị."""
+        self.known_students = students
+        self.known_students_dict = {s['id']: s for s in students}
+        self.faces_model.set_students(self.known_students_dict)
+        self.roster_model.set_students(students)
+        self._refresh_scope_combo()
+
+    def _select_recognized_student(self, student_id):
+        """Chọn hàng của student_id trong danh sách nhận diện (tra O(1) theo id)."""
+        return self._select_face_row(self.faces_model.row_of(student_id))
+
+    def _select_face_row(self, row):
+        if row is None:
+            return False
+        index = self.faces_model.index(row)
+        self.student_list_view.setCurrentIndex(index)
+        self.display_student_info(index)
+        return True
+
     def create_info_group(self):
         """Tạo group box cho thông tin chi tiết học sinh."""
         group = QGroupBox("Thao tác")
@@ -331,9 +561,17 @@ class MainWindow(QMainWindow):
         self.time_label.setFixedWidth(120)  # Đặt chiều rộng cố định để giao diện gọn gàng
         self.time_label.setAlignment(Qt.AlignCenter)  # Căn giữa để đẹp hơn
 
+        # Nhảy tới lần xuất hiện tiếp theo của học sinh đang chọn (cần dòng thời gian nhận diện)
+        self.next_appearance_button = QPushButton()
+        self.next_appearance_button.setIcon(self.style().standardIcon(QStyle.SP_MediaSeekForward))
+        self.next_appearance_button.setToolTip("Lần xuất hiện tiếp theo của học sinh đang chọn")
+        self.next_appearance_button.setEnabled(False)
+        self.next_appearance_button.clicked.connect(self.jump_to_next_appearance)
+
         layout.addWidget(self.play_pause_button)
         layout.addWidget(self.video_slider)
         layout.addWidget(self.time_label)
+        layout.addWidget(self.next_appearance_button)
 
         self.video_controls_widget = widget
         return widget
@@ -405,7 +643,9 @@ class MainWindow(QMainWindow):
             self.video_slider.setMaximum(total_frames)
             self.video_slider.setValue(0)
 
-            self.thread = VideoThread(
+            self.attendance.set_source(file_path)
+            self._apply_source_scope(file_path)
+            self.thread = create_video_thread(
                         input_source=file_path,
                         known_students=self.known_students,
                         face_processor=self.face_processor, 
@@ -413,6 +653,7 @@ class MainWindow(QMainWindow):
                     )
             self.connect_thread_signals()
             self.thread.start()
+            self.start_timeline(file_path)
 
         except Exception as e:
             logging.error(f"Lỗi khi mở video: {str(e)}")
@@ -421,6 +662,46 @@ class MainWindow(QMainWindow):
             self.video_slider.setValue(0)
 
 
+    def start_timeline(self, file_path):
+        """Dùng dòng thời gian nhận diện đã có của video, hoặc bắt đầu tính ở nền."""
+        if self.timeline_video == file_path and self.timeline is not None:
+            self.thread.set_timeline(self.timeline)
+            return
+        self.timeline = None
+        self.timeline_video = None
+        self.next_appearance_button.setEnabled(False)
+        if self.timeline_thread is not None:
+            if self.timeline_thread.video_path == file_path and self.timeline_thread.isRunning():
+                return
+            self.timeline_thread.stop()
+        self.timeline_thread = TimelineThread(file_path, self.face_processor, parent=self)
+        self.timeline_thread.ready_signal.connect(self.on_timeline_ready)
+        self.timeline_thread.start()
+
+    def on_timeline_ready(self, video_path, timeline):
+        if video_path != getattr(self, 'last_video_file', None):
+            return
+        self.timeline = timeline
+        self.timeline_video = video_path
+        self.next_appearance_button.setEnabled(True)
+        if self.thread and self.thread.input_source == video_path:
+            self.thread.set_timeline(timeline)
+        logging.info("Đã có dòng thời gian nhận diện, phát lại và tua không cần nhận diện lại.")
+
+    def jump_to_next_appearance(self):
+        """Tua tới khung hình kế tiếp có học sinh đang chọn, tra trên dòng thời gian."""
+        if not self.thread or self.timeline is None or self.thread.input_source != self.timeline_video:
+            return
+        if not self.selected_student_id:
+            self.statusBar().showMessage("Hãy chọn một học sinh trước.", 3000)
+            return
+        frame = self.timeline.next_appearance(self.selected_student_id, self.thread.frame_count)
+        if frame is None:
+            self.statusBar().showMessage("Không còn lần xuất hiện nào của học sinh này.", 3000)
+            return
+        self.video_slider.setValue(frame)
+        self.thread.seek_to_frame(frame)
+
     def pause_for_seek(self):
         if self.thread:
             self.thread._is_paused = True
@@ -441,6 +722,10 @@ class MainWindow(QMainWindow):
     def display_student_info(self, current, previous=None):
         student_id = current.data(Qt.UserRole)
         self.selected_student_id = student_id
+        # Khuôn mặt chọn trong danh sách nhận diện: lấy ngay mẫu đăng ký đã tính sẵn (cache chỉ giữ vài giây)
+        self.selected_sample = None
+        if current.model() is self.faces_model:
+            self.selected_sample = self.face_processor.sample_for_result(self.faces_model.result_at(current.row()))
         # Nếu không có ID (ví dụ: click vào "Người lạ"), thì xóa thông tin và ẩn nút Sửa
         if student_id is None:
             self.add_student_button.setVisible(True)
@@ -462,28 +747,36 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Lỗi", "Chưa có hình ảnh. Vui lòng mở camera hoặc chọn ảnh trước.")
             return
 
+        # Khuôn mặt đang chọn đã có embedding từ luồng nhận diện: dùng lại, ảnh đăng ký là ảnh chân dung của nó
+        selected = self.selected_sample
+
         # Bước 1: Lấy thông tin từ dialog
-        student_data = self._get_data_from_dialog()
+        student_data = self._get_data_from_dialog(self.current_frame if selected is None else selected[1])
         if not student_data:
             return
 
-        # Bước 2: Lấy mã hóa khuôn mặt, Hàm get_single_face_encoding trả về (results, encoding)
-        _, face_encoding = self.face_processor.get_single_face_encoding(student_data["image"], self.known_students)
-        if face_encoding is None:
+        # Bước 2: Lấy mã hóa khuôn mặt (kèm ảnh crop đã căn chỉnh); chỉ chạy model khi không có mẫu sẵn
+        if selected is not None and selected[0] is not None and student_data.get("new_image") is None:
+            sample = selected[0]
+        else:
+            sample = self.face_processor.get_single_face_sample(student_data["image"], self.known_students)
+        if sample is None:
             QMessageBox.warning(self, "Lỗi", "Không thể lấy mã khuôn mặt. Vui lòng kiểm tra ảnh đầu vào và đảm bảo chỉ có một khuôn mặt.")
             return
+        face_encoding = sample.encoding
 
         # Bước 3: Lưu vào CSDL và lấy ID của học sinh mới
         new_student_id = self._save_student_to_db(student_data, face_encoding)
         if not new_student_id:
             return # Thông báo lỗi đã được hiển thị trong hàm con
 
-        # Bước 4: Thêm vào Faiss
+        # Bước 4: Đồng bộ Faiss với CSDL và thêm vào kho ảnh crop
         import faiss_manager
-        faiss_manager.add_to_index(new_student_id, face_encoding)
+        faiss_manager.sync_index()
+        self.crop_store.put(student_data["code"], sample.crop, sample.landmarks)
 
         # Bước 5: Cập nhật giao diện
-        self._update_ui_after_add(new_student_id)
+        self._update_ui_after_add(new_student_id, sample)
         QMessageBox.information(self, "Thành công", f"Đã thêm học sinh {student_data['name']}.")
 
     # === SỬA HỌC SINH ===
@@ -497,18 +790,20 @@ class MainWindow(QMainWindow):
             if not student:
                 return
 
-            dialog = AddStudentDialog(existing_data=student, parent=self)
+            dialog = AddStudentDialog(existing_data=student, parent=self, image_store=self.image_store)
             result = dialog.exec()
             new_image = None
             if result == QDialog.Accepted:
                 updated_data = dialog.get_data()
                 new_image = updated_data.pop("new_image", None)
                 new_encoding = None
+                sample = None
                 if new_image is not None:
-                    _, new_encoding = self.face_processor.get_single_face_encoding(new_image, [])
-                    if new_encoding is None:
+                    sample = self.face_processor.get_single_face_sample(new_image, [])
+                    if sample is None:
                         QMessageBox.warning(self, "Lỗi ảnh", "Không tìm thấy khuôn mặt trong ảnh mới hoặc có quá nhiều khuôn mặt.")
                         return
+                    new_encoding = sample.encoding
                     self.current_frame = new_image
 
                 success = db.update_student(
@@ -520,35 +815,37 @@ class MainWindow(QMainWindow):
                     updated_data['school_year'],
                     updated_data['stt'],
                     updated_data['image_path'],
-                    face_encoding= new_encoding if new_encoding is not None else student['face_encoding']
+                    face_encoding= new_encoding if new_encoding is not None else student['face_encoding'],
+                    embedding_model=(self.face_processor.enrollment_model_id if new_encoding is not None
+                                     else student['embedding_model'])
                 )
 
                 if success:
                     QMessageBox.information(self, "Thành công", "Cập nhật thông tin thành công.")
                     # Lấy lại danh sách mới từ DB
-                    list_of_students = db.get_all_students()
-                    self.known_students = list_of_students
-                    # ✅ Cập nhật lại dictionary để tra cứu nhanh
-                    self.known_students_dict = {s['id']: s for s in list_of_students}
+                    self._set_known_students(db.get_all_students())
                     self.update_results(self.recognition_results)
 
                     if new_encoding is not None:
-                        faiss_manager.remove_from_index(self.selected_student_id)
-                        faiss_manager.add_to_index(self.selected_student_id, new_encoding)
+                        faiss_manager.sync_index()
+                        self.crop_store.put(self.selected_student_id, sample.crop, sample.landmarks)
+                        self._reload_faiss_to_faceprocessor()
                         print(f"✅ Đã cập nhật Faiss cho học sinh ID {self.selected_student_id} (đổi ảnh).")
                     else:
+                        # Chỉ đổi thông tin: cập nhật danh sách học sinh trong ảnh chụp, giữ chỉ mục
+                        self.face_processor.update_roster(self.known_students)
                         print(f"✅ Không đổi ảnh, không cập nhật Faiss.")
 
-                    current_item = self.student_list_widget.currentItem()
-                    if current_item:
-                        self.display_student_info(current_item)
+                    current_index = self.student_list_view.currentIndex()
+                    if current_index.isValid():
+                        self.display_student_info(current_index)
                 else:
                     QMessageBox.warning(self, "Lỗi", "Không thể cập nhật thông tin.")
         
     # --- CÁC HÀM CON TRỢ GIÚP ---
-    def _get_data_from_dialog(self):
-        """Mở dialog, lấy và xác thực dữ liệu người dùng nhập."""
-        dialog = AddStudentDialog(self.current_frame, parent=self)
+    def _get_data_from_dialog(self, frame):
+        """Mở dialog với ảnh đăng ký frame, lấy và xác thực dữ liệu người dùng nhập."""
+        dialog = AddStudentDialog(frame, parent=self, image_store=self.image_store)
         if dialog.exec() != QDialog.Accepted:
             return None # Người dùng nhấn Cancel
 
@@ -575,37 +872,35 @@ class MainWindow(QMainWindow):
             gender=student_data["gender"],
             school_year=student_data["school_year"],
             stt=student_data["stt"],
-            image_path=student_data["image_path"]
+            image_path=student_data["image_path"],
+            embedding_model=self.face_processor.enrollment_model_id
         )
         if not new_id:
             QMessageBox.critical(self, "Lỗi", "Không thể thêm học sinh. Mã khuôn mặt có thể đã tồn tại trong CSDL.")
             return None
-        return new_id
+        # add_student trả về rowid; chỉ mục và danh sách dùng mã học sinh
+        return student_data["code"]
 
-    def _update_ui_after_add(self, new_student_id):
+    def _update_ui_after_add(self, new_student_id, sample):
         """Tải lại dữ liệu và làm mới giao diện sau khi thêm thành công."""
         # 1. Tải lại danh sách học sinh từ CSDL
-        self.known_students = db.get_all_students()
-        self.known_students_dict = {s['id']: s for s in self.known_students}
-
-        # 2. Chạy lại nhận diện trên frame hiện tại để cập nhật tên
+        self._set_known_students(db.get_all_students())
+
+        # 2. Gắn tên cho khuôn mặt vừa đăng ký trong kết quả hiện tại (không chạy lại nhận diện)
+        location = sample.results[0]["location"]
+        name = self.known_students_dict[new_student_id]["name"] if new_student_id in self.known_students_dict else ""
+        results = [dict(r, id=new_student_id, name=name) if r.get("location") == location else r
+                   for r in self.recognition_results]
+        if not any(r.get("id") == new_student_id for r in results):
+            results = [dict(sample.results[0], id=new_student_id, name=name)]
+        self.update_results(results)
         if self.current_frame is not None:
-            # Sử dụng hàm get_single_face_encoding đã tạo ở gợi ý trước
-            results, _  = self.face_processor.get_single_face_encoding(self.current_frame, self.known_students)
-            self.update_results(results)
             self.update_image(self.current_frame)
 
         # 3. Tự động chọn học sinh vừa thêm trong danh sách
-        for i in range(self.student_list_widget.count()):
-            item = self.student_list_widget.item(i)
-            if item.data(Qt.UserRole) == new_student_id:
-                self.student_list_widget.setCurrentItem(item)
-                self.display_student_info(item)
-                break
+        self._select_recognized_student(new_student_id)
 
-        # (3) Chỉ build lại Faiss nếu thêm học sinh thành công
-        print("Cập nhật chỉ mục Faiss sau khi thêm thành công...")
-        faiss_manager.build_and_save_index()
+        # 4. sync_index đã ghi thế hệ chỉ mục mới: chỉ cần nạp lại vào FaceProcessor
         self._reload_faiss_to_faceprocessor()
         print("Đã cập nhật chỉ mục Faiss.")
 
@@ -625,79 +920,43 @@ class MainWindow(QMainWindow):
             success = db.delete_student(self.selected_student_id)
             if success:
                 QMessageBox.information(self, "Thành công", "Đã xóa học sinh.")
-                faiss_manager.remove_from_index(self.selected_student_id)
+                self.crop_store.remove(self.selected_student_id)
                 self.clear_student_info()
                 # Lấy lại danh sách mới từ DB
-                list_of_students = db.get_all_students()
-                self.known_students = list_of_students
-                # ✅ Cập nhật lại dictionary để tra cứu nhanh
-                self.known_students_dict = {s['id']: s for s in list_of_students}
+                self._set_known_students(db.get_all_students())
                 self.update_results([])  # Ẩn khuôn mặt cũ
                 print("Cập nhật chỉ mục Faiss sau khi xóa thành công...")
-                faiss_manager.build_and_save_index()
+                faiss_manager.sync_index()
                 self._reload_faiss_to_faceprocessor()
                 print("Đã cập nhật chỉ mục Faiss.")
             else:
                 QMessageBox.critical(self, "Lỗi", "Không thể xóa học sinh.")
     def _reload_faiss_to_faceprocessor(self):
         self.faiss_index, self.id_mapping = faiss_manager.load_index()
-        self.face_processor.faiss_index = self.faiss_index
-        self.face_processor.id_mapping = self.id_mapping
+        # Thay cả chỉ mục, ánh xạ và danh sách học sinh bằng một ảnh chụp duy nhất
+        self.face_processor.swap_snapshot(self.faiss_index, self.id_mapping, self.known_students)
 
     def on_image_click(self, event):
         """
         Xử lý sự kiện click chuột lên ảnh, tìm và chọn học sinh tương ứng.
-        Sửa lỗi: Thêm bước map tọa độ từ QLabel sang QPixmap để hoạt động đúng với ảnh tĩnh.
+        Dùng đúng mảng hộp (không gian hiển thị, đã lật) mà OverlayRenderer vừa vẽ.
         """
         start_time = time()
         # --- Các bước kiểm tra điều kiện ---
         pixmap = self.image_label.pixmap()
-        if not pixmap or pixmap.isNull() or not self.recognition_results or not hasattr(self, 'scaler'):
-            return
-        if not self.scaler.scale_ratio > 0:
+        layout = self.overlay_thread.renderer.layout
+        if not pixmap or pixmap.isNull() or layout is None or not layout.results:
             return
 
         # --- Bước 1: Ánh xạ tọa độ click từ QLabel sang QPixmap ---
-        label_w = self.image_label.width()
-        label_h = self.image_label.height()
-        pixmap_w = pixmap.width()
-        pixmap_h = pixmap.height()
-
-        # Tọa độ click thực sự trên ảnh (đã tính đến việc ảnh bị co giãn)
-        click_x = int(event.x() * pixmap_w / label_w)
-        click_y = int(event.y() * pixmap_h / label_h)
-
-        # --- Bước 2: Tính toán scale và lật (giữ nguyên như cũ) ---
-        final_scale_factor = self.scaler.scale_ratio / RESIZE_FACTOR
-        display_w = pixmap_w
-
-        # --- Bước 3: Duyệt và so sánh ---
-        for result in self.recognition_results:
-            loc = result.get("location")
-            if not loc:
-                continue
-
-            # Scale tọa độ box về không gian hiển thị (pixmap)
-            top, right, bottom, left = loc
-            scaled_top = int(top * final_scale_factor)
-            scaled_bottom = int(bottom * final_scale_factor)
-            scaled_left = int(left * final_scale_factor)
-            scaled_right = int(right * final_scale_factor)
-
-            # Lật tọa độ box để so sánh vì ảnh hiển thị đã bị lật
-            flipped_box_left = display_w - scaled_right
-            flipped_box_right = display_w - scaled_left
-
-            # So sánh tọa độ click ĐÃ ÁNH XẠ với tọa độ box ĐÃ LẬT
-            if flipped_box_left < click_x < flipped_box_right and scaled_top < click_y < scaled_bottom:
-                # Tìm item trong danh sách và chọn nó
-                for i in range(self.student_list_widget.count()):
-                    item = self.student_list_widget.item(i)
-                    if item.data(Qt.UserRole) == result["id"]:
-                        self.student_list_widget.setCurrentItem(item)
-                        self.display_student_info(item)
-                        break
-                break
+        click_x = event.x() * pixmap.width() / self.image_label.width()
+        click_y = event.y() * pixmap.height() / self.image_label.height()
+
+        # --- Bước 2: So sánh với mọi hộp cùng lúc ---
+        result = layout.hit_test(click_x, click_y)
+        if result is not None:
+            # Tra theo vị trí nên chọn được cả người lạ (để đăng ký từ khung hình nhiều người)
+            self._select_face_row(self.faces_model.row_of_result(result))
         end_time = time()
         response_time = (end_time - start_time) * 1000  # Chuyển sang ms
         logging.info(f"Thời gian phản hồi khi click vào ảnh: {response_time:.2f} ms")
@@ -706,7 +965,9 @@ class MainWindow(QMainWindow):
         self.stop_thread()
         self.clear_student_info()
         self.video_controls_widget.setVisible(False) 
-        self.thread = VideoThread(
+        self.attendance.set_source("camera:0")
+        self._apply_source_scope("camera:0")
+        self.thread = create_video_thread(
                         input_source=0,
                         known_students=self.known_students,
                         face_processor=self.face_processor, 
@@ -790,152 +1051,46 @@ class MainWindow(QMainWindow):
 
     def update_image(self, img):
         """
-        Cập nhật và hiển thị ảnh, sử dụng QPainter cho TOÀN BỘ thao tác vẽ (hộp và chữ).
-        Tối ưu hơn bằng cách loại bỏ cv2.rectangle và chỉ lặp qua các kết quả một lần.
+        Nhận khung hình mới và chuyển cho OverlayRenderThread dựng (thu nhỏ, lật, vẽ hộp và tên).
+        Ảnh đã dựng được hiển thị trong on_overlay_rendered.
         """
         if not isinstance(img, np.ndarray):
             return
-
-        # --- Bước 1: Chuẩn bị ảnh nền ---
         self.current_frame = img  # Lưu ảnh gốc
-        display_img = self.scaler.resize_image(img) # Resize ảnh về kích thước hiển thị
-        
-        # Lật ảnh ngay từ đầu để mọi tọa độ vẽ sau này đều nằm trong không gian đã lật
-        flipped_img = cv2.flip(display_img, 1)
-        
-        # Chuyển ảnh numpy (BGR) sang QImage để QPainter có thể vẽ lên
-        h, w, ch = flipped_img.shape
-        qt_image = QImage(flipped_img.data, w, h, ch * w, QImage.Format_BGR888)
-
-        # --- Bước 2: Chuẩn bị và thực hiện vẽ ---
-        painter = QPainter(qt_image)
-        font = painter.font()
-        font.setPointSize(12)
-        painter.setFont(font)
-
-        # Tính toán các giá trị cần thiết chỉ một lần
-        final_scale_factor = self.scaler.scale_ratio / RESIZE_FACTOR
-        display_w = qt_image.width()
         results_to_draw = self.recognition_results if self.recognition_results else self.last_results
-
-        # --- Bước 3: Vòng lặp vẽ duy nhất ---
-        for result in results_to_draw:
-            loc = result.get("location")
-            if not loc:
-                continue
-
-            # Scale tọa độ gốc từ không gian nhận diện sang không gian hiển thị
-            top, right, bottom, left = loc
-            scaled_top = int(top * final_scale_factor)
-            scaled_bottom = int(bottom * final_scale_factor)
-            scaled_left = int(left * final_scale_factor)
-            scaled_right = int(right * final_scale_factor)
-
-            # Xác định màu sắc
-            is_stranger = result.get("id") is None
-            color = QColor(255, 0, 0) if is_stranger else QColor(0, 255, 0)
-            
-            pen = QPen(color, 2) # Tạo bút vẽ với màu và độ dày
-            painter.setPen(pen)
-
-            # Tính toán tọa độ và kích thước của hộp trong không gian ĐÃ LẬT
-            # Tọa độ y không đổi, tọa độ x được lật qua trục giữa của ảnh
-            flipped_left = display_w - scaled_right
-            rect_w = scaled_right - scaled_left
-            rect_h = scaled_bottom - scaled_top
-            
-            # 1. Vẽ hộp chữ nhật
-            painter.drawRect(flipped_left, scaled_top, rect_w, rect_h)
-
-            # 2. Vẽ tên
-            # Đo kích thước chữ để căn giữa phía trên hộp
-            metrics = painter.fontMetrics()
-            text_width = metrics.horizontalAdvance(result["name"])
-            text_x = flipped_left + (rect_w - text_width) // 2
-            text_y = scaled_top - 5 # Dịch lên 5 pixel so với cạnh trên của hộp
-            
-            # Vẽ nền cho chữ để dễ đọc hơn
-            painter.fillRect(QRect(text_x - 2, text_y - metrics.ascent(), text_width + 4, metrics.height()), color)
-            
-            # Đặt lại bút vẽ cho màu chữ (ví dụ: màu trắng)
-            painter.setPen(QColor(255, 255, 255))
-            painter.drawText(text_x, text_y, result["name"])
-            
-        painter.end() # Kết thúc việc vẽ
-
-        # --- Bước 4: Hiển thị ảnh đã vẽ lên QLabel ---
-        new_pixmap = QPixmap.fromImage(qt_image)
-        self.image_label.setPixmap(new_pixmap)
-        self.current_pixmap = new_pixmap
+        self.overlay_thread.submit_results(results_to_draw)
+        self.overlay_thread.submit_frame(img)
+
+    def on_overlay_rendered(self, qt_image):
+        """Phần việc duy nhất còn lại trên luồng GUI cho mỗi khung hình: tạo QPixmap và hiển thị."""
+        with metrics.timer("gui_update"):
+            new_pixmap = QPixmap.fromImage(qt_image)
+            self.image_label.setPixmap(new_pixmap)
+            self.current_pixmap = new_pixmap
+        # Sau khi QPixmap đã sao chép dữ liệu, bộ đệm của qt_image có thể được dùng lại
+        self.overlay_thread.frame_consumed()
 
     def update_results(self, results):
         """
-        Cập nhật danh sách nhận diện. Chỉ vẽ lại widget nếu danh sách ID thay đổi.
+        Cập nhật danh sách nhận diện. Chỉ các hàng có học sinh vào/ra khung hình được thêm/bớt.
         """
-        # 1. Trích xuất danh sách ID từ kết quả mới và cũ để so sánh
-        # Dùng tuple đã sắp xếp để việc so sánh đáng tin cậy
-        new_ids = tuple(sorted(r.get("id") for r in results if r.get("id") is not None))
-        old_ids = tuple(sorted(r.get("id") for r in self.recognition_results if r.get("id") is not None))
-
-        # Đếm số người lạ ở mỗi kết quả
-        new_strangers = sum(1 for r in results if r.get("id") is None)
-        old_strangers = sum(1 for r in self.recognition_results if r.get("id") is None)
-
-        # 2. Nếu danh sách ID và số người lạ không có gì thay đổi, thoát sớm
-        if new_ids == old_ids and new_strangers == old_strangers:
-            # Cập nhật lại recognition_results để chứa tọa độ mới nhất, nhưng không vẽ lại widget
-            self.recognition_results = results
-            return
-
-        # --- Chỉ thực hiện các bước dưới đây nếu có sự thay đổi về người trong khung hình ---
+        # Ghi nhận điểm danh cho mọi kết quả (chỉ cập nhật bộ nhớ, việc ghi CSDL chạy nền)
+        self.attendance.observe(results)
+        # Vẽ lại khung hiện tại nếu kết quả thay đổi (kể cả khi video đang tạm dừng)
+        self.overlay_thread.submit_results(results if results else self.last_results)
 
-        # 3. Cập nhật kết quả và lấy item đang được chọn (nếu có)
+        # Model chỉ chèn/xóa các hàng thay đổi; hàng đang chọn giữ nguyên vị trí
         self.recognition_results = results
-        current_selected_id = None
-        if self.student_list_widget.currentItem():
-            current_selected_id = self.student_list_widget.currentItem().data(Qt.UserRole)
-
-        self.student_list_widget.clear()
-
-        for result in results:
-            # Phần code còn lại của bạn để tạo và thêm item giữ nguyên
-            student_id = result.get("id")
-            student_class = ""
-            student_name = "Người lạ"
-            
-            # Lấy thông tin chi tiết nếu là học sinh đã biết
-            if student_id is not None and student_id in self.known_students_dict:
-                student_info = self.known_students_dict[student_id]
-                student_class = student_info.get("class", "")
-                student_name = student_info.get("name", "")
-
-            # Định dạng nội dung item
-            item_text = (
-                "--------------------\n"
-                f"ID: {'N/A' if student_id is None else student_id}\n"
-                f"Họ và tên: {student_name}\n"
-                f"Lớp: {student_class}\n"
-                "--------------------"
-            )
-            item = QListWidgetItem(item_text)
-            item.setData(Qt.UserRole, student_id)
-            item.setSizeHint(QSize(item.sizeHint().width(), 80)) # Điều chỉnh chiều cao
-
-            if student_id is None:
-                item.setForeground(Qt.red)
-
-            self.student_list_widget.addItem(item)
-            
-            # Chọn lại item nếu nó vẫn còn trong danh sách mới
-            if current_selected_id is not None and student_id == current_selected_id:
-                self.student_list_widget.setCurrentItem(item)
+        self.faces_model.set_results(results)
 
     def clear_student_info(self):
         """Xóa thông tin và ẩn nút Sửa."""
         self.selected_student_id = None # Xóa ID đã lưu
+        self.selected_sample = None
         # ✅ THÊM DÒNG NÀY ĐỂ XÓA HIGHLIGHT
-        if self.student_list_widget:
-            self.student_list_widget.setCurrentItem(None)
+        if self.student_list_view:
+            self.student_list_view.clearSelection()
+            self.student_list_view.setCurrentIndex(QModelIndex())
 
         if self.edit_student_button:
             self.edit_student_button.setVisible(False) # ✅ ẨN NÚT SỬA
@@ -994,6 +1149,14 @@ class MainWindow(QMainWindow):
             f"RAM: {self.resource_info['ram_used']:.1f}/{self.resource_info['ram_total']:.1f} GB "
             f"({self.resource_info['ram_usage']:.1f}%)"
         )
+        if self.face_processor:
+            hits, misses, hit_rate = self.face_processor.recognition_cache.stats()
+            status_msg += f" | Cache: {hit_rate * 100:.0f}% ({hits}/{hits + misses})"
+        # Độ trễ p50/p95/p99 của nhận diện, của việc dựng khung (luồng vẽ) và thời gian luồng GUI mỗi khung
+        for label, name in (("Nhận diện", "recognize"), ("Vẽ", "overlay_render"), ("GUI", "gui_update")):
+            percentiles = metrics.format_percentiles(name)
+            if percentiles:
+                status_msg += f" | {label}: {percentiles}"
         if self.gpu_available:
             status_msg += (
                 f" | GPU: {self.resource_info['gpu_usage']}% | "
@@ -1005,6 +1168,17 @@ class MainWindow(QMainWindow):
         """Dọn dẹp tài nguyên trước khi đóng ứng dụng."""
         logging.info("Đang đóng ứng dụng, dọn dẹp tài nguyên...")
         self.stop_thread()
+        self.overlay_thread.stop()
+        self.overlay_thread.wait()
+        if self.timeline_thread is not None:
+            self.timeline_thread.stop()
+            self.timeline_thread.wait()
+        if self.migration_thread is not None:
+            self.migration_thread.stop()
+            self.migration_thread.wait()
+
+        # Ghi nốt dữ liệu điểm danh còn trong bộ nhớ
+        self.attendance.stop()
         
         # TẮT EXECUTOR CỦA FACE PROCESSOR
         if self.face_processor:
@@ -1015,6 +1189,8 @@ class MainWindow(QMainWindow):
         if self.gpu_available:
             pynvml.nvmlShutdown()  # Tắt pynvml
         self.resource_timer.stop()  # Dừng timer
+        self.metrics_log_timer.stop()
+        metrics.log_summary()
 
         gc.collect()
         logging.info("Đã dọn dẹp xong. Tạm biệt!")
@@ -1028,8 +1204,31 @@ if __name__ == "__main__":
             logging.StreamHandler()
         ]
     )
+    parser = argparse.ArgumentParser(description="Hệ thống Nhận diện Khuôn mặt")
+    profiling.add_profile_arguments(parser)
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Bật xuất số đo Prometheus tại http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--pipeline", choices=("qthread", "async"), default=None,
+                        help="Vòng lặp đọc video: qthread (mặc định) hoặc async (asyncio)")
+    args, qt_args = parser.parse_known_args()
+    if args.pipeline:
+        config.VIDEO_PIPELINE = args.pipeline
+
     db.create_table()
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
     main_window = MainWindow()
     main_window.show()
+
+    # Xuất số đo cho hệ thống giám sát (tùy chọn)
+    if args.metrics_port is not None or METRICS_EXPORTER_ENABLED:
+        exporter = MetricsExporter(port=args.metrics_port if args.metrics_port is not None else METRICS_PORT)
+        if exporter.start():
+            app.aboutToQuit.connect(exporter.stop)
+
+    # Chế độ profile: chạy trong một khoảng thời gian giới hạn rồi tự ghi kết quả
+    profile_session = profiling.session_from_args(args, "gui")
+    if profile_session:
+        profile_session.start()
+        QTimer.singleShot(int(profile_session.duration * 1000), profile_session.stop)
+        app.aboutToQuit.connect(profile_session.stop)
     sys.exit(app.exec_())
\ No newline at end of file
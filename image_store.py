@@ -0,0 +1,283 @@
+# image_store.py
+"""
+Kho ảnh đăng ký của học sinh: images/{mã}.jpg (ENROLL_IMAGE_SIZE) và ảnh thu nhỏ images/thumbs/{mã}.jpg
+(THUMBNAIL_SIZE) cho danh sách học sinh và khung xem trước.
+- Ghi nguyên tử: mã hóa JPEG trong bộ nhớ -> file tạm -> fsync -> os.replace; ảnh thu nhỏ ghi cùng lúc.
+- Đọc lười qua một LRU (khóa = đường dẫn + mtime) nên mở lại dialog hay cuộn danh sách không giải mã lại.
+- Xóa an toàn: file không còn tồn tại không phải lỗi.
+- Tùy chọn gói mọi ảnh vào một file zip (ZIP_STORED vì JPEG đã nén; zip có bảng mục lục ở cuối nên đọc
+  một ảnh không phải quét cả file) để sao lưu bằng một lần chép. Ảnh không có trên đĩa được đọc từ gói,
+  nên máy mới chỉ cần chép images.zip là khởi động được.
+
+Chạy `python -m image_store --pack` để tạo gói, `--restore` để giải nén gói ra images/.
+"""
+import argparse
+import logging
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from config import (IMAGE_DIR, ENROLL_IMAGE_SIZE, THUMBNAIL_SIZE, IMAGE_JPEG_QUALITY, IMAGE_CACHE_SIZE,
+                    IMAGE_ARCHIVE_FILE)
+
+THUMB_DIR = "thumbs"
+
+
+def default_root():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), IMAGE_DIR)
+
+
+def _atomic_write(path, data):
+    """Ghi toàn bộ data ra path qua file tạm + os.replace: người đọc chỉ thấy file cũ hoặc file mới hoàn chỉnh."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        print(f"[ImageStore Lỗi] Không thể xóa {path}: {e}")
+        return False
+
+
+def _encode_jpeg(image):
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, IMAGE_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Không thể mã hóa ảnh JPEG.")
+    return buffer.tobytes()
+
+
+def make_thumbnail(image, size=THUMBNAIL_SIZE):
+    """Thu nhỏ giữ tỉ lệ sao cho cạnh dài bằng size (INTER_AREA)."""
+    h, w = image.shape[:2]
+    scale = size / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+class ImageStore:
+    """Ảnh đăng ký + ảnh thu nhỏ, cache giải mã LRU. An toàn đa luồng trong một tiến trình."""
+    def __init__(self, root=None, archive_path=None, cache_size=IMAGE_CACHE_SIZE):
+        self.root = root or default_root()
+        self.archive_path = archive_path or os.path.join(os.path.dirname(self.root), IMAGE_ARCHIVE_FILE)
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # (đường dẫn, mtime_ns) -> ảnh BGR đã giải mã
+        self._archive = None
+        self._archive_mtime = None
+
+    def path_for(self, student_id):
+        return os.path.join(self.root, f"{student_id}.jpg")
+
+    @staticmethod
+    def thumbnail_path(path):
+        return os.path.join(os.path.dirname(path), THUMB_DIR, os.path.basename(path))
+
+    def save(self, student_id, image):
+        """Thu về ENROLL_IMAGE_SIZE, ghi ảnh và ảnh thu nhỏ của học sinh (nguyên tử). Trả về đường dẫn ảnh."""
+        path = self.path_for(student_id)
+        scaled = cv2.resize(image, ENROLL_IMAGE_SIZE)
+        _atomic_write(path, _encode_jpeg(scaled))
+        _atomic_write(self.thumbnail_path(path), _encode_jpeg(make_thumbnail(scaled)))
+        self._invalidate(path)
+        return path
+
+    def remove(self, path):
+        """Xóa ảnh và ảnh thu nhỏ; không lỗi nếu đã bị xóa. Trả về True nếu ảnh đã tồn tại."""
+        if not path:
+            return False
+        self._invalidate(path)
+        _remove(self.thumbnail_path(path))
+        return _remove(path)
+
+    def _invalidate(self, path):
+        thumb = self.thumbnail_path(path)
+        with self._lock:
+            for key in [key for key in self._cache if key[0] in (path, thumb)]:
+                del self._cache[key]
+
+    def exists(self, path):
+        return bool(path) and (os.path.exists(path) or self._archive_member(path) is not None)
+
+    def load(self, path):
+        """Ảnh BGR (từ file, hoặc từ gói nếu không có trên đĩa), hoặc None. Kết quả chỉ đọc, dùng chung."""
+        return self._decode(path)
+
+    def thumbnail(self, path):
+        """Ảnh thu nhỏ của ảnh đăng ký path; tạo và lưu lại nếu chưa có (ảnh đăng ký trước khi có kho này)."""
+        if not path:
+            return None
+        thumb_path = self.thumbnail_path(path)
+        thumb = self._decode(thumb_path)
+        if thumb is not None:
+            return thumb
+        image = self._decode(path)
+        if image is None:
+            return None
+        thumb = make_thumbnail(image)
+        try:
+            _atomic_write(thumb_path, _encode_jpeg(thumb))
+        except OSError as e:
+            logging.warning(f"Không thể lưu ảnh thu nhỏ {thumb_path}: {e}")
+        return thumb
+
+    def _decode(self, path):
+        if not path:
+            return None
+        try:
+            key = (path, os.stat(path).st_mtime_ns)
+        except OSError:
+            key = (path, None)  # Đọc từ gói
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                return image
+        data = self._read_bytes(path, key[1] is not None)
+        if data is None:
+            return None
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        image.setflags(write=False)
+        with self._lock:
+            self._cache[key] = image
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return image
+
+    def _read_bytes(self, path, on_disk):
+        if on_disk:
+            try:
+                with open(path, 'rb') as f:
+                    return f.read()
+            except OSError:
+                return None
+        member = self._archive_member(path)
+        if member is None:
+            return None
+        with self._lock:
+            return self._archive.read(member)
+
+    # ------------------------------------------------------------- gói zip
+
+    def _member_name(self, path):
+        """Tên trong gói: images/{mã}.jpg hoặc thumbs/{mã}.jpg."""
+        parent = os.path.basename(os.path.dirname(path))
+        return f"{THUMB_DIR if parent == THUMB_DIR else IMAGE_DIR}/{os.path.basename(path)}"
+
+    def _archive_member(self, path):
+        """Tên mục của path trong gói nếu có gói và mục đó, ngược lại None. Mở lại gói khi file gói đổi."""
+        try:
+            mtime = os.stat(self.archive_path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            if self._archive is None or mtime != self._archive_mtime:
+                if self._archive is not None:
+                    self._archive.close()
+                try:
+                    self._archive = zipfile.ZipFile(self.archive_path, 'r')
+                except (OSError, zipfile.BadZipFile) as e:
+                    logging.warning(f"Không thể mở gói ảnh '{self.archive_path}': {e}")
+                    self._archive = None
+                    return None
+                self._archive_mtime = mtime
+                self._cache.clear()
+            name = self._member_name(path)
+            try:
+                self._archive.getinfo(name)
+            except KeyError:
+                return None
+            return name
+
+    def pack(self):
+        """Gói mọi ảnh và ảnh thu nhỏ vào archive_path (ZIP_STORED, ghi file tạm rồi os.replace). Trả về số ảnh."""
+        tmp_path = self.archive_path + ".tmp"
+        count = 0
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for subdir, prefix in ((self.root, IMAGE_DIR), (os.path.join(self.root, THUMB_DIR), THUMB_DIR)):
+                if not os.path.isdir(subdir):
+                    continue
+                for name in sorted(os.listdir(subdir)):
+                    if not name.endswith(".jpg"):
+                        continue
+                    archive.write(os.path.join(subdir, name), f"{prefix}/{name}")
+                    if prefix == IMAGE_DIR:
+                        count += 1
+        with open(tmp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.archive_path)
+        print(f"[ImageStore] Đã gói {count} ảnh vào '{self.archive_path}'.")
+        return count
+
+    def _restore_path(self, name):
+        """
+        Đường dẫn ghi của một mục trong gói: chỉ nhận "images/{tên}.jpg" và "thumbs/{tên}.jpg" (tên phẳng),
+        và đường dẫn chuẩn hóa phải nằm trong root. Mục khác (thư mục con, "..", đường dẫn tuyệt đối) trả về None.
+        """
+        prefix, _, filename = name.replace("\\", "/").partition("/")
+        if prefix == IMAGE_DIR:
+            directory = self.root
+        elif prefix == THUMB_DIR:
+            directory = os.path.join(self.root, THUMB_DIR)
+        else:
+            return None
+        if (not filename or filename != os.path.basename(filename) or filename in (".", "..")
+                or not filename.endswith(".jpg")):
+            return None
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(directory, filename))
+        if os.path.commonpath([root, path]) != root:
+            return None
+        return path
+
+    def restore(self):
+        """Giải nén các ảnh trong gói còn thiếu trên đĩa. Trả về số ảnh đã ghi."""
+        if not os.path.exists(self.archive_path):
+            print(f"[ImageStore] Không có gói '{self.archive_path}'.")
+            return 0
+        count = 0
+        with zipfile.ZipFile(self.archive_path, 'r') as archive:
+            for name in archive.namelist():
+                path = self._restore_path(name)
+                if path is None:
+                    print(f"[ImageStore] Bỏ qua mục không hợp lệ trong gói: {name!r}")
+                    continue
+                if not os.path.exists(path):
+                    _atomic_write(path, archive.read(name))
+                    count += 1
+        print(f"[ImageStore] Đã giải nén {count} file từ '{self.archive_path}'.")
+        return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m image_store", description="Kho ảnh đăng ký của học sinh.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--pack", action="store_true", help=f"Gói images/ vào {IMAGE_ARCHIVE_FILE}.")
+    group.add_argument("--restore", action="store_true", help=f"Giải nén {IMAGE_ARCHIVE_FILE} ra images/.")
+    args = parser.parse_args(argv)
+    store = ImageStore()
+    if args.pack:
+        store.pack()
+    else:
+        store.restore()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
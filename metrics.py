@@ -0,0 +1,243 @@
+# metrics.py
+"""
+Đo đạc nhẹ cho đường xử lý nóng: bộ đếm, gauge và histogram kiểu HDR (bucket log-tuyến tính,
+sai số tương đối ~3%, ghi O(1), không cấp phát bộ nhớ khi ghi).
+Dùng:
+    with metrics.timer("detect"):
+        ...
+    metrics.inc("frames_dropped")
+    metrics.observe("faces_per_frame", len(faces))
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS   # 32 bucket con cho mỗi lũy thừa của 2
+MAX_SHIFT = 40                       # Đủ cho giá trị tới ~2^46 đơn vị ghi
+
+
+class Histogram:
+    """
+    Histogram log-tuyến tính. Giá trị được ghi theo đơn vị `unit` và lưu dưới dạng số nguyên
+    với độ phân giải `resolution` (ví dụ ms với resolution=1000 -> lưu theo µs).
+    """
+    def __init__(self, name, help_text="", unit="ms", resolution=1000):
+        self.name = name
+        self.help = help_text
+        self.unit = unit
+        self.resolution = resolution
+        self._counts = [0] * (SUB_BUCKETS * (MAX_SHIFT + 2))
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _bucket_index(value):
+        shift = max(0, value.bit_length() - SUB_BUCKET_BITS - 1)
+        return min(shift, MAX_SHIFT) * SUB_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def _bucket_bounds(index):
+        """Trả về [cận dưới, cận trên) của bucket theo đơn vị nguyên đã lưu."""
+        shift = max(0, index // SUB_BUCKETS - 1)
+        lower = (index - shift * SUB_BUCKETS) << shift
+        return lower, lower + (1 << shift)
+
+    def record(self, value):
+        scaled = int(value * self.resolution)
+        if scaled < 0:
+            scaled = 0
+        index = self._bucket_index(scaled)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        """Giá trị tại phân vị q (0-100), lấy điểm giữa bucket. Trả về None nếu chưa có dữ liệu."""
+        with self._lock:
+            if self.count == 0:
+                return None
+            target = max(1, int(round(q / 100.0 * self.count)))
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    lower, upper = self._bucket_bounds(index)
+                    return min((lower + upper) / 2.0 / self.resolution, self.max)
+        return self.max
+
+    def buckets(self):
+        """Danh sách (cận trên theo đơn vị `unit`, số đếm) của các bucket khác 0, theo thứ tự tăng dần."""
+        with self._lock:
+            counts = list(self._counts)
+        return [(self._bucket_bounds(i)[1] / self.resolution, c) for i, c in enumerate(counts) if c]
+
+    def cumulative_counts(self, bounds):
+        """
+        Số giá trị <= từng cận trong bounds (theo đơn vị `unit`, tăng dần), dùng để xuất
+        histogram với bộ bucket cố định (`le` của Prometheus, tính cả giá trị bằng cận).
+        Một bucket được tính cho mọi cận >= cận dưới của nó, nên sai số theo độ rộng bucket (~3%).
+        """
+        scaled_bounds = [b * self.resolution for b in bounds]
+        result = [0] * len(bounds)
+        with self._lock:
+            counts = list(self._counts)
+        position = 0
+        running = 0
+        for index, count in enumerate(counts):
+            if not count:
+                continue
+            lower = self._bucket_bounds(index)[0]
+            while position < len(bounds) and lower > scaled_bounds[position]:
+                result[position] = running
+                position += 1
+            running += count
+        while position < len(bounds):
+            result[position] = running
+            position += 1
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * len(self._counts)
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+
+class Counter:
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Giá trị tức thời; có thể gán trực tiếp hoặc gắn hàm tính giá trị khi được đọc."""
+    def __init__(self, name, help_text="", function=None):
+        self.name = name
+        self.help = help_text
+        self._value = 0.0
+        self._function = function
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception as e:
+                logging.debug(f"Không thể đọc gauge {self.name}: {e}")
+                return float("nan")
+        return self._value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = factory()
+                    self._metrics[name] = metric
+        return metric
+
+    def histogram(self, name, help_text="", unit="ms", resolution=1000):
+        return self._get_or_create(name, lambda: Histogram(name, help_text, unit, resolution))
+
+    def counter(self, name, help_text=""):
+        return self._get_or_create(name, lambda: Counter(name, help_text))
+
+    def gauge(self, name, help_text="", function=None):
+        return self._get_or_create(name, lambda: Gauge(name, help_text, function))
+
+    def items(self):
+        with self._lock:
+            return sorted(self._metrics.items())
+
+
+REGISTRY = Registry()
+
+# Bước đang chạy của từng luồng (thread id -> ngăn xếp tên timer), để profiler gắn nhãn mẫu
+_stage_stacks = {}
+
+
+def current_stage(thread_id):
+    """Tên timer trong cùng đang chạy trên luồng thread_id, hoặc None."""
+    stack = _stage_stacks.get(thread_id)
+    try:
+        return stack[-1] if stack else None
+    except IndexError:  # Luồng kia vừa thoát khỏi timer
+        return None
+
+
+@contextmanager
+def timer(name):
+    """Đo thời gian (ms, đồng hồ đơn điệu) của khối lệnh và ghi vào histogram `name`."""
+    stack = _stage_stacks.setdefault(threading.get_ident(), [])
+    stack.append(name)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.histogram(name).record((perf_counter() - start) * 1000)
+        stack.pop()
+
+
+def observe(name, value, unit="", resolution=1):
+    """Ghi một giá trị không phải thời gian (ví dụ số khuôn mặt mỗi khung hình)."""
+    REGISTRY.histogram(name, unit=unit, resolution=resolution).record(value)
+
+
+def inc(name, amount=1):
+    REGISTRY.counter(name).inc(amount)
+
+
+def format_percentiles(name):
+    """Chuỗi 'p50/p95/p99' ngắn gọn cho thanh trạng thái, hoặc None nếu chưa có dữ liệu."""
+    histogram = REGISTRY.histogram(name)
+    if histogram.count == 0:
+        return None
+    p50, p95, p99 = (histogram.percentile(q) for q in (50, 95, 99))
+    return f"{p50:.0f}/{p95:.0f}/{p99:.0f} {histogram.unit}"
+
+
+def log_summary():
+    """Ghi tóm tắt toàn bộ số đo ra log (performance.log khi chạy GUI)."""
+    for name, metric in REGISTRY.items():
+        if isinstance(metric, Histogram):
+            if metric.count == 0:
+                continue
+            logging.info(
+                f"[Metrics] {name}: n={metric.count} mean={metric.total / metric.count:.2f} "
+                f"p50={metric.percentile(50):.2f} p95={metric.percentile(95):.2f} "
+                f"p99={metric.percentile(99):.2f} max={metric.max:.2f} {metric.unit}")
+        elif isinstance(metric, Counter):
+            logging.info(f"[Metrics] {name}: {metric.value}")
+        elif isinstance(metric, Gauge):
+            logging.info(f"[Metrics] {name}: {metric.value}")
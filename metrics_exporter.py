@@ -0,0 +1,203 @@
+# metrics_exporter.py
+"""
+Xuất số đo theo định dạng văn bản của Prometheus qua một luồng HTTP cục bộ.
+Kiểm tra nhanh:  curl http://127.0.0.1:9108/metrics
+Tự kiểm tra (scrape bằng HTTP client cục bộ và so giá trị _bucket):  python -m metrics_exporter --self-check
+Chỉ lắng nghe trên localhost theo mặc định; không phụ thuộc thư viện ngoài.
+"""
+import argparse
+import logging
+import math
+import os
+import re
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psutil
+
+import metrics
+from config import METRICS_HOST, METRICS_PORT
+
+METRIC_PREFIX = "face_recognition_"
+# Bucket cố định để các lần scrape luôn có cùng tập chuỗi thời gian
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+COUNT_BUCKETS = [0, 1, 2, 3, 5, 8, 13, 21, 34, 55]
+
+_INVALID_CHARS = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _metric_name(name):
+    return METRIC_PREFIX + _INVALID_CHARS.sub("_", name)
+
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def render_exposition(registry=None):
+    """Chuyển toàn bộ registry sang định dạng văn bản Prometheus (version 0.0.4)."""
+    registry = registry or metrics.REGISTRY
+    lines = []
+    for name, metric in registry.items():
+        if isinstance(metric, metrics.Histogram):
+            # Histogram thời gian (ms) được xuất theo giây như quy ước của Prometheus
+            is_latency = metric.unit == "ms"
+            full_name = _metric_name(name) + ("_seconds" if is_latency else "")
+            bounds = LATENCY_BUCKETS_MS if is_latency else COUNT_BUCKETS
+            scale = 1000.0 if is_latency else 1.0
+            lines.append(f"# HELP {full_name} {_escape_help(metric.help or name)}")
+            lines.append(f"# TYPE {full_name} histogram")
+            for bound, count in zip(bounds, metric.cumulative_counts(bounds)):
+                lines.append(f'{full_name}_bucket{{le="{_format_value(bound / scale)}"}} {count}')
+            lines.append(f'{full_name}_bucket{{le="+Inf"}} {metric.count}')
+            lines.append(f"{full_name}_sum {_format_value(metric.total / scale)}")
+            lines.append(f"{full_name}_count {metric.count}")
+        elif isinstance(metric, metrics.Counter):
+            full_name = _metric_name(name) + "_total"
+            lines.append(f"# HELP {full_name} {_escape_help(metric.help or name)}")
+            lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{full_name} {metric.value}")
+        elif isinstance(metric, metrics.Gauge):
+            full_name = _metric_name(name)
+            lines.append(f"# HELP {full_name} {_escape_help(metric.help or name)}")
+            lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name} {_format_value(metric.value)}")
+    return "\n".join(lines) + "\n"
+
+
+def register_process_gauges(registry=None):
+    """Gauge tài nguyên của tiến trình hiện tại (bộ nhớ, CPU, số luồng)."""
+    registry = registry or metrics.REGISTRY
+    process = psutil.Process(os.getpid())
+    registry.gauge("process_resident_memory_bytes", "Bộ nhớ RSS của tiến trình",
+                   lambda: process.memory_info().rss)
+    registry.gauge("process_cpu_percent", "Phần trăm CPU của tiến trình kể từ lần đọc trước",
+                   lambda: process.cpu_percent(interval=None))
+    registry.gauge("process_threads", "Số luồng của tiến trình", lambda: process.num_threads())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_exposition(self.registry).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("[Metrics HTTP] " + format % args)
+
+
+class MetricsExporter:
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT, registry=None):
+        self.host = host
+        self.port = port
+        self.registry = registry or metrics.REGISTRY
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Mở cổng HTTP trong luồng nền. Trả về False nếu không mở được (ví dụ cổng đã bị dùng)."""
+        handler = type("MetricsHandler", (_MetricsHandler,), {"registry": self.registry})
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        except OSError as e:
+            logging.error(f"[Metrics] Không thể mở cổng {self.host}:{self.port}: {e}")
+            return False
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        register_process_gauges(self.registry)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsExporter", daemon=True)
+        self._thread.start()
+        logging.info(f"[Metrics] Đang xuất số đo tại http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Giá trị đã biết và số đếm tích lũy mong đợi (le bao gồm cả giá trị bằng cận)
+_CHECK_COUNTS = [0, 1, 1, 2, 3]
+_CHECK_LATENCIES_MS = [1, 2, 5, 10]
+
+
+def _scrape_buckets(url):
+    """Đọc /metrics bằng HTTP và trả về {(tên, le): số đếm} của các dòng _bucket."""
+    with urllib.request.urlopen(url, timeout=5) as response:
+        text = response.read().decode("utf-8")
+    buckets = {}
+    for line in text.splitlines():
+        match = re.match(r'^(\w+)_bucket\{le="([^"]+)"\} (\d+)$', line)
+        if match:
+            buckets[(match.group(1), match.group(2))] = int(match.group(3))
+    return buckets
+
+
+def self_check():
+    """
+    Ghi các giá trị đã biết vào một registry riêng, mở exporter trên cổng ngẫu nhiên, scrape bằng HTTP client
+    cục bộ và so từng dòng _bucket với giá trị mong đợi. Trả về True nếu khớp hết.
+    """
+    registry = metrics.Registry()
+    faces = registry.histogram("faces_per_frame", unit="", resolution=1)
+    for value in _CHECK_COUNTS:
+        faces.record(value)
+    latency = registry.histogram("detect")
+    for value in _CHECK_LATENCIES_MS:
+        latency.record(value)
+
+    expected = {}
+    for name, bounds, scale, values in (("faces_per_frame", COUNT_BUCKETS, 1.0, _CHECK_COUNTS),
+                                        ("detect_seconds", LATENCY_BUCKETS_MS, 1000.0, _CHECK_LATENCIES_MS)):
+        for bound in bounds:
+            expected[(_metric_name(name), _format_value(bound / scale))] = sum(1 for v in values if v <= bound)
+        expected[(_metric_name(name), "+Inf")] = len(values)
+
+    exporter = MetricsExporter(host="127.0.0.1", port=0, registry=registry)
+    if not exporter.start():
+        return False
+    try:
+        actual = _scrape_buckets(f"http://127.0.0.1:{exporter.port}/metrics")
+    finally:
+        exporter.stop()
+    ok = True
+    for key, count in expected.items():
+        if actual.get(key) != count:
+            print(f"[Metrics Lỗi] {key[0]}_bucket{{le=\"{key[1]}\"}}: {actual.get(key)}, mong đợi {count}")
+            ok = False
+    print(f"[Metrics] Tự kiểm tra {'đạt' if ok else 'KHÔNG đạt'} ({len(expected)} dòng _bucket).")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m metrics_exporter",
+                                     description="Xuất số đo theo định dạng Prometheus.")
+    parser.add_argument("--self-check", action="store_true",
+                        help="Scrape một exporter tạm bằng HTTP và kiểm tra giá trị _bucket.")
+    args = parser.parse_args(argv)
+    if args.self_check:
+        return 0 if self_check() else 1
+    parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
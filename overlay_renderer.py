@@ -0,0 +1,177 @@
+# overlay_renderer.py
+"""
+Dựng khung hình hiển thị: thu nhỏ + lật ngang trong một lần cv2.warpAffine vào bộ đệm dùng lại,
+rồi vẽ khung + nhãn tên khuôn mặt bằng QPainter trên QImage.
+Nhãn tên được dựng sẵn một lần cho mỗi (tên, loại) và chỉ dán lại ở các khung hình sau.
+
+Chỉ dùng QImage (không dùng QPixmap) nên chạy được ngoài luồng GUI: OverlayRenderThread nhận
+khung hình/kết quả mới nhất, chỉ dựng lại khi một trong hai thay đổi, luồng GUI chỉ còn QPixmap.fromImage.
+"""
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QImage, QPainter, QColor, QPen, QFont, QFontMetrics
+
+import metrics
+from config import RESIZE_FACTOR
+from scaler import DisplayTransform
+
+LABEL_CACHE_SIZE = 256
+STRANGER_COLOR = QColor(255, 0, 0)
+KNOWN_COLOR = QColor(0, 255, 0)
+TEXT_COLOR = QColor(255, 255, 255)
+
+
+class OverlayRenderer:
+    """
+    Dựng khung hình hiển thị theo scaler (FixedScaler): cập nhật scaler.scale_ratio như resize_image.
+    Trả về QImage dùng chung bộ nhớ với một trong `buffers` bộ đệm xoay vòng, nên QImage chỉ
+    hợp lệ cho tới khi đã dựng thêm `buffers - 1` khung hình.
+    """
+    def __init__(self, scaler, buffers=3):
+        self.scaler = scaler
+        self._buffers = [None] * buffers
+        self._next_buffer = 0
+        self._labels = OrderedDict()   # (tên, người lạ?) -> (QImage, ascent)
+        self._font = QFont()
+        self._font.setPointSize(12)
+        self._font_metrics = QFontMetrics(self._font)
+        self._pens = {True: QPen(STRANGER_COLOR, 2), False: QPen(KNOWN_COLOR, 2)}
+        self.transform = DisplayTransform()
+        # Hộp của khung hình vừa dựng (không gian hiển thị), để xác định click đúng với những gì đang vẽ
+        self.layout = None
+
+    def _take_buffer(self, h, w):
+        buffer = self._buffers[self._next_buffer]
+        if buffer is None or buffer.shape != (h, w, 3):
+            buffer = np.empty((h, w, 3), dtype=np.uint8)
+            self._buffers[self._next_buffer] = buffer
+        self._next_buffer = (self._next_buffer + 1) % len(self._buffers)
+        return buffer
+
+    def compose(self, img):
+        """Thu nhỏ về target_width và lật ngang trong một phép biến đổi affine, ghi vào bộ đệm dùng lại."""
+        h, w = img.shape[:2]
+        s = self.scaler.target_width / w
+        self.scaler.scale_ratio = s
+        out_w, out_h = self.scaler.target_width, int(h * s)
+        # Cùng quy ước tâm điểm ảnh như cv2.resize, rồi lật: x' = (out_w - 1) - ((x + 0.5) * s - 0.5)
+        matrix = np.array([[-s, 0.0, out_w - 0.5 - 0.5 * s],
+                           [0.0, s, 0.5 * s - 0.5]], dtype=np.float64)
+        buffer = self._take_buffer(out_h, out_w)
+        cv2.warpAffine(img, matrix, (out_w, out_h), dst=buffer,
+                       flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return buffer
+
+    def _label(self, name, is_stranger):
+        """Ảnh nhãn (nền màu + chữ trắng) dựng một lần rồi dùng lại."""
+        key = (name, is_stranger)
+        label = self._labels.get(key)
+        if label is not None:
+            self._labels.move_to_end(key)
+            return label
+        font_metrics = self._font_metrics
+        image = QImage(font_metrics.horizontalAdvance(name) + 4, font_metrics.height(),
+                       QImage.Format_ARGB32_Premultiplied)
+        image.fill(STRANGER_COLOR if is_stranger else KNOWN_COLOR)
+        painter = QPainter(image)
+        painter.setFont(self._font)
+        painter.setPen(TEXT_COLOR)
+        painter.drawText(2, font_metrics.ascent(), name)
+        painter.end()
+        label = (image, font_metrics.ascent())
+        self._labels[key] = label
+        if len(self._labels) > LABEL_CACHE_SIZE:
+            self._labels.popitem(last=False)
+        return label
+
+    def render(self, img, results):
+        """Trả về (qt_image, buffer); buffer là bộ nhớ mà qt_image tham chiếu tới."""
+        buffer = self.compose(img)
+        h, w = buffer.shape[:2]
+        qt_image = QImage(buffer.data, w, h, 3 * w, QImage.Format_BGR888)
+        # Tọa độ hộp trong không gian hiển thị (đã lật) được tính một lần cho cả mảng
+        layout = self.transform.layout(results, self.scaler.scale_ratio / RESIZE_FACTOR, w)
+        self.layout = layout
+        if not layout.results:
+            return qt_image, buffer
+
+        painter = QPainter(qt_image)
+        for result, (x1, y1, x2, y2) in zip(layout.results, layout.boxes.tolist()):
+            is_stranger = result.get("id") is None
+            painter.setPen(self._pens[is_stranger])
+            painter.drawRect(x1, y1, x2 - x1, y2 - y1)
+
+            # Nhãn tên căn giữa phía trên hộp, cách cạnh trên 5 pixel
+            label, ascent = self._label(result["name"], is_stranger)
+            painter.drawImage(x1 + (x2 - x1 - label.width()) // 2, y1 - 5 - ascent, label)
+        painter.end()
+        return qt_image, buffer
+
+
+def _results_key(results):
+    return tuple((r.get("id"), r.get("name"), tuple(r.get("location") or ())) for r in results)
+
+
+class OverlayRenderThread(QThread):
+    """
+    Dựng khung hình hiển thị ngoài luồng GUI. submit_frame/submit_results chỉ ghi lại giá trị mới nhất;
+    khung trung gian bị gộp. Chỉ có tối đa một khung đang chờ luồng GUI (frame_consumed) để bộ đệm
+    xoay vòng của OverlayRenderer không bị ghi đè khi QImage còn đang được dùng.
+    """
+    rendered_signal = pyqtSignal(QImage)
+
+    def __init__(self, scaler, parent=None):
+        super().__init__(parent)
+        self.renderer = OverlayRenderer(scaler)
+        self._condition = threading.Condition()
+        self._frame = None
+        self._results = []
+        self._results_key = ()
+        self._dirty = False
+        self._awaiting_ack = False
+        self._run_flag = True
+
+    def submit_frame(self, frame):
+        with self._condition:
+            self._frame = frame
+            self._dirty = True
+            self._condition.notify()
+
+    def submit_results(self, results):
+        """Kết quả giống hệt lần trước (cùng id, tên, vị trí) không gây vẽ lại."""
+        key = _results_key(results)
+        with self._condition:
+            if key == self._results_key:
+                return
+            self._results = list(results)
+            self._results_key = key
+            self._dirty = True
+            self._condition.notify()
+
+    def frame_consumed(self):
+        with self._condition:
+            self._awaiting_ack = False
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._run_flag and (not self._dirty or self._awaiting_ack or self._frame is None):
+                    self._condition.wait()
+                if not self._run_flag:
+                    return
+                frame, results = self._frame, self._results
+                self._dirty = False
+                self._awaiting_ack = True
+            with metrics.timer("overlay_render"):
+                qt_image, _buffer = self.renderer.render(frame, results)
+            self.rendered_signal.emit(qt_image)
+
+    def stop(self):
+        with self._condition:
+            self._run_flag = False
+            self._condition.notify()
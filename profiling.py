@@ -0,0 +1,130 @@
+# profiling.py
+"""
+Chế độ profile có giới hạn thời gian cho GUI và các đường chạy không giao diện.
+- Lấy mẫu (sampling): một luồng nền đọc ngăn xếp của mọi luồng theo chu kỳ và gắn nhãn mỗi mẫu
+  bằng bước đang chạy (tên timer trong metrics: capture, detect, embed, search, identify, gui_update...).
+  Kết quả ghi ra file .folded (định dạng "stack count") dùng được ngay với flamegraph.pl / speedscope.
+- Tất định (deterministic): cProfile trên luồng gọi start() (luồng GUI/luồng chính), ghi file .pstats.
+"""
+import cProfile
+import logging
+import os
+import sys
+import threading
+from collections import Counter as _Counter
+from datetime import datetime
+from time import monotonic
+
+import metrics
+
+DEFAULT_PROFILE_DIR = "profiles"
+
+
+def add_profile_arguments(parser):
+    """Thêm các tham số --profile* vào argparse parser."""
+    parser.add_argument("--profile", action="store_true", help="Bật profile trong một khoảng thời gian giới hạn.")
+    parser.add_argument("--profile-duration", type=float, default=60.0, help="Thời gian profile (giây).")
+    parser.add_argument("--profile-interval", type=float, default=0.005, help="Chu kỳ lấy mẫu (giây).")
+    parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR, help="Thư mục ghi kết quả profile.")
+    parser.add_argument("--no-cprofile", action="store_true", help="Chỉ lấy mẫu, không chạy cProfile.")
+
+
+def session_from_args(args, name):
+    """Tạo ProfileSession từ tham số dòng lệnh, hoặc None nếu không bật --profile."""
+    if not getattr(args, "profile", False):
+        return None
+    return ProfileSession(name, output_dir=args.profile_dir, duration=args.profile_duration,
+                          interval=args.profile_interval, deterministic=not args.no_cprofile)
+
+
+class ProfileSession:
+    def __init__(self, name, output_dir=DEFAULT_PROFILE_DIR, duration=60.0, interval=0.005, deterministic=True):
+        self.name = name
+        self.output_dir = output_dir
+        self.duration = duration
+        self.interval = interval
+        self.deterministic = deterministic
+        self.session_id = f"{name}_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{os.getpid()}"
+        self._samples = _Counter()
+        self._stage_samples = _Counter()
+        self._stop_event = threading.Event()
+        self._sampler = None
+        self._profiler = None
+        self._owner_thread = None
+        self.active = False
+
+    def start(self):
+        """Bắt đầu profile. cProfile chỉ áp dụng cho luồng gọi hàm này."""
+        if self.active:
+            return
+        self.active = True
+        self._owner_thread = threading.get_ident()
+        if self.deterministic:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._sampler = threading.Thread(target=self._sample_loop, name="ProfileSampler", daemon=True)
+        self._sampler.start()
+        logging.info(f"[Profile] Bắt đầu phiên {self.session_id} trong {self.duration:.0f} giây.")
+
+    def _sample_loop(self):
+        sampler_id = threading.get_ident()
+        names = {}
+        deadline = monotonic() + self.duration
+        while not self._stop_event.wait(self.interval) and monotonic() < deadline:
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stage = metrics.current_stage(thread_id) or "idle"
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                thread_name = names.get(thread_id, str(thread_id))
+                self._samples[";".join([thread_name, f"[{stage}]"] + stack)] += 1
+                self._stage_samples[stage] += 1
+
+    def stop(self):
+        """
+        Dừng profile và ghi kết quả. Phải gọi từ chính luồng đã gọi start() để dừng cProfile.
+        Trả về danh sách đường dẫn các file đã ghi.
+        """
+        if not self.active:
+            return []
+        self.active = False
+        self._stop_event.set()
+        if self._profiler is not None:
+            if threading.get_ident() == self._owner_thread:
+                self._profiler.disable()
+            else:
+                logging.warning("[Profile] stop() không được gọi từ luồng đã bắt đầu; bỏ qua cProfile.")
+                self._profiler = None
+        self._sampler.join()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, self.session_id)
+        paths = []
+
+        folded_path = base + ".folded"
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{stack} {count}\n")
+        paths.append(folded_path)
+
+        stages_path = base + ".stages.txt"
+        total = sum(self._stage_samples.values()) or 1
+        with open(stages_path, "w", encoding="utf-8") as f:
+            for stage, count in self._stage_samples.most_common():
+                f.write(f"{stage:<20} {count:>8} {count * 100 / total:6.1f}%\n")
+        paths.append(stages_path)
+
+        if self._profiler is not None:
+            pstats_path = base + ".pstats"
+            self._profiler.dump_stats(pstats_path)
+            paths.append(pstats_path)
+
+        logging.info(f"[Profile] Đã ghi kết quả phiên {self.session_id}: {', '.join(paths)}")
+        return paths
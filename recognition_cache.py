@@ -0,0 +1,137 @@
+# recognition_cache.py
+"""
+Bộ nhớ đệm kết quả nhận diện theo độ tương đồng embedding.
+Trong lớp học cố định, cùng một nhóm học sinh được nhận diện lại sau mỗi SKIP_FRAMES khung hình.
+Cache giữ vài chục embedding (đã chuẩn hóa) gần nhất cùng kết quả, và được kiểm tra bằng một phép
+nhân ma trận nhỏ trước khi tìm kiếm trong chỉ mục Faiss chính.
+
+FrameSampleCache giữ mẫu đăng ký của các khuôn mặt trong vài khung hình vừa nhận diện (xem bên dưới).
+"""
+import itertools
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+import numpy as np
+
+from config import (RECOGNITION_CACHE_SIZE, RECOGNITION_CACHE_TTL, RECOGNITION_CACHE_SIMILARITY,
+                    FRAME_SAMPLE_CACHE_SIZE, FRAME_SAMPLE_TTL)
+
+
+class RecognitionCache:
+    def __init__(self, capacity=RECOGNITION_CACHE_SIZE, ttl=RECOGNITION_CACHE_TTL,
+                 min_similarity=RECOGNITION_CACHE_SIMILARITY):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        self._vectors = None                          # (capacity, d), tạo khi biết số chiều
+        self._entries = [None] * capacity             # (student_id, name, score) cho mỗi ô
+        self._expires_at = np.zeros(capacity)         # Thời điểm hết hạn của mỗi ô (monotonic)
+        self._last_used = np.zeros(capacity)          # Dùng cho chính sách thay thế LRU
+        self._generation = None                       # Thế hệ ảnh chụp chỉ mục mà cache thuộc về
+        self.hits = 0
+        self.misses = 0
+
+    def _reset(self, generation):
+        """Xóa toàn bộ mục (gọi khi giữ lock)."""
+        self._entries = [None] * self.capacity
+        self._expires_at[:] = 0
+        self._last_used[:] = 0
+        self._generation = generation
+
+    def invalidate(self):
+        """Xóa cache, ví dụ sau khi chỉ mục hoặc danh sách học sinh thay đổi."""
+        with self._lock:
+            self._reset(None)
+
+    def lookup(self, query_vectors, generation):
+        """
+        Tìm kết quả đã lưu cho từng vector truy vấn (đã chuẩn hóa L2).
+        Trả về list cùng độ dài: (student_id, name, score) nếu trúng cache, None nếu trượt.
+        Cache tự xóa khi thế hệ ảnh chụp chỉ mục khác với thế hệ đã lưu.
+        """
+        n = len(query_vectors)
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+            now = monotonic()
+            valid = self._expires_at > now
+            if self._vectors is None or not valid.any() or self._vectors.shape[1] != query_vectors.shape[1]:
+                self.misses += n
+                return [None] * n
+
+            similarities = query_vectors @ self._vectors.T
+            similarities[:, ~valid] = -np.inf
+            best_slots = np.argmax(similarities, axis=1)
+            best_scores = similarities[np.arange(n), best_slots]
+
+            results = []
+            for slot, similarity in zip(best_slots, best_scores):
+                if similarity >= self.min_similarity:
+                    self._last_used[slot] = now
+                    results.append(self._entries[slot])
+                    self.hits += 1
+                else:
+                    results.append(None)
+                    self.misses += 1
+            return results
+
+    def insert(self, vector, student_id, name, score, generation):
+        """Thêm một kết quả vào cache, thay ô đã hết hạn hoặc ô ít được dùng nhất."""
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._vectors = np.zeros((self.capacity, len(vector)), dtype='float32')
+                self._reset(generation)
+            now = monotonic()
+            expired = np.flatnonzero(self._expires_at <= now)
+            slot = expired[0] if len(expired) else int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._entries[slot] = (student_id, name, score)
+            self._expires_at[slot] = now + self.ttl
+            self._last_used[slot] = now
+
+    def stats(self):
+        """Trả về (số lần trúng, số lần trượt, tỉ lệ trúng)."""
+        total = self.hits + self.misses
+        return self.hits, self.misses, (self.hits / total if total else 0.0)
+
+
+class FrameSampleCache:
+    """
+    Mẫu đăng ký (FaceSample + ảnh chân dung) của các khuôn mặt trong vài khung hình vừa nhận diện, để đăng ký
+    học sinh từ khuôn mặt người dùng vừa chọn mà không phải phát hiện và tính embedding lại.
+    Mỗi khung hình có một số thứ tự (frame_seq, ghi vào kết quả nhận diện); khuôn mặt được tra theo location.
+    Khung hình quá ttl giây hoặc ngoài capacity khung gần nhất bị bỏ.
+    """
+    def __init__(self, capacity=FRAME_SAMPLE_CACHE_SIZE, ttl=FRAME_SAMPLE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._frames = OrderedDict()   # frame_seq -> (thời điểm, {location: (sample, ảnh chân dung)})
+        self._seq = itertools.count(1)
+
+    def put(self, faces, now=None):
+        """faces: dict location -> (sample, ảnh chân dung). Trả về frame_seq của khung hình."""
+        now = monotonic() if now is None else now
+        with self._lock:
+            frame_seq = next(self._seq)
+            self._frames[frame_seq] = (now, faces)
+            while len(self._frames) > self.capacity:
+                self._frames.popitem(last=False)
+        return frame_seq
+
+    def get(self, frame_seq, location, now=None):
+        """(sample, ảnh chân dung) của khuôn mặt tại location trong khung frame_seq, hoặc None."""
+        now = monotonic() if now is None else now
+        with self._lock:
+            entry = self._frames.get(frame_seq)
+            if entry is None or now - entry[0] > self.ttl:
+                return None
+            return entry[1].get(tuple(location))
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
@@ -0,0 +1,357 @@
+# recognition_server.py
+"""
+Dịch vụ nhận diện không giao diện: một tiến trình giữ FaceProcessor (model đã nạp sẵn) và chỉ mục Faiss,
+phục vụ nhiều giao diện/script qua HTTP cục bộ hoặc Unix socket.
+
+API (JSON, trừ /recognize nhận trực tiếp bytes ảnh):
+    GET  /health                                   -> {"status", "index_size"}
+    POST /recognize          body: bytes ảnh JPEG/PNG -> {"faces": [...]}
+    POST /recognize_batch    {"images": [base64, ...]} -> {"results": [[...], ...]}
+    POST /enroll             {"id", "name", "dob", "class", "gender", "school_year", "stt", "image": base64}
+    POST /search             {"embedding": [...], "k": 5} -> {"matches": [...]}
+
+Các yêu cầu nhận diện đồng thời được gom (BatchCoalescer) thành một lần gọi model nhận diện;
+mỗi yêu cầu HTTP được xử lý trong một thread pool có giới hạn.
+
+Chạy:  python recognition_server.py --port 8765
+       python recognition_server.py --unix-socket /tmp/face.sock
+       python recognition_server.py --scope 2025-2026/10A   (chỉ nhận diện học sinh lớp 10A; /search vẫn toàn trường)
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import monotonic
+
+import cv2
+import numpy as np
+
+import database_manager as db
+import faiss_manager
+import metrics
+import profiling
+from config import (RESIZE_FACTOR, SERVER_HOST, SERVER_PORT, SERVER_MAX_BATCH,
+                    SERVER_MAX_WAIT_MS, SERVER_WORKERS, SERVER_MAX_BODY_BYTES, DEFAULT_SCOPE)
+from crop_store import CropStore
+from image_store import ImageStore
+from face_processor import FaceProcessor
+from metrics_exporter import MetricsExporter
+
+
+class BatchCoalescer:
+    """
+    Gom các yêu cầu nhận diện đến gần nhau thành một lô: luồng nền lấy yêu cầu đầu tiên,
+    chờ thêm tối đa max_wait_ms hoặc đến khi đủ max_batch ảnh, rồi gọi recognize_batch một lần.
+    """
+    def __init__(self, processor, max_batch=SERVER_MAX_BATCH, max_wait_ms=SERVER_MAX_WAIT_MS):
+        self.processor = processor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="BatchCoalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, frames):
+        """Gửi một hoặc nhiều ảnh, trả về Future chứa list kết quả (mỗi ảnh một list)."""
+        future = Future()
+        self._queue.put((frames, future))
+        return future
+
+    def _run(self):
+        while self._running:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if first is None:
+                break
+            pending = [first]
+            total = len(first[0])
+            deadline = monotonic() + self.max_wait
+            while total < self.max_batch:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._running = False
+                    break
+                pending.append(item)
+                total += len(item[0])
+
+            metrics.observe("server_batch_size", total)
+            frames = [frame for item_frames, _ in pending for frame in item_frames]
+            try:
+                with metrics.timer("server_batch"):
+                    results = self.processor.recognize_batch(frames)
+            except Exception as e:
+                logging.exception("Lỗi khi nhận diện theo lô")
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            position = 0
+            for item_frames, future in pending:
+                future.set_result(results[position:position + len(item_frames)])
+                position += len(item_frames)
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class RecognitionService:
+    """Phần logic của dịch vụ, tách khỏi HTTP để có thể dùng trực tiếp từ script."""
+    def __init__(self, max_batch=SERVER_MAX_BATCH, max_wait_ms=SERVER_MAX_WAIT_MS, scope=None):
+        faiss_index, id_mapping = faiss_manager.load_index()
+        self.known_students = db.get_all_students()
+        self.processor = FaceProcessor(faiss_index, id_mapping, self.known_students)
+        # Một tiến trình phục vụ một phạm vi (ví dụ các camera của một lớp); None = toàn trường
+        self.processor.set_scope(scope)
+        self.coalescer = BatchCoalescer(self.processor, max_batch, max_wait_ms)
+        self._enroll_lock = threading.Lock()
+        self.crop_store = CropStore()
+        self.image_store = ImageStore()
+
+    @staticmethod
+    def _to_response(faces):
+        """Chuyển kết quả sang JSON; tọa độ hộp trả về theo ảnh gốc (top, right, bottom, left)."""
+        return [{
+            "id": face["id"],
+            "name": face["name"],
+            "score": face["score"],
+            "box": [int(round(v / RESIZE_FACTOR)) for v in face["location"]],
+        } for face in faces]
+
+    def recognize(self, frames):
+        results = self.coalescer.submit(frames).result()
+        return [self._to_response(faces) for faces in results]
+
+    def search(self, embedding, k=5):
+        return self.processor.search_embedding(embedding, k)
+
+    def enroll(self, data, image):
+        """Đăng ký học sinh mới từ ảnh có đúng một khuôn mặt; cập nhật CSDL, chỉ mục và ảnh chụp chỉ mục."""
+        with self._enroll_lock:
+            sample = self.processor.get_single_face_sample(image, self.known_students)
+            if sample is None:
+                raise ValueError("Ảnh phải chứa đúng một khuôn mặt.")
+            face_encoding = sample.encoding
+            student_id = str(data["id"]).strip()
+            image_path = self.image_store.path_for(student_id)
+
+            # Ghi CSDL trước: mã đã tồn tại thì dừng ở đây, không ghi đè ảnh của học sinh đang có mã đó
+            new_id = db.add_student(student_id, data["name"], data.get("dob", ""), data["class"],
+                                    np.asarray(face_encoding), data.get("gender", ""),
+                                    data.get("school_year", ""), data.get("stt"), image_path,
+                                    embedding_model=self.processor.enrollment_model_id)
+            if not new_id:
+                raise ValueError("Không thể thêm học sinh (mã hoặc khuôn mặt đã tồn tại).")
+            try:
+                self.image_store.save(student_id, image)
+                faiss_manager.sync_index()
+                self.crop_store.put(student_id, sample.crop, sample.landmarks)
+            except Exception:
+                # Hoàn tác để không còn học sinh thiếu ảnh/chỉ mục hay ảnh không thuộc ai
+                logging.exception(f"Đăng ký {student_id} thất bại, hoàn tác.")
+                self.image_store.remove(image_path)
+                self.crop_store.remove(student_id)
+                db.delete_student(student_id)
+                faiss_manager.sync_index()
+                raise
+            self.known_students = db.get_all_students()
+            faiss_index, id_mapping = faiss_manager.load_index()
+            self.processor.swap_snapshot(faiss_index, id_mapping, self.known_students)
+            return {"id": student_id, "index_size": int(faiss_index.ntotal)}
+
+    def index_size(self):
+        faiss_index = self.processor.snapshot.faiss_index
+        return 0 if faiss_index is None else int(faiss_index.ntotal)
+
+    def shutdown(self):
+        self.coalescer.stop()
+        self.processor.shutdown()
+
+
+def _decode_image(data):
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Không giải mã được ảnh.")
+    return image
+
+
+class RecognitionRequestHandler(BaseHTTPRequestHandler):
+    service = None  # Gán khi tạo server
+
+    def address_string(self):
+        # Với Unix socket, client_address là chuỗi rỗng
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        logging.debug(f"[Server] {self.address_string()} " + format % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0 or length > SERVER_MAX_BODY_BYTES:
+            raise ValueError("Nội dung yêu cầu rỗng hoặc quá lớn.")
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "index_size": self.service.index_size()})
+        else:
+            self._send_json(404, {"error": "Không tìm thấy."})
+
+    def do_POST(self):
+        metrics.inc("server_requests")
+        try:
+            with metrics.timer("server_request"):
+                if self.path == "/recognize":
+                    image = _decode_image(self._read_body())
+                    self._send_json(200, {"faces": self.service.recognize([image])[0]})
+                elif self.path == "/recognize_batch":
+                    payload = json.loads(self._read_body())
+                    images = [_decode_image(base64.b64decode(item)) for item in payload["images"]]
+                    self._send_json(200, {"results": self.service.recognize(images)})
+                elif self.path == "/enroll":
+                    payload = json.loads(self._read_body())
+                    image = _decode_image(base64.b64decode(payload.pop("image")))
+                    self._send_json(200, self.service.enroll(payload, image))
+                elif self.path == "/search":
+                    payload = json.loads(self._read_body())
+                    matches = self.service.search(payload["embedding"], int(payload.get("k", 5)))
+                    self._send_json(200, {"matches": matches})
+                else:
+                    self._send_json(404, {"error": "Không tìm thấy."})
+        except (ValueError, KeyError, TypeError) as e:
+            metrics.inc("server_bad_requests")
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            metrics.inc("server_errors")
+            logging.exception("Lỗi khi xử lý yêu cầu")
+            self._send_json(500, {"error": str(e)})
+
+
+class _PooledMixIn:
+    """Xử lý mỗi kết nối trong một ThreadPoolExecutor có giới hạn thay vì tạo luồng mới không giới hạn."""
+    max_workers = SERVER_WORKERS
+
+    def _ensure_pool(self):
+        if getattr(self, "_pool", None) is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ServerWorker")
+
+    def process_request(self, request, client_address):
+        self._ensure_pool()
+        self._pool.submit(self._process_request_in_pool, request, client_address)
+
+    def _process_request_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if getattr(self, "_pool", None) is not None:
+            self._pool.shutdown(wait=True)
+
+
+class PooledHTTPServer(_PooledMixIn, HTTPServer):
+    pass
+
+
+if hasattr(socket, "AF_UNIX"):
+    class PooledUnixHTTPServer(_PooledMixIn, socketserver.UnixStreamServer):
+        def server_bind(self):
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+            super().server_bind()
+            self.server_name, self.server_port = "unix", 0
+
+
+def create_server(service, host=SERVER_HOST, port=SERVER_PORT, unix_socket=None, workers=SERVER_WORKERS):
+    handler = type("Handler", (RecognitionRequestHandler,), {"service": service})
+    if unix_socket:
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("Hệ điều hành không hỗ trợ Unix socket.")
+        server_class = PooledUnixHTTPServer
+        address = unix_socket
+    else:
+        server_class = PooledHTTPServer
+        address = (host, port)
+    server_class = type(server_class.__name__, (server_class,), {"max_workers": workers})
+    return server_class(address, handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dịch vụ nhận diện khuôn mặt không giao diện.")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--unix-socket", help="Lắng nghe trên Unix socket thay vì TCP.")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Số luồng xử lý yêu cầu tối đa.")
+    parser.add_argument("--max-batch", type=int, default=SERVER_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=SERVER_MAX_WAIT_MS)
+    parser.add_argument("--metrics-port", type=int, default=None)
+    parser.add_argument("--scope", default=DEFAULT_SCOPE,
+                        help="Phạm vi nhận diện \"năm học/lớp\", \"lớp\" hoặc \"năm học/*\" (mặc định toàn trường).")
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(encoding='utf-8', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[logging.FileHandler("performance.log"), logging.StreamHandler()])
+    db.create_table()
+    service = RecognitionService(args.max_batch, args.max_wait_ms, args.scope)
+    server = create_server(service, args.host, args.port, args.unix_socket, args.workers)
+
+    exporter = None
+    if args.metrics_port is not None:
+        exporter = MetricsExporter(port=args.metrics_port)
+        exporter.start()
+
+    # Yêu cầu được xử lý trên các luồng của pool nên chỉ dùng profile lấy mẫu (không cProfile)
+    args.no_cprofile = True
+    profile_session = profiling.session_from_args(args, "server")
+    if profile_session:
+        profile_session.start()
+        threading.Timer(profile_session.duration, profile_session.stop).start()
+
+    where = args.unix_socket or f"http://{args.host}:{args.port}"
+    logging.info(f"[Server] Đang phục vụ tại {where} ({args.workers} luồng, lô tối đa {args.max_batch}).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if profile_session:
+            profile_session.stop()
+        if exporter:
+            exporter.stop()
+        metrics.log_summary()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
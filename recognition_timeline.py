@@ -0,0 +1,251 @@
+# recognition_timeline.py
+"""
+Dòng thời gian nhận diện tính trước cho video đã ghi: xử lý cả file một lần ở nền, lưu kết quả
+từng khung hình đã xử lý vào một file .npz gọn (timelines/<hash>.npz, khóa theo hash của file video).
+Khi phát lại, tua hoặc kéo thanh trượt, kết quả được tra trực tiếp từ dòng thời gian thay vì nhận diện lại.
+
+Cấu trúc file (mảng phẳng, không có đối tượng Python):
+    frames      int32 [F]     số thứ tự các khung hình đã xử lý (tăng dần)
+    offsets     int32 [F+1]   khuôn mặt của frames[i] nằm ở [offsets[i], offsets[i+1])
+    boxes       int32 [N, 4]  (top, right, bottom, left) theo tọa độ khung hình gốc
+    students    int32 [N]     chỉ số vào student_ids, -1 nếu không nhận ra
+    scores      float16 [N]
+    student_ids, names        bảng tra chuỗi
+    meta        JSON: phiên bản, bước khung hình, tổng số khung, roster_version
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+import database_manager as db
+import metrics
+from config import RESIZE_FACTOR, TIMELINE_FRAME_STEP, TIMELINE_BATCH_SIZE
+
+TIMELINE_DIR = None  # Ghi đè để đặt thư mục lưu khác (mặc định: timelines/ cạnh mã nguồn)
+TIMELINE_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+UNKNOWN_NAME = "Người lạ"
+
+
+def _timeline_dir():
+    base_dir = TIMELINE_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), "timelines")
+    os.makedirs(base_dir, exist_ok=True)
+    return base_dir
+
+
+def file_hash(video_path):
+    """
+    Hash nhận dạng file video: kích thước + ba khối 1 MB (đầu, giữa, cuối).
+    Đủ để phân biệt các file ghi hình khác nhau mà không phải đọc cả file nhiều GB.
+    """
+    size = os.path.getsize(video_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(video_path, 'rb') as f:
+        for offset in (0, max(0, size // 2 - HASH_CHUNK_SIZE // 2), max(0, size - HASH_CHUNK_SIZE)):
+            f.seek(offset)
+            digest.update(f.read(HASH_CHUNK_SIZE))
+    return digest.hexdigest()
+
+
+def timeline_path(video_hash):
+    return os.path.join(_timeline_dir(), f"{video_hash}.npz")
+
+
+class RecognitionTimeline:
+    def __init__(self, frames, offsets, boxes, students, scores, student_ids, names, meta):
+        self.frames = np.asarray(frames, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.students = np.asarray(students, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float16)
+        self.student_ids = [str(s) for s in student_ids]
+        self.names = [str(n) for n in names]
+        self.meta = meta
+        self.step = int(meta.get("step", 1))
+        self._student_rows = {sid: i for i, sid in enumerate(self.student_ids)}
+        # Khung hình của từng khuôn mặt, dùng cho tìm kiếm vector hóa
+        self._face_frames = np.repeat(self.frames, np.diff(self.offsets))
+        self._frame_list = self.frames.tolist()
+
+    @property
+    def roster_version(self):
+        return self.meta.get("roster_version")
+
+    def lookup(self, frame_number):
+        """
+        Vị trí (trong frames) của khung đã xử lý gần nhất không sau frame_number, hoặc None nếu
+        khung đó cách quá một bước xử lý (ví dụ đầu video).
+        """
+        position = bisect.bisect_right(self._frame_list, frame_number) - 1
+        if position < 0 or frame_number - self._frame_list[position] >= self.step:
+            return None
+        return position
+
+    def results_at(self, frame_number, resize_factor=RESIZE_FACTOR):
+        """
+        Kết quả nhận diện cho frame_number theo đúng định dạng của FaceProcessor
+        (location trong không gian ảnh đã thu nhỏ resize_factor), hoặc None nếu không có.
+        """
+        position = self.lookup(frame_number)
+        if position is None:
+            return None
+        return self.results_for(position, resize_factor)
+
+    def results_for(self, position, resize_factor=RESIZE_FACTOR):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        boxes = np.rint(self.boxes[start:end] * resize_factor).astype(int).tolist()
+        results = []
+        for box, row, score in zip(boxes, self.students[start:end].tolist(), self.scores[start:end].tolist()):
+            if row < 0:
+                results.append({"name": UNKNOWN_NAME, "id": None, "score": score, "location": tuple(box)})
+            else:
+                results.append({"name": self.names[row], "id": self.student_ids[row],
+                                "score": score, "location": tuple(box)})
+        return results
+
+    def next_appearance(self, student_id, after_frame):
+        """Khung hình đầu tiên sau after_frame có student_id, hoặc None."""
+        row = self._student_rows.get(student_id)
+        if row is None:
+            return None
+        face_frames = self._face_frames[self.students == row]
+        position = np.searchsorted(face_frames, after_frame, side='right')
+        return int(face_frames[position]) if position < len(face_frames) else None
+
+    def appearances(self, student_id):
+        """Các khung hình có student_id (tăng dần, không trùng)."""
+        row = self._student_rows.get(student_id)
+        if row is None:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(self._face_frames[self.students == row])
+
+    def save(self, path):
+        """Ghi nguyên tử: file tạm rồi os.replace."""
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, frames=self.frames, offsets=self.offsets, boxes=self.boxes,
+                            students=self.students, scores=self.scores,
+                            student_ids=np.asarray(self.student_ids, dtype=str),
+                            names=np.asarray(self.names, dtype=str),
+                            meta=np.asarray(json.dumps(self.meta)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != TIMELINE_VERSION:
+                return None
+            return cls(data["frames"], data["offsets"], data["boxes"], data["students"], data["scores"],
+                       data["student_ids"].tolist(), data["names"].tolist(), meta)
+
+
+class TimelineCursor:
+    """Theo dõi vị trí phát trên dòng thời gian; chỉ trả kết quả khi chuyển sang khung đã xử lý khác."""
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self._position = -1
+
+    def results_if_changed(self, frame_number):
+        """Danh sách kết quả nếu khung xử lý tương ứng đã đổi (list rỗng nếu không có), ngược lại None."""
+        position = self.timeline.lookup(frame_number)
+        if position == self._position:
+            return None
+        self._position = position
+        return [] if position is None else self.timeline.results_for(position)
+
+    def reset(self):
+        self._position = -1
+
+
+def load_timeline(video_path, video_hash=None):
+    """Đọc dòng thời gian đã lưu cho video; None nếu chưa có, hỏng hoặc danh sách học sinh đã đổi."""
+    path = timeline_path(video_hash or file_hash(video_path))
+    if not os.path.exists(path):
+        return None
+    try:
+        timeline = RecognitionTimeline.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Không đọc được dòng thời gian {path}: {e}")
+        return None
+    if timeline is not None and timeline.roster_version != db.get_roster_version():
+        logging.info("Danh sách học sinh đã thay đổi, dòng thời gian nhận diện cần tính lại.")
+        return None
+    return timeline
+
+
+def build_timeline(video_path, processor, step=TIMELINE_FRAME_STEP, batch_size=TIMELINE_BATCH_SIZE,
+                   progress=None, should_stop=None, video_hash=None):
+    """
+    Xử lý cả video (mỗi `step` khung một lần, theo lô qua FaceProcessor.recognize_batch) và lưu dòng thời gian.
+    progress(frame, total) được gọi sau mỗi lô; should_stop() trả về True để hủy (khi đó trả về None).
+    """
+    video_hash = video_hash or file_hash(video_path)
+    roster_version = db.get_roster_version()
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    if not cap.isOpened():
+        raise RuntimeError(f"Không thể mở video {video_path}")
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    frames, offsets, boxes, students, scores = [], [0], [], [], []
+    student_rows, student_ids, names = {}, [], []
+
+    def flush(batch_numbers, batch_frames):
+        with metrics.timer("timeline_batch"):
+            batch_results = processor.recognize_batch(batch_frames)
+        for frame_number, results in zip(batch_numbers, batch_results):
+            frames.append(frame_number)
+            for result in results:
+                boxes.append([v / RESIZE_FACTOR for v in result["location"]])
+                scores.append(result["score"])
+                student_id = result["id"]
+                if student_id is None:
+                    students.append(-1)
+                    continue
+                row = student_rows.get(student_id)
+                if row is None:
+                    row = student_rows[student_id] = len(student_ids)
+                    student_ids.append(student_id)
+                    names.append(result["name"])
+                students.append(row)
+            offsets.append(len(students))
+
+    try:
+        frame_number = 0
+        batch_numbers, batch_frames = [], []
+        while True:
+            if should_stop is not None and should_stop():
+                return None
+            if frame_number % step == 0:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                batch_numbers.append(frame_number)
+                batch_frames.append(frame)
+                if len(batch_frames) >= batch_size:
+                    flush(batch_numbers, batch_frames)
+                    batch_numbers, batch_frames = [], []
+                    if progress is not None:
+                        progress(frame_number, total)
+            elif not cap.grab():  # Khung không xử lý: chỉ giải nén, không chuyển màu
+                break
+            frame_number += 1
+        if batch_frames:
+            flush(batch_numbers, batch_frames)
+    finally:
+        cap.release()
+
+    meta = {"version": TIMELINE_VERSION, "step": step, "total_frames": total,
+            "roster_version": roster_version, "source": os.path.basename(video_path)}
+    timeline = RecognitionTimeline(frames, offsets, np.rint(np.asarray(boxes, dtype=np.float64).reshape(-1, 4)),
+                                   students, scores, student_ids, names, meta)
+    timeline.save(timeline_path(video_hash))
+    logging.info(f"Đã lưu dòng thời gian nhận diện ({len(frames)} khung, {len(students)} khuôn mặt) "
+                 f"cho {os.path.basename(video_path)}.")
+    if progress is not None:
+        progress(total, total)
+    return timeline
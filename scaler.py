@@ -1,6 +1,9 @@
 # scaler.py
 
+from collections import namedtuple
+
 import cv2
+import numpy as np
 
 class FixedScaler:
     def __init__(self, target_width=640):
@@ -41,3 +44,60 @@ class FixedScaler:
         """Click từ ảnh nhỏ về ảnh gốc"""
         s = 1.0 / self.scale_ratio
         return int(x * s), int(y * s)
+
+
+class BoxLayout(namedtuple("BoxLayout", ["results", "boxes"])):
+    """
+    Các hộp của một khung hình trong không gian hiển thị: boxes là mảng int32 (N, 4) dạng
+    (x1, y1, x2, y2), hàng i ứng với results[i]. Dùng chung cho vẽ và xác định click.
+    """
+    __slots__ = ()
+
+    def hit_test(self, x, y):
+        """Kết quả đầu tiên có hộp chứa điểm (x, y), hoặc None."""
+        if not len(self.boxes):
+            return None
+        boxes = self.boxes
+        inside = (boxes[:, 0] < x) & (x < boxes[:, 2]) & (boxes[:, 1] < y) & (y < boxes[:, 3])
+        hits = np.flatnonzero(inside)
+        return self.results[hits[0]] if len(hits) else None
+
+
+class DisplayTransform:
+    """
+    Phép biến đổi affine từ không gian nhận diện (ảnh đã thu nhỏ RESIZE_FACTOR) sang không gian hiển thị
+    (ảnh đã thu nhỏ theo FixedScaler rồi lật ngang):  x' = W - s * x,  y' = s * y,  s = scale_ratio / RESIZE_FACTOR.
+    Áp dụng cho cả mảng hộp một lần; kết quả của lần gọi gần nhất được giữ lại để dùng lại cho cùng khung hình.
+    """
+    def __init__(self, scale=1.0, display_width=0):
+        self.matrix = np.zeros((2, 3), dtype=np.float64)
+        self.set_params(scale, display_width)
+        self._layout = BoxLayout([], np.empty((0, 4), dtype=np.int32))
+        self._layout_source = None
+        self._layout_params = None
+
+    def set_params(self, scale, display_width):
+        self.matrix[:] = ((-scale, 0.0, display_width), (0.0, scale, 0.0))
+
+    def transform_boxes(self, locations):
+        """Mảng (N, 4) các (top, right, bottom, left) -> mảng int32 (N, 4) các (x1, y1, x2, y2) đã lật."""
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 4)
+        # Hai góc (left, top) và (right, bottom) của mỗi hộp, biến đổi cùng lúc
+        corners = locations[:, [3, 0, 1, 2]].reshape(-1, 2, 2)
+        points = corners @ self.matrix[:, :2].T + self.matrix[:, 2]
+        x = np.sort(points[:, :, 0], axis=1)   # Lật ngang đảo thứ tự trái/phải
+        y = np.sort(points[:, :, 1], axis=1)
+        return np.floor(np.stack([x[:, 0], y[:, 0], x[:, 1], y[:, 1]], axis=1)).astype(np.int32)
+
+    def layout(self, results, scale, display_width):
+        """BoxLayout cho results; tính lại chỉ khi danh sách kết quả hoặc thông số hiển thị đổi."""
+        params = (scale, display_width)
+        if results is self._layout_source and params == self._layout_params:
+            return self._layout
+        self.set_params(scale, display_width)
+        valid = [r for r in results if r.get("location")]
+        boxes = self.transform_boxes([r["location"] for r in valid])
+        self._layout = BoxLayout(valid, boxes)
+        self._layout_source = results
+        self._layout_params = params
+        return self._layout
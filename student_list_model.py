@@ -0,0 +1,205 @@
+# student_list_model.py
+"""
+Model Qt cho danh sách học sinh, thay cho việc xóa và tạo lại QListWidgetItem mỗi lần kết quả đổi:
+- RecognizedFacesModel: các khuôn mặt trong khung hình hiện tại, chỉ chèn/xóa những hàng thay đổi,
+  tra hàng theo id trong O(1);
+- RosterModel + RosterFilterModel: toàn bộ học sinh đã đăng ký, tìm theo tên/mã/lớp (không phân biệt
+  hoa thường và dấu tiếng Việt). QListView chỉ vẽ các hàng đang hiện nên vẫn mượt với hàng nghìn học sinh;
+  ảnh thu nhỏ của mỗi hàng cũng chỉ được giải mã khi hàng hiện ra (LRU của image_store).
+"""
+import unicodedata
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QSortFilterProxyModel
+from PyQt5.QtGui import QColor, QImage, QPixmap
+
+IdRole = Qt.UserRole
+SearchRole = Qt.UserRole + 1
+ROW_HEIGHT = 80
+STRANGER_NAME = "Người lạ"
+
+
+def normalize_search_text(text):
+    """Chữ thường, bỏ dấu tiếng Việt (kể cả đ -> d) để tìm kiếm."""
+    text = unicodedata.normalize("NFD", str(text).lower().replace("đ", "d"))
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def format_student_text(student_id, student):
+    """Nội dung hiển thị của một hàng (giữ định dạng của danh sách cũ)."""
+    name = student.get("name", "") if student else STRANGER_NAME
+    student_class = student.get("class", "") if student else ""
+    return (
+        "--------------------\n"
+        f"ID: {'N/A' if student_id is None else student_id}\n"
+        f"Họ và tên: {name}\n"
+        f"Lớp: {student_class}\n"
+        "--------------------"
+    )
+
+
+class RecognizedFacesModel(QAbstractListModel):
+    """
+    Mỗi hàng là một học sinh (khóa = id) hoặc một người lạ (khóa = ("stranger", k)) trong khung hình hiện tại.
+    Hàng đã có giữ nguyên vị trí, nên lựa chọn của người dùng không bị mất khi kết quả cập nhật.
+    """
+    def __init__(self, students_dict=None, parent=None):
+        super().__init__(parent)
+        self._students = students_dict or {}
+        self._keys = []
+        self._rows = {}     # khóa -> hàng
+        self._texts = {}    # khóa -> chuỗi hiển thị đã định dạng
+        self._results = {}  # khóa -> kết quả nhận diện mới nhất của hàng
+
+    @staticmethod
+    def _student_id(key):
+        return None if isinstance(key, tuple) else key
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._keys)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._keys):
+            return None
+        key = self._keys[index.row()]
+        student_id = self._student_id(key)
+        if role == Qt.DisplayRole:
+            text = self._texts.get(key)
+            if text is None:
+                text = self._texts[key] = format_student_text(student_id, self._students.get(student_id))
+            return text
+        if role == IdRole:
+            return student_id
+        if role == Qt.ForegroundRole and student_id is None:
+            return QColor(Qt.red)
+        if role == Qt.SizeHintRole:
+            return QSize(0, ROW_HEIGHT)
+        return None
+
+    def row_of(self, student_id):
+        """Hàng của học sinh student_id, hoặc None."""
+        return self._rows.get(student_id)
+
+    def result_at(self, row):
+        """Kết quả nhận diện (dict có "location") của hàng, hoặc None."""
+        if 0 <= row < len(self._keys):
+            return self._results.get(self._keys[row])
+        return None
+
+    def row_of_result(self, result):
+        """Hàng hiển thị một kết quả nhận diện (kể cả người lạ, tra theo vị trí), hoặc None."""
+        if result.get("id") is not None:
+            return self.row_of(result["id"])
+        location = result.get("location")
+        return next((self._rows[key] for key, r in self._results.items()
+                     if r.get("location") == location and key in self._rows), None)
+
+    def set_results(self, results):
+        """Cập nhật theo kết quả nhận diện mới; chỉ các hàng bị thêm/bớt mới phát tín hiệu."""
+        new_keys = []
+        seen = set()
+        strangers = 0
+        results_by_key = {}
+        for result in results:
+            student_id = result.get("id")
+            if student_id is None:
+                key = ("stranger", strangers)
+                strangers += 1
+            elif student_id in seen:
+                continue
+            else:
+                key = student_id
+            seen.add(key)
+            new_keys.append(key)
+            results_by_key[key] = result
+        self._results = results_by_key
+        if new_keys == self._keys:
+            return
+
+        # Xóa các hàng không còn, từ dưới lên để chỉ số phía trên không đổi
+        for row in range(len(self._keys) - 1, -1, -1):
+            if self._keys[row] not in seen:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self._keys[row]
+                self.endRemoveRows()
+        # Thêm các hàng mới vào cuối trong một lần
+        existing = set(self._keys)
+        added = [key for key in new_keys if key not in existing]
+        if added:
+            first = len(self._keys)
+            self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+            self._keys.extend(added)
+            self.endInsertRows()
+        self._rows = {key: row for row, key in enumerate(self._keys)}
+
+    def set_students(self, students_dict):
+        """Danh sách học sinh thay đổi (thêm/sửa/xóa): định dạng lại các hàng đang hiển thị."""
+        self._students = students_dict or {}
+        self._texts.clear()
+        if self._keys:
+            self.dataChanged.emit(self.index(0), self.index(len(self._keys) - 1), [Qt.DisplayRole])
+
+    def clear(self):
+        self.set_results([])
+
+
+def thumbnail_pixmap(image):
+    """QPixmap từ ảnh BGR (numpy) của ImageStore.thumbnail; QPixmap giữ bản sao dữ liệu."""
+    h, w = image.shape[:2]
+    return QPixmap.fromImage(QImage(image.data, w, h, 3 * w, QImage.Format_BGR888))
+
+
+class RosterModel(QAbstractListModel):
+    """
+    Toàn bộ học sinh đã đăng ký (danh sách dict như database_manager.get_all_students).
+    Có image_store thì mỗi hàng kèm ảnh thu nhỏ (DecorationRole).
+    """
+    def __init__(self, students=None, parent=None, image_store=None):
+        super().__init__(parent)
+        self._image_store = image_store
+        self._students = []
+        self._search = []
+        self._texts = {}
+        self.set_students(students or [])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._students)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._students):
+            return None
+        row = index.row()
+        student = self._students[row]
+        if role == Qt.DisplayRole:
+            text = self._texts.get(row)
+            if text is None:
+                text = self._texts[row] = format_student_text(student["id"], student)
+            return text
+        if role == IdRole:
+            return student["id"]
+        if role == SearchRole:
+            return self._search[row]
+        if role == Qt.DecorationRole and self._image_store is not None:
+            thumb = self._image_store.thumbnail(student.get("image_path"))
+            return None if thumb is None else thumbnail_pixmap(thumb)
+        if role == Qt.SizeHintRole:
+            return QSize(0, ROW_HEIGHT)
+        return None
+
+    def set_students(self, students):
+        self.beginResetModel()
+        self._students = sorted(students, key=lambda s: (str(s.get("class", "")), str(s.get("name", ""))))
+        self._search = [normalize_search_text(f"{s['id']} {s.get('name', '')} {s.get('class', '')}")
+                        for s in self._students]
+        self._texts = {}
+        self.endResetModel()
+
+
+class RosterFilterModel(QSortFilterProxyModel):
+    """Lọc RosterModel theo chuỗi tìm kiếm đã chuẩn hóa (SearchRole)."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFilterRole(SearchRole)
+        self.setFilterCaseSensitivity(Qt.CaseInsensitive)
+
+    def set_search_text(self, text):
+        self.setFilterFixedString(normalize_search_text(text.strip()))
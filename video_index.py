@@ -0,0 +1,104 @@
+# video_index.py
+"""
+Tua video nhanh trên VideoCapture:
+- FrameCache: LRU các khung hình đã giải mã quanh vị trí hiện tại, để kéo thanh tua qua lại không phải giải mã lại;
+- FrameSeeker: bọc VideoCapture, lấy khung cần từ cache nếu có; tua tiến một đoạn ngắn (<= VIDEO_SEEK_FORWARD_LIMIT)
+  thì giải mã tiến từ vị trí hiện tại, còn lại đặt thẳng cap.set(CAP_PROP_POS_FRAMES, target).
+
+Giới hạn: với backend FFmpeg, CAP_PROP_POS_FRAMES tự tua về keyframe gần nhất phía trước rồi giải mã tiến đến
+khung cần, nên ngoài cache (và việc không tua lại khi chỉ nhảy tiến vài khung) không có cách nào tua nhanh hơn
+cap.set mà không giải mã phần cứng; một lần tua xa vẫn tốn chi phí giải mã từ keyframe đến khung cần.
+"""
+from collections import OrderedDict
+
+import cv2
+
+from config import VIDEO_FRAME_CACHE_SIZE, VIDEO_SEEK_FORWARD_LIMIT
+
+
+class FrameCache:
+    """LRU các khung hình đã giải mã, khóa theo số thứ tự khung hình."""
+    def __init__(self, capacity=VIDEO_FRAME_CACHE_SIZE):
+        self.capacity = capacity
+        self._frames = OrderedDict()
+
+    def get(self, frame_number):
+        frame = self._frames.get(frame_number)
+        if frame is not None:
+            self._frames.move_to_end(frame_number)
+        return frame
+
+    def put(self, frame_number, frame):
+        if self.capacity <= 0:
+            return
+        self._frames[frame_number] = frame
+        self._frames.move_to_end(frame_number)
+        while len(self._frames) > self.capacity:
+            self._frames.popitem(last=False)
+
+    def clear(self):
+        self._frames.clear()
+
+
+class FrameSeeker:
+    """
+    Đọc tuần tự và tua trên một VideoCapture. Không an toàn đa luồng: chỉ gọi từ luồng sở hữu cap.
+    position là số thứ tự khung hình mà cap.read() kế tiếp sẽ trả về; next_frame là khung hình
+    mà read() kế tiếp cần trả về (khác position sau khi tua trúng cache).
+    """
+    def __init__(self, cap, cache_size=VIDEO_FRAME_CACHE_SIZE, forward_limit=VIDEO_SEEK_FORWARD_LIMIT):
+        self.cap = cap
+        self.cache = FrameCache(cache_size)
+        self.forward_limit = forward_limit
+        self.position = 0
+        self.next_frame = 0
+
+    def read(self):
+        """Đọc khung hình kế tiếp (như cap.read()) và đưa vào cache."""
+        if self.next_frame != self.position:
+            frame = self.cache.get(self.next_frame)
+            if frame is not None:
+                self.next_frame += 1
+                return True, frame
+            self._move_to(self.next_frame)
+        ret, frame = self.cap.read()
+        if ret:
+            self.cache.put(self.position, frame)
+            self.position += 1
+            self.next_frame = self.position
+        return ret, frame
+
+    def read_at(self, frame_number):
+        """Tua đến frame_number và trả về (ret, frame); lần read() sau trả về khung hình tiếp theo."""
+        frame_number = max(0, frame_number)
+        frame = self.cache.get(frame_number)
+        if frame is not None:
+            self.next_frame = frame_number + 1
+            return True, frame
+        self.next_frame = frame_number
+        return self.read()
+
+    def set_position(self, frame_number):
+        """Chỉ đặt khung hình mà read() kế tiếp trả về; việc tua thật diễn ra khi đọc."""
+        self.next_frame = max(0, frame_number)
+
+    def _move_to(self, target):
+        """Đặt cap để lần read() kế tiếp trả về khung hình target."""
+        if not 0 <= target - self.position <= self.forward_limit:
+            # Tua lùi hoặc tua xa: OpenCV tự tua về keyframe và giải mã tiến bên trong
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            self.position = target
+            return
+        # Nhảy tiến ngắn: giải mã tiến (không tua lại keyframe); vài khung ngay trước target được giữ lại
+        # để kéo lùi một chút vẫn trúng cache
+        keep_from = target - self.cache.capacity // 2
+        while self.position < target:
+            if self.position >= keep_from:
+                ret, frame = self.cap.read()
+                if ret:
+                    self.cache.put(self.position, frame)
+            else:
+                ret = self.cap.grab()
+            if not ret:
+                break
+            self.position += 1